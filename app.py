@@ -1,55 +1,885 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_request_context, Response, stream_with_context, make_response
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
+import io
+import csv
+import json
+import base64
+import hashlib
+import hmac
+import click
 import jwt
+import random
+import threading
+import time
 from functools import wraps
+from mirror import Mirror, ReservationRecord, GroupRecord, time_of, version_of, waiting_key
+from changefeed import ChangeFeed
+from scheduler import VipScheduler
+import events
+import grouping
+import metrics
+import payload
+import storage
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['ETag', 'X-Firestore-Reads', 'X-Firestore-Writes', 'X-Firestore-Queries'])
 
 # 環境変数
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
 JWT_SECRET = os.environ.get('JWT_SECRET', 'simple-secret-key')
+MIRROR_ENABLED = os.environ.get('MIRROR_ENABLED', '1') == '1'
+FETCH_BATCH_SIZE = int(os.environ.get('FETCH_BATCH_SIZE', '100'))
+MEMBER_FETCH_WINDOW = 10
+# 1回のカウンター更新でプロセスが確保する予約番号の数（1なら毎回カウンターを更新）
+ID_BLOCK_SIZE = max(1, int(os.environ.get('ID_BLOCK_SIZE', '1')))
+# 変更通知（SSE）: 1接続の最大時間（過ぎたらクライアントがLast-Event-IDで再接続）とハートビート間隔
+STREAM_MAX_SECONDS = int(os.environ.get('STREAM_MAX_SECONDS', '300'))
+STREAM_HEARTBEAT_SECONDS = 15
+STREAM_RETRY_MS = 3000
+# 変更通知の接続用トークンの有効期間（接続時だけ確認する。ログインのトークンはクエリに載せない）
+STREAM_TOKEN_SECONDS = int(os.environ.get('STREAM_TOKEN_SECONDS', '60'))
+# 一覧のページング・エクスポートでFirestoreから1回に読む件数
+EXPORT_PAGE_SIZE = 500
+MAX_PAGE_LIMIT = 500
+# 一括取り込み: 1回のコミットの最大書き込み数（Firestoreの上限）と1回に取り込める行数
+IMPORT_BATCH_WRITES = 500
+MAX_IMPORT_ROWS = 20000
+# トランザクションが競合したときの最大試行回数とバックオフ（秒、試行ごとに倍にしてランダムに待つ）
+TRANSACTION_MAX_ATTEMPTS = max(1, int(os.environ.get('TRANSACTION_MAX_ATTEMPTS', '5')))
+TRANSACTION_BACKOFF_SECONDS = 0.05
+TRANSACTION_BACKOFF_MAX_SECONDS = 1.0
+# 関係者予約（X/Y）の割り当て: バックグラウンドのスケジューラを動かすか、/internal/tick 用のトークン
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', '1') == '1'
+TICK_TOKEN = os.environ.get('TICK_TOKEN', '')
+# /metrics をPrometheusから読むためのトークン（Authorization: Bearer、未設定なら管理者のトークンだけ）
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+VIP_LEAD_MINUTES = 5
+# グループの定員（"4" または "2025-11-01=4,2025-11-02=5"）と、予約を入れるグループの選び方（first-fit / best-fit）
+group_capacity = grouping.parse_capacity(os.environ.get('GROUP_CAPACITY'))
+GROUP_STRATEGY = grouping.get_strategy(os.environ.get('GROUP_STRATEGY', 'first-fit'))
 
-# Firebase初期化
+# 保存先: firestore（既定）/ memory（プロセス内、負荷試験用）/ sqlite（SQLITE_PATHのファイル）
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'local.db')
+
+# 変換値（Increment など）・transactional（ローカルのエンジンではstorageの互換実装）
+# firebase_adminのimportとgRPCの準備は重いので、起動時ではなくFirestoreに接続するとき（set_db）に差し替える
+firestore = storage
+
+# Firebase初期化（最初に使うとき、またはウォームアップでinit_dbが接続する）
+# 失敗した場合（認証情報の取得・ネットワークの一時的なエラーなど）はDB_RETRY_SECONDS後の呼び出しでやり直す
+DB_RETRY_SECONDS = 10
 db = None
-try:
-    import firebase_admin
-    from firebase_admin import credentials, firestore
-    
-    if os.path.exists('firebase-key.json'):
-        cred = credentials.Certificate('firebase-key.json')
-        firebase_admin.initialize_app(cred)
-        db = firestore.client()
-        print("✅ Firebase OK")
+_db_lock = threading.Lock()
+_db_retry_at = 0
+# 起動の各段階にかかった時間（秒）
+startup_timings = {}
+
+def init_db():
+    global _db_retry_at
+    if db is not None or time.monotonic() < _db_retry_at:
+        return db
+    with _db_lock:
+        if db is not None or time.monotonic() < _db_retry_at:
+            return db
+        started = time.perf_counter()
+        try:
+            if STORAGE_BACKEND in ('memory', 'sqlite'):
+                set_db(storage.create_client(STORAGE_BACKEND, SQLITE_PATH))
+                print(f"✅ Local storage OK ({STORAGE_BACKEND})")
+            else:
+                import firebase_admin
+                from firebase_admin import credentials, firestore as firebase_firestore
+                
+                if os.path.exists('firebase-key.json'):
+                    # 前回の失敗でアプリだけ初期化済みの場合はそれを使う
+                    try:
+                        firebase_admin.get_app()
+                    except ValueError:
+                        firebase_admin.initialize_app(credentials.Certificate('firebase-key.json'))
+                    set_db(firebase_firestore.client())
+                    print("✅ Firebase OK")
+                else:
+                    print("❌ No firebase-key.json")
+        except Exception as e:
+            print(f"❌ Storage error: {e}")
+            import traceback
+            traceback.print_exc()
+        if db is None:
+            _db_retry_at = time.monotonic() + DB_RETRY_SECONDS
+            print(f"Retrying storage connection in {DB_RETRY_SECONDS}s")
+        startup_timings['connect'] = round(time.perf_counter() - started, 4)
+        return db
+
+# 作成済みのクライアントを使う（init_dbのほか、エミュレーターに接続する負荷試験などから）
+def set_db(client):
+    global db, firestore
+    if isinstance(client, storage.BaseClient):
+        firestore = storage
+    else:
+        from firebase_admin import firestore as firebase_firestore
+        firestore = firebase_firestore
+    db = metrics.instrument(client)
+    return db
+
+# リクエストごとのFirestore操作数の計測と /metrics
+# FIRESTORE_DEBUG_HEADERS=1（またはデバッグ実行）でレスポンスに X-Firestore-Reads などを付ける
+# /metrics は認証が必要（METRICS_TOKEN または管理者のトークン）
+metrics.init_app(app, debug_headers=os.environ.get('FIRESTORE_DEBUG_HEADERS') == '1',
+                 check_auth=lambda: check_metrics_auth())
+
+# JSONの高速な書き出し（orjson）とgzip / brotli圧縮
+payload.init_app(app)
+
+# 開催日と予約番号の種別・保存先（EVENT_DAYS / STORAGE_LAYOUT、詳しくは events.py）
+EVENT_ID = os.environ.get('EVENT_ID', 'default')
+registry = events.Registry.parse(EVENT_ID, os.environ.get('EVENT_DAYS'), os.environ.get('STORAGE_LAYOUT', 'legacy'))
+
+GROUP_COLLECTIONS = [day.groups for day in registry.days]
+GROUP_DATES = {day.groups: day.date for day in registry.days}
+RESERVATION_PREFIXES = registry.prefixes
+DEFAULT_DATE = registry.default_date
+
+# 予約番号の先頭文字から開催日を引く（登録されていない種別は最後の日）
+def day_of_reservation(res_id):
+    return registry.day_of_id(res_id) or registry.days[-1]
+
+# 予約の日付を判定（dateがない旧データはIDの先頭文字から）
+def reservation_date(res_id, data):
+    if data.get('date'):
+        return data['date']
+    return day_of_reservation(res_id).date
+
+# 日付のグループのコレクション（登録されていない日付はValueError）
+def group_collection_for(date):
+    day = registry.day(date)
+    if day is None:
+        raise ValueError(f"Unknown date: {date}")
+    return day.groups
+
+# 登録されていない日付のエラーのレスポンス（登録されていればNone）
+def check_date(date):
+    if registry.day(date) is None:
+        return jsonify({'error': f'Unknown date: {date}'}), 400
+    return None
+
+# 関係者予約（スケジューラが割り当てる種別）か
+def is_vip_type(res_type):
+    return registry.kind(res_type) == 'vip'
+
+# 予約ドキュメントの参照（partitionedでは開催日のコレクション）
+def reservation_ref(res_id, client=None):
+    return (client or db).collection(day_of_reservation(res_id).reservations).document(res_id)
+
+# 指定日の予約のクエリ（legacyは全日付のコレクションをdateで絞り込む）
+def day_reservations_query(client, date):
+    day = registry.day(date)
+    if day is None:
+        return client.collection(registry.days[0].reservations).where('date', '==', date)
+    query = client.collection(day.reservations)
+    return query.where('date', '==', date) if day.shared else query
+
+# 全日付の予約（コレクションごとに読む）
+def stream_all_reservations():
+    for path in registry.reservation_collections():
+        yield from db.collection(path).stream()
+
+# 統計ドキュメントの参照
+def stats_ref(date):
+    day = registry.day(date)
+    return db.document(day.stats) if day is not None else db.collection('stats').document(date)
+
+# ミラーが受け取った変更の配信用（/api/admin/stream）
+change_feed = ChangeFeed()
+
+# ミラーの変更を配信用の小さな差分にする
+def publish_change(kind, old, new):
+    if kind == 'settings':
+        change_feed.publish('settings', None, {key: new.get(key, False) for key in ('reception', 'joukyou', 'jidou')})
+    elif kind == 'reservation':
+        record = new or old
+        data = {'id': record.id}
+        if new is None:
+            data['removed'] = True
+        else:
+            data.update({'status': new.status, 'group': new.group, 'priority': new.priority, 'count': new.count})
+        change_feed.publish('reservation', record.date, data)
+    else:
+        record = new or old
+        data = {'collection': kind, 'number': record.number}
+        if new is None:
+            data['removed'] = True
+        else:
+            data.update({'status': new.status, 'head_count': new.head_count})
+        change_feed.publish('group', GROUP_DATES.get(kind), data)
+
+# ミラーが受け取った変更（他のインスタンスで作られた関係者予約もスケジューラに登録する）
+def on_mirror_change(kind, old, new):
+    publish_change(kind, old, new)
+    if kind == 'reservation' and new is not None:
+        schedule_vip(new)
+
+# 予約・グループのミラー（プロセス内で共有）
+_mirror = None
+_mirror_lock = threading.Lock()
+_mirror_restarted_at = 0
+
+def get_mirror():
+    global _mirror, _mirror_restarted_at
+    if not MIRROR_ENABLED or db is None:
+        return None
+    if _mirror is not None and _mirror.is_ready():
+        return _mirror
+    with _mirror_lock:
+        if _mirror is not None and _mirror.is_ready():
+            return _mirror
+        # リスナーが切れていたら作り直す（30秒に1回まで）
+        now = datetime.now().timestamp()
+        if now - _mirror_restarted_at < 30:
+            return None
+        _mirror_restarted_at = now
+        try:
+            restarted = _mirror is not None
+            if restarted:
+                _mirror.stop()
+            mirror = Mirror(reservation_date, GROUP_COLLECTIONS, on_change=on_mirror_change,
+                            reservation_collections=registry.reservation_collections())
+            _mirror = mirror
+            if mirror.start(db):
+                # 作り直す間の変更は配信できていないので、接続中のクライアントに全件の再取得を促す
+                if restarted:
+                    change_feed.publish('reset', None, {})
+                return mirror
+            print("⚠️ Mirror not ready, falling back to Firestore reads")
+        except Exception as e:
+            print(f"Error starting mirror: {e}")
+        return None
+
+# 指定日の予約を取得（ミラーが使えない場合はFirestoreのクエリで絞り込む）
+# status / priority: 一致するもの, group_after: グループ番号がそれより大きいもの, max_count: 人数がそれ以下のもの
+# legacyではdateフィールドで絞り込むので、旧データは flask backfill-dates で移行しておく（partitionedは開催日のコレクションだけを読む）
+def list_reservations(date, status=None, priority=None, group_after=None, max_count=None):
+    mirror = get_mirror()
+    if mirror is not None:
+        # next-groupが毎回確認する待機中の優先予約は、ミラーが別に持っている
+        if status == 0 and priority is True and group_after is None and max_count is None:
+            return mirror.priority_reservations(date)
+        result = mirror.reservations(date)
+        if status is not None:
+            result = [res for res in result if res.status == status]
+        if priority is not None:
+            result = [res for res in result if res.priority == priority]
+        if group_after is not None:
+            result = [res for res in result if isinstance(res.group, int) and res.group > group_after]
+        if max_count is not None:
+            result = [res for res in result if res.count <= max_count]
+        return result
+    
+    query = reservations_query(db, date, status, priority, group_after, max_count)
+    return [ReservationRecord(doc.id, date, doc.to_dict()) for doc in query.stream()]
+
+# list_reservationsのFirestoreクエリ（clientは同期・非同期どちらのクライアントでもよい）
+def reservations_query(client, date, status=None, priority=None, group_after=None, max_count=None):
+    query = day_reservations_query(client, date)
+    if status is not None:
+        query = query.where('status', '==', status)
+    if priority is not None:
+        query = query.where('priority', '==', priority)
+    if group_after is not None:
+        query = query.where('group', '>', group_after)
+    if max_count is not None:
+        query = query.where('count', '<=', max_count)
+    return query
+
+# 指定日の予約のうちsince（バージョン）より後に変わったものを取得
+# 戻り値: (予約, 削除された予約ID, 新しいバージョン)。sinceがNoneなら全件
+def list_reservations_since(date, since=None):
+    mirror = get_mirror()
+    if mirror is not None:
+        return mirror.reservations_since(date, since)
+    
+    query = day_reservations_query(db, date)
+    if since is not None:
+        query = query.where('updated_at', '>', time_of(since))
+    
+    # 読み取り時刻までのコミットはすべて含まれているので、それを新しいバージョンにする
+    records = []
+    version = since or 0
+    for doc in query.stream():
+        records.append(ReservationRecord(doc.id, date, doc.to_dict(), doc.update_time))
+        version = max(version, version_of(doc.read_time))
+    return records, [], version
+
+# 一覧の並び順（グループ番号順で未割り当ては最後、同じグループ内は登録順）
+def reservation_sort_key(res):
+    return (res.group is None, res.group or 0, res.created_at or '', res.id)
+
+# ページングのカーソル（直前の予約の (group, created_at, id)）
+def encode_cursor(res):
+    raw = json.dumps([res.group, res.created_at, res.id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    group, created_at, res_id = json.loads(raw)
+    return group, created_at, res_id
+
+# 指定日の予約を一覧の並び順でFirestoreから少しずつ読み込む（afterはdecode_cursorの値）
+# 1回のクエリは page_size 件までなので、件数が多くても長時間のストリームやメモリの増加にならない
+def iter_reservations_ordered(date, after=None, page_size=EXPORT_PAGE_SIZE):
+    base = day_reservations_query(db, date)
+    # グループ割り当て済み → 未割り当て（group=None）の順
+    phases = [
+        ('group', base.where('group', '>', 0).order_by('group').order_by('created_at').order_by('__name__')),
+        ('none', base.where('group', '==', None).order_by('created_at').order_by('__name__'))
+    ]
+    if after is not None and after[0] is None:
+        phases = phases[1:]
+    
+    for phase, query in phases:
+        cursor = None
+        if after is not None:
+            group, created_at, res_id = after
+            if phase == 'group' and group is not None:
+                cursor = {'group': group, 'created_at': created_at, '__name__': res_id}
+            elif phase == 'none' and group is None:
+                cursor = {'created_at': created_at, '__name__': res_id}
+        
+        while True:
+            page = query.start_after(cursor) if cursor is not None else query
+            docs = list(page.limit(page_size).stream())
+            for doc in docs:
+                yield ReservationRecord(doc.id, date, doc.to_dict(), doc.update_time)
+            if len(docs) < page_size:
+                break
+            last = docs[-1].to_dict()
+            cursor = {'created_at': last.get('created_at'), '__name__': docs[-1].id}
+            if phase == 'group':
+                cursor['group'] = last.get('group')
+
+# 1ページ分の予約と次のカーソル
+def list_reservations_page(date, limit, after=None):
+    mirror = get_mirror()
+    if mirror is not None:
+        records = sorted(mirror.reservations(date), key=reservation_sort_key)
+        if after is not None:
+            group, created_at, res_id = after
+            after_key = (group is None, group or 0, created_at or '', res_id)
+            records = [res for res in records if reservation_sort_key(res) > after_key]
+        page = records[:limit + 1]
     else:
-        print("❌ No firebase-key.json")
-except Exception as e:
-    print(f"❌ Firebase error: {e}")
+        page = []
+        for res in iter_reservations_ordered(date, after, page_size=limit + 1):
+            page.append(res)
+            if len(page) > limit:
+                break
+    
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+# 全予約を取得
+def list_all_reservations():
+    mirror = get_mirror()
+    if mirror is not None:
+        return mirror.all_reservations()
+    return [ReservationRecord(doc.id, reservation_date(doc.id, doc.to_dict()), doc.to_dict())
+            for doc in stream_all_reservations()]
+
+# グループ一覧を取得（数値でないIDは除外、statusを指定すればその状態のものだけ）
+def list_groups(group_collection, status=None):
+    mirror = get_mirror()
+    if mirror is not None:
+        groups = mirror.groups(group_collection)
+        return groups if status is None else [group for group in groups if group.status == status]
+    query = db.collection(group_collection)
+    if status is not None:
+        query = query.where('status', '==', status)
+    result = []
+    for group_doc in query.stream():
+        try:
+            result.append(GroupRecord(int(group_doc.id), group_doc.to_dict()))
+        except ValueError:
+            continue
+    return result
+
+# リクエスト内で読んだ予約のキャッシュ
+def _request_cache():
+    if not has_request_context():
+        return {}
+    if 'reservation_cache' not in g:
+        g.reservation_cache = {}
+    return g.reservation_cache
+
+# 予約をまとめて取得（get_allで一括読み込み、同じリクエスト内では重複して読まない）
+def fetch_reservations(res_ids):
+    res_ids = list(dict.fromkeys(res_ids))
+    mirror = get_mirror()
+    if mirror is not None:
+        result = {}
+        for r_id in res_ids:
+            record = mirror.reservation(r_id)
+            if record is not None:
+                result[r_id] = record
+        return result
+    
+    cache = _request_cache()
+    missing = [r_id for r_id in res_ids if r_id not in cache]
+    for start in range(0, len(missing), FETCH_BATCH_SIZE):
+        refs = [reservation_ref(r_id) for r_id in missing[start:start + FETCH_BATCH_SIZE]]
+        for doc in db.get_all(refs):
+            if doc.exists:
+                data = doc.to_dict()
+                cache[doc.id] = ReservationRecord(doc.id, reservation_date(doc.id, data), data)
+            else:
+                cache[doc.id] = None
+    return {r_id: cache[r_id] for r_id in res_ids if cache.get(r_id) is not None}
+
+# 複数ドキュメントの書き込みを1回のコミットにまとめる（ミラーにも反映）
+# transactionを渡した場合はトランザクションに書き込み、commit()はトランザクションのコミット後にミラーへ反映するだけ
+class BatchWriter:
+    def __init__(self, transaction=None):
+        self.transaction = transaction
+        self._batch = transaction if transaction is not None else db.batch()
+        self._writes = []
+    
+    def _add(self, op, collection, doc_id, data):
+        # 差分取得（since=）用に、書き込みごとにコミット時刻を記録
+        data = dict(data, updated_at=firestore.SERVER_TIMESTAMP)
+        if collection == 'reservation':
+            ref = reservation_ref(doc_id)
+        else:
+            ref = db.collection(collection).document(str(doc_id))
+        if op == 'set':
+            self._batch.set(ref, data)
+        else:
+            self._batch.update(ref, data)
+        self._writes.append((op, collection, doc_id, data))
+    
+    def set_reservation(self, res_id, data):
+        self._add('set', 'reservation', res_id, data)
+    
+    def update_reservation(self, res_id, fields):
+        self._add('update', 'reservation', res_id, fields)
+    
+    def set_group(self, group_collection, group_num, data):
+        self._add('set', group_collection, group_num, data)
+    
+    def update_group(self, group_collection, group_num, fields):
+        self._add('update', group_collection, group_num, fields)
+    
+    # 統計ドキュメント（stats_ref）の集計値を増減する（counts: ドット区切りのフィールド → 増減数）
+    def increment_stats(self, date, counts):
+        data = {}
+        for field_path, delta in counts.items():
+            parts = field_path.split('.')
+            node = data
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node[parts[-1]] = firestore.Increment(delta)
+        self._batch.set(stats_ref(date), data, merge=True)
+        self._writes.append(('stats', 'stats', date, data))
+    
+    def commit(self):
+        if not self._writes:
+            return
+        if self.transaction is not None:
+            results = getattr(self.transaction, 'write_results', None)
+        else:
+            results = self._batch.commit()
+        update_time = getattr(results[0], 'update_time', None) if results else None
+        cache = _request_cache()
+        for op, collection, doc_id, data in self._writes:
+            if op == 'stats':
+                continue
+            if collection == 'reservation':
+                cache.pop(doc_id, None)
+            if _mirror is None:
+                continue
+            if collection == 'reservation' and op == 'set':
+                _mirror.set_reservation(doc_id, data, update_time)
+            elif collection == 'reservation':
+                _mirror.update_reservation(doc_id, data, update_time)
+            elif op == 'set':
+                _mirror.set_group(collection, doc_id, data, update_time)
+            else:
+                _mirror.update_group(collection, doc_id, data, update_time)
+        self._writes = []
+
+# グループ1件だけの書き込み
+def update_group(group_collection, group_num, fields):
+    writer = BatchWriter()
+    writer.update_group(group_collection, group_num, fields)
+    writer.commit()
+
+# グループドキュメントに持たせるメンバー情報（人数・状態・優先フラグ）
+def member_summary(count, status=0, priority=False, time=None):
+    summary = {'count': count, 'status': status, 'priority': priority}
+    if time:
+        summary['time'] = time
+    return summary
+
+# グループに予約を追加する変更（人数とメンバー情報も同時に更新）
+# サマリーのない旧データのグループは配列だけ更新し、repair-groupsで作り直す
+def group_join_fields(group, res_id, summary):
+    return group_join_many_fields(group, {res_id: summary})
+
+# 複数の予約をまとめてグループに追加する変更（members: 予約ID → メンバー情報）
+def group_join_many_fields(group, members):
+    fields = {'reservation': firestore.ArrayUnion(list(members))}
+    if group.has_summary():
+        fields['head_count'] = firestore.Increment(sum(summary['count'] for summary in members.values()))
+        for res_id, summary in members.items():
+            fields[f'members.{res_id}'] = summary
+    return fields
+
+# グループから予約を外す変更
+def group_leave_fields(group, res_id, count):
+    fields = {'reservation': firestore.ArrayRemove([res_id])}
+    if group.has_summary():
+        fields['head_count'] = firestore.Increment(-count)
+        fields[f'members.{res_id}'] = firestore.DELETE_FIELD
+    return fields
+
+# 統計の状態区分（来店済み・キャンセル以外は待機中として数える）
+def stats_bucket(status):
+    return {1: 'visited', 2: 'cancelled'}.get(status, 'waiting')
+
+# 時間帯別に数えるイベント（状態 → イベント名）
+STATS_EVENTS = {1: 'visited', 2: 'cancelled', 3: 'absent'}
+
+# 時間帯（by_hourのキー）
+def stats_hour(timestamp=None):
+    try:
+        moment = datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+    except ValueError:
+        return None
+    return moment.strftime('%H')
+
+# 状態が変わったときの統計の増減
+def status_stats_counts(old_status, new_status):
+    counts = {}
+    if old_status == new_status:
+        return counts
+    if stats_bucket(old_status) != stats_bucket(new_status):
+        counts[stats_bucket(old_status)] = -1
+        counts[stats_bucket(new_status)] = 1
+    if new_status in STATS_EVENTS:
+        counts[f'by_hour.{stats_hour()}.{STATS_EVENTS[new_status]}'] = 1
+    return counts
+
+# 予約データから統計を集計する（reservations: (予約ID, データ) の一覧）
+def aggregate_stats(reservations):
+    stats = {'total': 0, 'visited': 0, 'cancelled': 0, 'waiting': 0, 'by_type': {}, 'by_hour': {}}
+    
+    def add_event(timestamp, event):
+        hour = stats_hour(timestamp) if timestamp else None
+        if hour is None:
+            return
+        bucket = stats['by_hour'].setdefault(hour, {})
+        bucket[event] = bucket.get(event, 0) + 1
+    
+    for res_id, data in reservations:
+        res_type = res_id[0] if len(res_id) > 0 else 'X'
+        status = data.get('status', 0)
+        stats['total'] += 1
+        stats[stats_bucket(status)] += 1
+        stats['by_type'][res_type] = stats['by_type'].get(res_type, 0) + 1
+        
+        add_event(data.get('created_at'), 'created')
+        add_event(data.get('absent_at'), 'absent')
+        if status == 1:
+            add_event(data.get('visited_at'), 'visited')
+        elif status == 2:
+            add_event(data.get('cancelled_at'), 'cancelled')
+    return stats
+
+# 比較用に0の集計値と空の内訳を除く（増分で作った統計ドキュメントには、まだ増えていない項目がない）
+def compact_stats(stats):
+    result = {}
+    for key, value in (stats or {}).items():
+        if isinstance(value, dict):
+            value = compact_stats(value)
+        if value:
+            result[key] = value
+    return result
+
+# 予約の状態を変更（所属グループのメンバー情報・統計も同じコミットで更新）
+# writerを渡した場合は書き込みを追加するだけで、コミットは呼び出し側で行う
+def update_reservation_status(res_id, fields, writer=None):
+    res = fetch_reservations([res_id]).get(res_id)
+    own_writer = writer is None
+    if own_writer:
+        writer = BatchWriter()
+    writer.update_reservation(res_id, fields)
+    
+    if res is not None and 'status' in fields:
+        counts = status_stats_counts(res.status, fields['status'])
+        if counts:
+            writer.increment_stats(res.date, counts)
+    
+    if res is not None and res.group and registry.day(res.date) is not None:
+        group_collection = group_collection_for(res.date)
+        group = get_group(group_collection, res.group)
+        if group is not None and group.has_summary() and res_id in group.members:
+            member_fields = {f'members.{res_id}.{key}': value for key, value in fields.items()
+                             if key in ('status', 'priority')}
+            writer.update_group(group_collection, res.group, member_fields)
+    
+    if own_writer:
+        writer.commit()
+
+# グループを1件取得
+def get_group(group_collection, group_num):
+    mirror = get_mirror()
+    if mirror is not None:
+        return mirror.group(group_collection, group_num)
+    group_doc = db.collection(group_collection).document(str(group_num)).get()
+    if not group_doc.exists:
+        return None
+    return GroupRecord(int(group_num), group_doc.to_dict())
+
+# 各グループの現在の人数（サマリーがあればhead_countをそのまま使う）
+def groups_head_counts(groups):
+    legacy = [group for group in groups if not group.has_summary()]
+    members = groups_members(legacy) if legacy else {}
+    counts = {}
+    for group in groups:
+        if group.has_summary():
+            counts[group.number] = group.head_count
+        else:
+            counts[group.number] = sum(m['count'] for m in members[group.number])
+    return counts
+
+# 各グループのメンバー一覧（サマリーがあればグループドキュメントだけで答える）
+# fetched: サマリーのない旧データの予約（予約ID→ReservationRecord）を読み込み済みなら渡す
+def groups_members(groups, fetched=None):
+    if fetched is None:
+        legacy_ids = legacy_member_ids(groups)
+        fetched = fetch_reservations(legacy_ids) if legacy_ids else {}
+    result = {}
+    for group in groups:
+        members = []
+        for r_id in group.reservation:
+            if group.has_summary():
+                summary = group.members.get(r_id)
+                if summary is None:
+                    continue
+                members.append({
+                    'reservation_id': r_id,
+                    'count': summary.get('count', 0),
+                    'type': r_id[0] if len(r_id) > 0 else 'X',
+                    'time': summary.get('time'),
+                    'status': summary.get('status', 0),
+                    'priority': summary.get('priority', False)
+                })
+            elif r_id in fetched:
+                members.append(fetched[r_id].to_member())
+        result[group.number] = members
+    return result
+
+# サマリーのない旧データのグループのメンバー（予約を読み込む必要がある予約ID）
+def legacy_member_ids(groups):
+    return list(dict.fromkeys(r_id for group in groups if not group.has_summary() for r_id in group.reservation))
+
+# 現在のリクエストの認証を確認（問題があればエラーのレスポンス、なければNone）
+def check_auth():
+    if db is None:
+        return jsonify({'error': 'DB not ready'}), 503
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    scope = None
+    # EventSourceはヘッダーを付けられないので、SSEの接続だけクエリのtoken（/api/admin/stream-tokenの短期トークン）も受け付ける
+    if not token and 'text/event-stream' in request.headers.get('Accept', ''):
+        token = request.args.get('token', '')
+        scope = 'stream'
+    if not token:
+        return jsonify({'error': 'No token'}), 401
+    try:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+    except:
+        return jsonify({'error': 'Bad token'}), 401
+    # 接続用トークンはSSEの接続だけ、ログインのトークンはヘッダーだけで使える
+    if claims.get('scope') != scope:
+        return jsonify({'error': 'Bad token'}), 401
+    return None
 
 def require_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        if db is None:
-            return jsonify({'error': 'DB not ready'}), 503
-        token = request.headers.get('Authorization', '').replace('Bearer ', '')
-        if not token:
-            return jsonify({'error': 'No token'}), 401
-        try:
-            jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-        except:
-            return jsonify({'error': 'Bad token'}), 401
+        error = check_auth()
+        if error is not None:
+            return error
         return f(*args, **kwargs)
     return decorated
 
+# 読み取りAPIの条件付きGET（ETag / If-None-Match）
+# ETagはミラーが受け取った変更の連番（日付ごと）とURLから作るので、変わっていなければFirestoreを読まずに304を返す
+# per_date=Falseの場合は日付に関係しないデータ（設定）として扱う
+def conditional_get(per_date=True):
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            etag = None
+            if get_mirror() is not None:
+                date = request.args.get('date', DEFAULT_DATE) if per_date else None
+                url_hash = hashlib.sha1(request.full_path.encode()).hexdigest()[:12]
+                etag = f"{change_feed.epoch}-{change_feed.version(date)}-{url_hash}"
+            
+            # 圧縮したレスポンスのETag（"<ETag>-gz"など）でも一致とみなし、一致したETagを返す
+            matched = payload.matching_etag(request.if_none_match, etag) if etag is not None else None
+            if matched is not None:
+                etag = matched
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if etag is None or response.status_code != 200:
+                    etag = None
+            
+            if etag is not None:
+                response.set_etag(etag)
+            # 毎回確認させる（認証ごとに内容が違う扱いにする）
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Authorization')
+            return response
+        return decorated
+    return decorator
+
 @app.route('/')
 def home():
     return jsonify({'status': 'ok', 'db': db is not None})
 
 @app.route('/health')
 def health():
-    return jsonify({'status': 'ok'})
+    result = {'status': 'ok'}
+    if MIRROR_ENABLED and db is not None:
+        get_mirror()
+        result['mirror'] = _mirror.status() if _mirror is not None else {'ready': False, 'consistent': False}
+    if _scheduler is not None:
+        next_due = _scheduler.next_due()
+        result['scheduler'] = {'pending': _scheduler.pending(), 'next_due': next_due.isoformat() if next_due else None}
+    return jsonify(result)
+
+# --- 起動直後の準備（ウォームアップ） ---
+# Cloud Runのスタートアッププローブで /ready を見れば、準備が終わるまでリクエストが来ない
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+_warmup_done = threading.Event()
+
+def start_warmup():
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=warm_up, name='warmup', daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread
+
+def _timed(name, func):
+    started = time.perf_counter()
+    try:
+        return func()
+    finally:
+        startup_timings[name] = round(time.perf_counter() - started, 4)
+
+# 接続、gRPCチャネルの確立（設定を1件読む）、当日分の予約・グループの読み込み（ミラー）、スケジューラの起動
+def warm_up():
+    started = time.perf_counter()
+    try:
+        if init_db() is not None:
+            _timed('channel', lambda: db.collection('settings').document('base').get())
+            _timed('mirror', get_mirror)
+            _timed('scheduler', get_scheduler)
+    except Exception as e:
+        print(f"Error in warm-up: {e}")
+    finally:
+        startup_timings['warmup'] = round(time.perf_counter() - started, 4)
+        _warmup_done.set()
+        print(f"✅ Warm-up finished in {startup_timings['warmup']}s")
+
+# 起動の準備ができたか（準備中・接続できない場合は503。/healthは起動中でも200を返す）
+@app.route('/ready')
+def ready():
+    start_warmup()
+    if not _warmup_done.is_set():
+        return jsonify({'status': 'starting'}), 503
+    # ウォームアップで接続できなかった場合も、DB_RETRY_SECONDSごとにやり直す
+    if init_db() is None:
+        return jsonify({'status': 'error', 'error': 'DB not ready'}), 503
+    result = {'status': 'ready', 'timings': startup_timings}
+    if MIRROR_ENABLED:
+        result['mirror'] = _mirror is not None and _mirror.is_ready()
+    return jsonify(result)
+
+# SSEの1イベント
+def sse_event(event_id, kind, data):
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+# 予約・グループ・設定の変更通知（Server-Sent Events）
+# 再接続時はLast-Event-ID（またはlast_event_id）の続きから送る。続きが送れない場合はresetを送る
+@app.route('/api/admin/stream', methods=['GET'])
+@require_auth
+def stream():
+    date = request.args.get('date')
+    if get_mirror() is None:
+        return jsonify({'error': 'Stream not available'}), 503
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    seq = change_feed.parse_event_id(last_event_id) if last_event_id else change_feed.last_seq
+    
+    # ASGI（asgi.py）で動かしている場合は切断を知らせるイベントがある（WSGIでは最大時間まで送り続ける）
+    disconnected = request.environ.get('asgi.scope', {}).get('disconnected')
+    
+    def generate():
+        current = seq
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        
+        deadline = datetime.now().timestamp() + STREAM_MAX_SECONDS
+        while datetime.now().timestamp() < deadline:
+            if disconnected is not None and disconnected.is_set():
+                return
+            changes = change_feed.since(current) if current is not None else None
+            if changes is None:
+                current = change_feed.last_seq
+                yield sse_event(change_feed.event_id(current), 'reset', {})
+                continue
+            
+            sent = False
+            for event_seq, kind, event_date, data in changes:
+                current = event_seq
+                # 他の日付の変更は送らない（日付のない設定・resetは全員に送る）
+                if date and event_date and event_date != date:
+                    continue
+                yield sse_event(change_feed.event_id(event_seq), kind, data)
+                sent = True
+            
+            # ミラーのリスナーが切れたら接続を閉じて再接続してもらう
+            if _mirror is None or not _mirror.is_ready():
+                return
+            
+            timeout = min(STREAM_HEARTBEAT_SECONDS, max(0, deadline - datetime.now().timestamp()))
+            if not change_feed.wait(current, timeout) and not sent:
+                yield ": ping\n\n"
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# 変更通知の接続用の短期トークン（クエリに載るのでログインのトークンの代わりに使う）
+@app.route('/api/admin/stream-token', methods=['POST'])
+@require_auth
+def stream_token():
+    try:
+        token = jwt.encode({'scope': 'stream', 'exp': datetime.utcnow() + timedelta(seconds=STREAM_TOKEN_SECONDS)}, JWT_SECRET, algorithm='HS256')
+        return jsonify({'token': token, 'expires_in': STREAM_TOKEN_SECONDS})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# 開催日の一覧（画面の日付 → APIの日付）
+@app.route('/api/admin/event-days', methods=['GET'])
+@require_auth
+def get_event_days():
+    return jsonify({'dates': registry.dates, 'default': DEFAULT_DATE})
 
 @app.route('/api/admin/login', methods=['POST'])
 def login():
@@ -67,101 +897,34 @@ def login():
 @require_auth
 def get_next_group():
     try:
-        date = request.args.get('date', '2025-11-01')
-        group_collection = 'group' if date == '2025-11-01' else 'group2'
-        
-        # 時間指定予約（X/Y）で呼び出し時刻になっているものをチェック
-        now = datetime.now()
-        current_time = now.strftime('%H:%M')
+        date = request.args.get('date', DEFAULT_DATE)
+        error = check_date(date)
+        if error is not None:
+            return error
+        group_collection = group_collection_for(date)
         
-        # 5分前になった関係者予約を探す
-        all_res = db.collection('reservation').stream()
-        vip_ready = []
-        
-        for doc in all_res:
-            res_id = doc.id
-            data = doc.to_dict()
-            res_type = res_id[0] if len(res_id) > 0 else 'X'
-            
-            # 関係者予約（X/Y）のみ
-            if res_type not in ['X', 'Y']:
-                continue
-            
-            # 日付チェック
-            if data.get('date') != date:
-                continue
-            
-            # ステータスチェック（status=0のみ）
-            if data.get('status', 0) != 0:
-                continue
-            
-            # 時刻チェック
-            res_time = data.get('time')
-            if res_time:
-                # 5分前かチェック
-                res_datetime = datetime.strptime(f"{date} {res_time}", '%Y-%m-%d %H:%M')
-                call_time = res_datetime - timedelta(minutes=5)
-                
-                if now >= call_time and not data.get('group'):
-                    vip_ready.append({
-                        'id': res_id,
-                        'time': res_time,
-                        'count': data.get('count', 0)
-                    })
-        
-        # 関係者予約をグループに割り当て
-        for vip in vip_ready:
-            assign_vip_to_group(vip['id'], vip['count'], group_collection)
+        # 時間指定予約（X/Y）のグループ割り当てはスケジューラ（または /internal/tick）が行うので、ここでは読むだけ
         
         # 不在マークされた予約（priority=True）を取得
         priority_reservations = []
-        all_res2 = db.collection('reservation').stream()
         
-        for doc in all_res2:
-            res_id = doc.id
-            data = doc.to_dict()
-            res_type = res_id[0] if len(res_id) > 0 else 'X'
-            
-            # 日付判定
-            if data.get('date'):
-                res_date = data['date']
-            else:
-                res_date = '2025-11-01' if res_type in ['A', 'C', 'X'] else '2025-11-02'
-            
-            if res_date != date:
-                continue
-            
-            # priority=Trueかつstatus=0の予約
-            if data.get('priority', False) and data.get('status', 0) == 0:
-                priority_reservations.append({
-                    'id': res_id,
-                    'count': data.get('count', 0),
-                    'type': res_type
-                })
+        # priority=Trueかつstatus=0の予約
+        for res in list_reservations(date, status=0, priority=True):
+            priority_reservations.append({
+                'id': res.id,
+                'count': res.count,
+                'type': res.type,
+                'time': res.time
+            })
         
         # 優先予約がある場合、次のグループに追加
         if priority_reservations:
             next_group_num = create_priority_group(priority_reservations, group_collection)
             if next_group_num:
                 # 作成したグループの情報を返す
-                group_doc = db.collection(group_collection).document(str(next_group_num)).get()
-                if group_doc.exists:
-                    group_data = group_doc.to_dict()
-                    reservations = []
-                    
-                    for res_id in group_data.get('reservation', []):
-                        res_doc = db.collection('reservation').document(res_id).get()
-                        if res_doc.exists:
-                            res_data = res_doc.to_dict()
-                            if res_data.get('status', 0) == 0:
-                                reservations.append({
-                                    'reservation_id': res_id,
-                                    'count': res_data.get('count', 0),
-                                    'type': res_id[0] if len(res_id) > 0 else 'X',
-                                    'time': res_data.get('time'),
-                                    'status': res_data.get('status', 0),
-                                    'priority': res_data.get('priority', False)
-                                })
+                group = get_group(group_collection, next_group_num)
+                if group is not None:
+                    reservations = [m for m in groups_members([group])[group.number] if m['status'] == 0]
                     
                     if reservations:
                         return jsonify({
@@ -170,46 +933,41 @@ def get_next_group():
                             'has_priority': True
                         })
         
-        # 次に呼び出すグループを取得
-        groups = db.collection(group_collection).order_by('__name__').stream()
-        
-        for group_doc in groups:
-            group_num = int(group_doc.id)
-            group_data = group_doc.to_dict()
-            
-            # status=0（待機中）のグループのみ
-            if group_data.get('status', 0) != 0:
-                continue
-            
-            # このグループの予約情報を取得
-            reservations = []
-            reservation_ids = group_data.get('reservation', [])
-            has_priority = False
-            
-            for res_id in reservation_ids:
-                res_doc = db.collection('reservation').document(res_id).get()
-                if res_doc.exists:
-                    res_data = res_doc.to_dict()
-                    # status=0（待機中）またはstatus=3（不在マーク、優先あり）のみ
-                    if res_data.get('status', 0) == 0:
-                        if res_data.get('priority', False):
-                            has_priority = True
-                        reservations.append({
-                            'reservation_id': res_id,
-                            'count': res_data.get('count', 0),
-                            'type': res_id[0] if len(res_id) > 0 else 'X',
-                            'time': res_data.get('time'),
-                            'status': res_data.get('status', 0),
-                            'priority': res_data.get('priority', False)
-                        })
-            
+        # 次に呼び出すグループを取得（ミラーがあれば呼び出し待ちのキューの先頭）
+        mirror = get_mirror()
+        if mirror is not None:
+            group = mirror.next_waiting_group(group_collection)
+            if group is None:
+                return jsonify({'group_number': None, 'reservations': []})
+            reservations = [m for m in groups_members([group])[group.number] if m['status'] == 0]
             if reservations:
-                # 優先予約がある場合は最優先で返す
                 return jsonify({
-                    'group_number': group_num,
+                    'group_number': group.number,
                     'reservations': reservations,
-                    'has_priority': has_priority
+                    'has_priority': any(m['priority'] for m in reservations)
                 })
+            # サマリーのない旧データのグループで待機中のメンバーがいなかった場合は、下で順番に確認する
+        
+        # status=0（待機中）のグループを呼び出す順（優先グループ→グループ番号順）に
+        waiting_groups = sorted(list_groups(group_collection, status=0), key=waiting_key)
+        
+        # 数グループずつメンバーを確認（サマリーのない旧データはまとめて読み込む）
+        for start in range(0, len(waiting_groups), MEMBER_FETCH_WINDOW):
+            window = waiting_groups[start:start + MEMBER_FETCH_WINDOW]
+            members = groups_members(window)
+            
+            for group in window:
+                # status=0（待機中）のメンバーのみ
+                reservations = [m for m in members[group.number] if m['status'] == 0]
+                has_priority = any(m['priority'] for m in reservations)
+                
+                if reservations:
+                    # 優先予約がある場合は最優先で返す
+                    return jsonify({
+                        'group_number': group.number,
+                        'reservations': reservations,
+                        'has_priority': has_priority
+                    })
         
         return jsonify({'group_number': None, 'reservations': []})
     except Exception as e:
@@ -224,16 +982,19 @@ def get_next_group():
 def call_group():
     try:
         data = request.json or {}
-        date = data.get('date', '2025-11-01')
+        date = data.get('date', DEFAULT_DATE)
         group_number = data.get('group_number')
         
         if not group_number:
             return jsonify({'error': 'group_number required'}), 400
         
-        group_collection = 'group' if date == '2025-11-01' else 'group2'
+        error = check_date(date)
+        if error is not None:
+            return error
+        group_collection = group_collection_for(date)
         
         # グループのステータスを1（呼び出し中）に更新
-        db.collection(group_collection).document(str(group_number)).update({
+        update_group(group_collection, group_number, {
             'status': 1,
             'called_at': datetime.now().isoformat()
         })
@@ -249,16 +1010,19 @@ def call_group():
 def reset_group():
     try:
         data = request.json or {}
-        date = data.get('date', '2025-11-01')
+        date = data.get('date', DEFAULT_DATE)
         group_number = data.get('group_number')
         
         if not group_number:
             return jsonify({'error': 'group_number required'}), 400
         
-        group_collection = 'group' if date == '2025-11-01' else 'group2'
+        error = check_date(date)
+        if error is not None:
+            return error
+        group_collection = group_collection_for(date)
         
         # グループのステータスを0（待機中）に戻す
-        db.collection(group_collection).document(str(group_number)).update({
+        update_group(group_collection, group_number, {
             'status': 0
         })
         
@@ -268,55 +1032,44 @@ def reset_group():
         return jsonify({'error': str(e)}), 500
 
 # 優先予約用のグループを作成
+# 定員内に収まるよう人数の多い順に組み合わせ（first-fit-decreasing）、入りきらない分は別の優先グループにする
+# 戻り値は最初に作ったグループの番号
 def create_priority_group(priority_reservations, group_collection):
     try:
-        # 既存のグループ番号を取得
-        groups = db.collection(group_collection).stream()
-        existing_nums = set()
+        capacity = group_capacity(GROUP_DATES.get(group_collection))
+        by_id = {res['id']: res for res in priority_reservations}
+        packed = grouping.pack([(res['id'], res['count']) for res in priority_reservations], capacity,
+                               GROUP_STRATEGY.name, decreasing=True)
         
-        for group_doc in groups:
-            try:
-                num = int(group_doc.id)
-                existing_nums.add(num)
-            except ValueError:
-                continue
+        # グループが空でない場合のみ作成
+        if not packed:
+            return None
         
-        # 新しいグループ番号を決定（既存と重複しない）
-        if not existing_nums:
-            new_group_num = 1
-        else:
-            new_group_num = max(existing_nums) + 1
-            # 既存の番号と重複する場合はさらに+1
-            while new_group_num in existing_nums:
-                new_group_num += 1
-        
-        # 優先予約を4人以下になるように組み合わせる
-        current_group_reservations = []
-        current_count = 0
-        
-        for res in priority_reservations:
-            if current_count + res['count'] <= 4:
-                current_group_reservations.append(res['id'])
-                current_count += res['count']
-                
-                # グループ番号を更新
-                db.collection('reservation').document(res['id']).update({
+        # 新しいグループ番号を払い出す（呼び出し順は組み合わせた順）
+        group_nums = [allocate_group_number(group_collection) for _ in packed]
+        writer = BatchWriter()
+        
+        for new_group_num, res_ids in zip(group_nums, packed):
+            members = {res_id: member_summary(by_id[res_id]['count'], 0, True, by_id[res_id].get('time')) for res_id in res_ids}
+            
+            # グループ番号を更新
+            for res_id in res_ids:
+                writer.update_reservation(res_id, {
                     'group': new_group_num
                 })
-        
-        # グループが空でない場合のみ作成
-        if current_group_reservations:
-            db.collection(group_collection).document(str(new_group_num)).set({
+            
+            writer.set_group(group_collection, new_group_num, {
                 'status': 0,
-                'reservation': current_group_reservations,
+                'reservation': res_ids,
+                'head_count': sum(member['count'] for member in members.values()),
+                'members': members,
                 'created_at': datetime.now().isoformat(),
                 'is_priority': True
             })
-            
-            print(f"Created priority group {new_group_num} with {len(current_group_reservations)} reservations")
-            return new_group_num
+        writer.commit()
         
-        return None
+        print(f"Created priority groups {group_nums} with {len(by_id)} reservations")
+        return group_nums[0]
     except Exception as e:
         print(f"Error creating priority group: {e}")
         import traceback
@@ -326,37 +1079,28 @@ def create_priority_group(priority_reservations, group_collection):
 # 呼び出し中のグループを取得
 @app.route('/api/admin/calling-group', methods=['GET'])
 @require_auth
+@conditional_get()
 def get_calling_group():
     try:
-        date = request.args.get('date', '2025-11-01')
-        group_collection = 'group' if date == '2025-11-01' else 'group2'
-        
-        groups = db.collection(group_collection).stream()
+        date = request.args.get('date', DEFAULT_DATE)
+        error = check_date(date)
+        if error is not None:
+            return error
+        group_collection = group_collection_for(date)
+        
+        # status=1（呼び出し中）のグループ（複数あれば番号の小さいもの）
+        mirror = get_mirror()
+        if mirror is not None:
+            calling = mirror.calling_group(group_collection)
+            groups = [calling] if calling is not None else []
+        else:
+            groups = sorted(list_groups(group_collection, status=1), key=lambda group: group.number)
         
-        for group_doc in groups:
-            group_num = int(group_doc.id)
-            group_data = group_doc.to_dict()
-            
-            # status=1（呼び出し中）のグループのみ
-            if group_data.get('status', 0) != 1:
-                continue
+        for group in groups:
+            group_num = group.number
             
             # このグループの予約情報を取得
-            reservations = []
-            reservation_ids = group_data.get('reservation', [])
-            
-            for res_id in reservation_ids:
-                res_doc = db.collection('reservation').document(res_id).get()
-                if res_doc.exists:
-                    res_data = res_doc.to_dict()
-                    reservations.append({
-                        'reservation_id': res_id,
-                        'count': res_data.get('count', 0),
-                        'type': res_id[0] if len(res_id) > 0 else 'X',
-                        'time': res_data.get('time'),
-                        'status': res_data.get('status', 0),
-                        'priority': res_data.get('priority', False)
-                    })
+            reservations = groups_members([group])[group.number]
             
             return jsonify({
                 'group_number': group_num,
@@ -374,13 +1118,12 @@ def get_calling_group():
 def mark_visit(res_id):
     try:
         # status=1（来店済み）にして、priorityフラグをクリア
-        db.collection('reservation').document(res_id).update({
-            'status': 1,
-            'priority': False
-        })
+        writer = BatchWriter()
+        update_reservation_status(res_id, outcome_fields('visited', datetime.now().isoformat()), writer)
         
-        # このグループの全予約をチェック
-        check_and_complete_group(res_id)
+        # このグループの全予約をチェック（完了なら同じコミットでグループも更新）
+        check_and_complete_group(res_id, writer, {res_id: 1})
+        writer.commit()
         
         return jsonify({'success': True})
     except Exception as e:
@@ -392,281 +1135,434 @@ def mark_visit(res_id):
 def mark_absent(res_id):
     try:
         # status=3（不在）にマーク、優先フラグを付与
-        db.collection('reservation').document(res_id).update({
-            'status': 3,
-            'priority': True,
-            'absent_at': datetime.now().isoformat()
-        })
+        writer = BatchWriter()
+        update_reservation_status(res_id, outcome_fields('absent', datetime.now().isoformat()), writer)
         
-        # 空いた枠を補充
-        fill_vacant_slot(res_id)
+        # 空いた枠を補充（不在・補充・グループ完了を1回のコミットで書き込む）
+        fill_vacant_slot(res_id, writer)
+        writer.commit()
         
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # 空いた枠を補充する
-def fill_vacant_slot(absent_res_id):
+# 書き込みはwriterに追加する（不在にする変更と同じコミットにするため、writerがなければここでコミット）
+def fill_vacant_slot(absent_res_id, writer=None):
+    own_writer = writer is None
+    if own_writer:
+        writer = BatchWriter()
+    add_fill_writes(absent_res_id, writer)
+    if own_writer:
+        writer.commit()
+
+# fill_vacant_slotの書き込みをwriterに追加する
+# 途中で失敗したら例外をそのまま返し、呼び出し側はwriterをコミットしない（メンバーの移動が片方だけ保存されないように）
+def add_fill_writes(absent_res_id, writer):
+    # 不在になった予約の情報を取得
+    absent = fetch_reservations([absent_res_id]).get(absent_res_id)
+    if absent is None:
+        return
+    
+    absent_count = absent.count
+    group_num = absent.group
+    
+    if not group_num:
+        return
+    
+    # 日付を判定（登録されていない日付のグループは扱わない）
+    date = absent.date
+    if registry.day(date) is None:
+        return
+    group_collection = group_collection_for(date)
+    
+    # このグループの情報を取得
+    group = get_group(group_collection, group_num)
+    if group is None:
+        return
+    
+    # グループが呼び出し中でない場合は何もしない
+    if group.status != 1:
+        return
+    
+    # 後ろのグループから補充候補を探す
+    candidates = []
+    
+    # status=0（待機中）で、現在のグループより後ろのグループにいて、人数が空き枠以下のもの
+    for res in list_reservations(date, status=0, group_after=group_num, max_count=absent_count):
+        candidates.append({
+            'id': res.id,
+            'count': res.count,
+            'group': res.group,
+            'priority': res.priority,
+            'type': res.type,
+            'time': res.time
+        })
+    
+    if not candidates:
+        # 補充候補がない場合、グループのチェック（不在にした予約は処理済みとして数える）
+        check_and_complete_group(absent_res_id, writer, {absent_res_id: 3})
+        return
+    
+    # 優先フラグがあるものを優先、次にグループ番号が小さいものを選択
+    candidates.sort(key=lambda x: (not x['priority'], x['group'], x['id']))
+    selected = candidates[0]
+    old_group = get_group(group_collection, selected['group'])
+    
+    # 選択された予約を現在のグループに移動（移動元・移動先のグループと同じコミットで）
+    # グループの配列はArrayRemove/ArrayUnionで更新するので、他の端末の変更を上書きしない
+    writer.update_reservation(selected['id'], {
+        'group': group_num,
+        'priority': False  # 優先フラグをクリア
+    })
+    
+    # 元のグループから削除
+    if old_group is not None and selected['id'] in old_group.reservation:
+        writer.update_group(group_collection, selected['group'],
+                            group_leave_fields(old_group, selected['id'], selected['count']))
+    
+    # 新しいグループに追加
+    if selected['id'] not in group.reservation:
+        writer.update_group(group_collection, group_num,
+                            group_join_fields(group, selected['id'], member_summary(selected['count'], 0, False, selected['time'])))
+    
+    print(f"Filled vacant slot: moved {selected['id']} to group {group_num}")
+
+# グループが完了したかチェック
+# pending_statuses: まだコミットしていない状態変更（予約ID → 状態）。writerを渡した場合は書き込みを追加するだけ
+# 失敗したら例外をそのまま返す（呼び出し側は同じwriterの書き込みをコミットしない）
+def check_and_complete_group(res_id, writer=None, pending_statuses=None):
+    # この予約が所属するグループを探す
+    res = fetch_reservations([res_id]).get(res_id)
+    if res is None:
+        return
+    
+    group_num = res.group
+    if not group_num:
+        return
+    
+    # 日付を判定（登録されていない日付のグループは扱わない）
+    date = res.date
+    if registry.day(date) is None:
+        return
+    group_collection = group_collection_for(date)
+    
+    # グループ情報を取得
+    group = get_group(group_collection, group_num)
+    if group is None:
+        return
+    
+    # グループが呼び出し中でない場合は何もしない
+    if group.status != 1:
+        return
+    
+    # グループ内の全予約をチェック
+    members = groups_members([group])[group.number]
+    
+    # status=0（待機中）がある場合は未完了
+    pending_statuses = pending_statuses or {}
+    all_processed = all(pending_statuses.get(m['reservation_id'], m['status']) != 0 for m in members)
+    
+    # 全て処理済み（来店 or 不在）の場合、グループを完了
+    if all_processed:
+        fields = {
+            'status': 2,  # 完了
+            'completed_at': datetime.now().isoformat()
+        }
+        if writer is not None:
+            writer.update_group(group_collection, group_num, fields)
+        else:
+            update_group(group_collection, group_num, fields)
+
+# 来店・不在にしたときの予約の変更（mark_visit / mark_absent と同じ）
+def outcome_fields(outcome, timestamp):
+    if outcome == 'visited':
+        return {'status': 1, 'priority': False, 'visited_at': timestamp}
+    return {'status': 3, 'priority': True, 'absent_at': timestamp}
+
+# グループのメンバーの来店・不在をまとめて反映する
+# 状態の変更・空いた枠の補充・グループの完了を1回のトランザクションで書き込む（補充と完了の判定は全員分まとめて1回）
+# body: {"date": "2025-11-01", "outcomes": {"A0001": "visited", "A0002": "absent"}}
+@app.route('/api/admin/groups/<int:group_number>/resolve', methods=['POST'])
+@require_auth
+def resolve_group(group_number):
     try:
-        # 不在になった予約の情報を取得
-        absent_doc = db.collection('reservation').document(absent_res_id).get()
-        if not absent_doc.exists:
-            return
-        
-        absent_data = absent_doc.to_dict()
-        absent_count = absent_data.get('count', 0)
-        group_num = absent_data.get('group')
-        
-        if not group_num:
-            return
-        
-        # 日付を判定
-        res_type = absent_res_id[0] if len(absent_res_id) > 0 else 'X'
-        date = '2025-11-01' if res_type in ['A', 'C', 'X'] else '2025-11-02'
-        group_collection = 'group' if date == '2025-11-01' else 'group2'
-        
-        # このグループの情報を取得
-        group_doc = db.collection(group_collection).document(str(group_num)).get()
-        if not group_doc.exists:
-            return
-        
-        group_data = group_doc.to_dict()
-        
-        # グループが呼び出し中でない場合は何もしない
-        if group_data.get('status', 0) != 1:
-            return
-        
-        # 後ろのグループから補充候補を探す
-        all_reservations = db.collection('reservation').stream()
+        data = request.json or {}
+        date = data.get('date', DEFAULT_DATE)
+        outcomes = data.get('outcomes') or {}
+        if isinstance(outcomes, list):
+            outcomes = {item.get('reservation_id'): item.get('outcome') for item in outcomes if isinstance(item, dict)}
+        if not outcomes or any(outcome not in ('visited', 'absent') for outcome in outcomes.values()):
+            return jsonify({'error': 'outcomes must map reservation IDs to visited or absent'}), 400
+        
+        error = check_date(date)
+        if error is not None:
+            return error
+        group_collection = group_collection_for(date)
+        group_ref = db.collection(group_collection).document(str(group_number))
+        
+        # 補充候補はトランザクションの外で絞り込み、中で読み直して確かめる
+        absent_ids = [res_id for res_id, outcome in outcomes.items() if outcome == 'absent']
+        freed = sum(res.count for res in fetch_reservations(absent_ids).values() if res.status == 0)
         candidates = []
-        
-        for doc in all_reservations:
-            r_id = doc.id
-            r_data = doc.to_dict()
-            r_type = r_id[0] if len(r_id) > 0 else 'X'
-            
-            # 日付チェック
-            if r_data.get('date'):
-                r_date = r_data['date']
-            else:
-                r_date = '2025-11-01' if r_type in ['A', 'C', 'X'] else '2025-11-02'
-            
-            if r_date != date:
-                continue
+        if freed:
+            candidates = list_reservations(date, status=0, group_after=group_number, max_count=freed)
+            candidates.sort(key=lambda res: (not res.priority, res.group, res.id))
+        
+        def resolve(transaction):
+            snapshot = group_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                raise LookupError('Group not found')
+            group = GroupRecord(group_number, snapshot.to_dict())
+            unknown = [res_id for res_id in outcomes if res_id not in group.reservation]
+            if unknown:
+                raise ValueError(f"Not in group {group_number}: {', '.join(unknown)}")
             
-            # status=0（待機中）のみ
-            if r_data.get('status', 0) != 0:
-                continue
+            refs = [reservation_ref(r_id) for r_id in group.reservation]
+            refs += [reservation_ref(res.id) for res in candidates]
+            docs = {doc.id: doc.to_dict() for doc in db.get_all(refs, transaction=transaction) if doc.exists}
             
-            # グループが割り当てられている
-            r_group = r_data.get('group')
-            if not r_group:
-                continue
+            # 呼び出し中のグループだけ、実際に空いた人数ぶん後ろのグループから補充する
+            filled = []
+            old_groups = {}
+            if group.status == 1:
+                remaining = sum(docs[res_id].get('count', 0) for res_id in absent_ids
+                                if res_id in docs and docs[res_id].get('status', 0) == 0)
+                for res in candidates:
+                    current = docs.get(res.id)
+                    if current is None or current.get('status', 0) != 0 or current.get('group') != res.group:
+                        continue
+                    if res.count <= remaining:
+                        filled.append(res)
+                        remaining -= res.count
+                old_group_refs = [db.collection(group_collection).document(str(number))
+                                  for number in sorted({res.group for res in filled})]
+                for doc in db.get_all(old_group_refs, transaction=transaction):
+                    if doc.exists:
+                        old_groups[int(doc.id)] = GroupRecord(int(doc.id), doc.to_dict())
             
-            # 現在のグループより後ろのグループ
-            if r_group <= group_num:
-                continue
+            # ここから書き込み
+            writer = BatchWriter(transaction)
+            timestamp = datetime.now().isoformat()
+            stats_counts = {}
+            member_fields = {}
+            statuses = {res_id: docs[res_id].get('status', 0) for res_id in group.reservation if res_id in docs}
+            for res_id, outcome in outcomes.items():
+                if res_id not in docs:
+                    continue
+                fields = outcome_fields(outcome, timestamp)
+                writer.update_reservation(res_id, fields)
+                for field_path, delta in status_stats_counts(statuses[res_id], fields['status']).items():
+                    stats_counts[field_path] = stats_counts.get(field_path, 0) + delta
+                statuses[res_id] = fields['status']
+                if group.has_summary() and res_id in group.members:
+                    member_fields[f'members.{res_id}.status'] = fields['status']
+                    member_fields[f'members.{res_id}.priority'] = fields['priority']
+            if member_fields:
+                writer.update_group(group_collection, group_number, member_fields)
             
-            # 人数が空き枠以下
-            r_count = r_data.get('count', 0)
-            if r_count <= absent_count:
-                candidates.append({
-                    'id': r_id,
-                    'count': r_count,
-                    'group': r_group,
-                    'priority': r_data.get('priority', False),
-                    'type': r_type
+            for res in filled:
+                writer.update_reservation(res.id, {
+                    'group': group_number,
+                    'priority': False  # 優先フラグをクリア
                 })
-        
-        if not candidates:
-            # 補充候補がない場合、グループのチェック
-            check_and_complete_group(absent_res_id)
-            return
-        
-        # 優先フラグがあるものを優先、次にグループ番号が小さいものを選択
-        candidates.sort(key=lambda x: (not x['priority'], x['group'], x['id']))
-        selected = candidates[0]
-        
-        # 選択された予約を現在のグループに移動
-        db.collection('reservation').document(selected['id']).update({
-            'group': group_num,
-            'priority': False  # 優先フラグをクリア
-        })
-        
-        # 元のグループから削除
-        old_group_doc = db.collection(group_collection).document(str(selected['group'])).get()
-        if old_group_doc.exists:
-            old_group_data = old_group_doc.to_dict()
-            old_reservations = old_group_data.get('reservation', [])
-            if selected['id'] in old_reservations:
-                old_reservations.remove(selected['id'])
-                db.collection(group_collection).document(str(selected['group'])).update({
-                    'reservation': old_reservations
+                old_group = old_groups.get(res.group)
+                if old_group is not None and res.id in old_group.reservation:
+                    writer.update_group(group_collection, res.group, group_leave_fields(old_group, res.id, res.count))
+                writer.update_group(group_collection, group_number,
+                                    group_join_fields(group, res.id, member_summary(res.count, 0, False, res.time)))
+            
+            # 全員処理済み（補充なし）ならグループを完了
+            completed = group.status == 1 and not filled and all(status != 0 for status in statuses.values())
+            if completed:
+                writer.update_group(group_collection, group_number, {
+                    'status': 2,  # 完了
+                    'completed_at': timestamp
                 })
+            if stats_counts:
+                writer.increment_stats(date, stats_counts)
+            return writer, [res.id for res in filled], completed
         
-        # 新しいグループに追加
-        current_reservations = group_data.get('reservation', [])
-        if selected['id'] not in current_reservations:
-            current_reservations.append(selected['id'])
-            db.collection(group_collection).document(str(group_num)).update({
-                'reservation': current_reservations
-            })
-        
-        print(f"Filled vacant slot: moved {selected['id']} to group {group_num}")
-        
+        try:
+            writer, filled, completed = run_transaction('resolve_group', resolve)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except ValueError as e:
+            # 競合で再試行しきれなかった場合は500
+            if isinstance(e.__cause__, storage.Aborted):
+                raise
+            return jsonify({'error': str(e)}), 400
+        writer.commit()
+        
+        if filled:
+            print(f"Filled vacant slots: moved {filled} to group {group_number}")
+        return jsonify({'success': True, 'group_number': group_number, 'filled': filled, 'completed': completed})
     except Exception as e:
-        print(f"Error in fill_vacant_slot: {e}")
-        import traceback
-        traceback.print_exc()
+        print(f"Error in resolve_group: {e}")
+        return jsonify({'error': str(e)}), 500
 
-# グループが完了したかチェック
-def check_and_complete_group(res_id):
+# 関係者予約の割り当て時刻（予約時刻の5分前）
+def vip_due_time(date, time):
     try:
-        # この予約が所属するグループを探す
-        res_doc = db.collection('reservation').document(res_id).get()
-        if not res_doc.exists:
-            return
-        
-        group_num = res_doc.to_dict().get('group')
-        if not group_num:
-            return
-        
-        # 日付を判定
-        res_type = res_id[0] if len(res_id) > 0 else 'X'
-        date = '2025-11-01' if res_type in ['A', 'C', 'X'] else '2025-11-02'
-        group_collection = 'group' if date == '2025-11-01' else 'group2'
-        
-        # グループ情報を取得
-        group_doc = db.collection(group_collection).document(str(group_num)).get()
-        if not group_doc.exists:
-            return
-        
-        group_data = group_doc.to_dict()
-        
-        # グループが呼び出し中でない場合は何もしない
-        if group_data.get('status', 0) != 1:
-            return
-        
-        # グループ内の全予約をチェック
-        reservation_ids = group_data.get('reservation', [])
-        all_processed = True
-        
-        for r_id in reservation_ids:
-            r_doc = db.collection('reservation').document(r_id).get()
-            if r_doc.exists:
-                r_status = r_doc.to_dict().get('status', 0)
-                # status=0（待機中）がある場合は未完了
-                if r_status == 0:
-                    all_processed = False
-                    break
-        
-        # 全て処理済み（来店 or 不在）の場合、グループを完了
-        if all_processed:
-            db.collection(group_collection).document(str(group_num)).update({
-                'status': 2,  # 完了
-                'completed_at': datetime.now().isoformat()
-            })
+        return datetime.strptime(f"{date} {time}", '%Y-%m-%d %H:%M') - timedelta(minutes=VIP_LEAD_MINUTES)
+    except (TypeError, ValueError):
+        return None
+
+# グループ割り当て待ちの関係者予約か（status=0・グループ未割り当て）
+def is_pending_vip(res):
+    return is_vip_type(res.type) and res.status == 0 and not res.group and vip_due_time(res.date, res.time) is not None
+
+# 関係者予約の割り当てスケジューラ（プロセス内で共有）
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+# スケジューラを起動（最初のリクエストで起動し、割り当て待ちの関係者予約を読み込む）
+def get_scheduler():
+    global _scheduler
+    if not SCHEDULER_ENABLED or db is None:
+        return None
+    if _scheduler is not None:
+        return _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            return _scheduler
+        scheduler = VipScheduler(assign_due_vips)
+        _scheduler = scheduler
+        try:
+            for date in GROUP_DATES.values():
+                for res in list_reservations(date, status=0):
+                    if is_pending_vip(res):
+                        scheduler.add(res.id, vip_due_time(res.date, res.time))
+        except Exception as e:
+            # 読み込めなかった分は /internal/tick で割り当てる
+            print(f"Error loading VIP schedule: {e}")
+        scheduler.start()
+        print(f"✅ VIP scheduler started: {scheduler.pending()} pending")
+        return scheduler
+
+# 最初のリクエストで接続・スケジューラの起動を行う（ウォームアップ済みなら何もしない）
+@app.before_request
+def prepare_instance():
+    # /ready は準備の完了を待たずに答える
+    if request.endpoint == 'ready':
+        return
+    init_db()
+    get_scheduler()
+
+# 関係者予約をスケジューラに登録（割り当て済み・キャンセルなら取り消す）
+def schedule_vip(res):
+    if _scheduler is None or not is_vip_type(res.type):
+        return
+    if is_pending_vip(res):
+        _scheduler.add(res.id, vip_due_time(res.date, res.time))
+    else:
+        _scheduler.discard(res.id)
+
+# 割り当て時刻になった関係者予約をグループに入れる（割り当て済み・キャンセル済みは飛ばす）
+def assign_vips(records, now=None):
+    now = now or datetime.now()
+    assigned = []
+    for res in records:
+        if not is_pending_vip(res) or vip_due_time(res.date, res.time) > now or registry.day(res.date) is None:
+            continue
+        group_collection = group_collection_for(res.date)
+        group_num = assign_vip_to_group(res.id, res.count, group_collection, res.time)
+        if group_num is not None:
+            assigned.append({'reservation_id': res.id, 'group_number': group_num})
+        elif _scheduler is not None:
+            # 失敗して割り当て待ちのままのものは少し後にやり直す
+            current = fetch_reservations([res.id]).get(res.id)
+            if current is not None and is_pending_vip(current):
+                _scheduler.add(res.id, now + timedelta(seconds=30))
+    return assigned
+
+# スケジューラから呼ばれる（res_ids: 割り当て時刻になった予約ID）
+def assign_due_vips(res_ids):
+    assigned = assign_vips(fetch_reservations(res_ids).values())
+    for item in assigned:
+        print(f"Assigned VIP {item['reservation_id']} to group {item['group_number']}")
+
+# 全日付の割り当て待ちの関係者予約を確認して、時刻になったものを割り当てる（何度呼んでも二重に割り当てない）
+def run_scheduler_tick(now=None):
+    now = now or datetime.now()
+    assigned = []
+    for date in GROUP_DATES.values():
+        records = [res for res in list_reservations(date, status=0) if is_pending_vip(res)]
+        assigned.extend(assign_vips(records, now))
+    next_due = _scheduler.next_due() if _scheduler is not None else None
+    return {'assigned': assigned, 'next_due': next_due.isoformat() if next_due else None}
+
+# /metrics の認証（METRICS_TOKENと一致すればDBの状態に関係なく読める。それ以外は管理者のトークン）
+def check_metrics_auth():
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    if METRICS_TOKEN and hmac.compare_digest(token, METRICS_TOKEN):
+        return None
+    return check_auth()
+
+# /internal/tick の認証（TICK_TOKENと一致するX-Tick-Tokenヘッダー、または管理者のトークン）
+def require_tick_auth(f):
+    admin_only = require_auth(f)
+    
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = request.headers.get('X-Tick-Token', '')
+        if TICK_TOKEN and hmac.compare_digest(token, TICK_TOKEN):
+            if db is None:
+                return jsonify({'error': 'DB not ready'}), 503
+            return f(*args, **kwargs)
+        return admin_only(*args, **kwargs)
+    return decorated
+
+# Cloud Schedulerから定期的に呼ぶ（インスタンスが0台まで縮小してスケジューラが止まっていても割り当てを進める）
+# グループへの割り当てを書き込むのでPOSTだけ受け付ける（リンクの先読みやクローラーのGETで書き込まない）
+@app.route('/internal/tick', methods=['POST'])
+@require_tick_auth
+def internal_tick():
+    try:
+        return jsonify(run_scheduler_tick())
     except Exception as e:
-        print(f"Error in check_and_complete_group: {e}")
+        print(f"Error in internal_tick: {e}")
+        return jsonify({'error': str(e)}), 500
 
 # 関係者予約をグループに割り当て
-def assign_vip_to_group(reservation_id, count, group_collection):
+# 予約ドキュメントもトランザクション内で読み直し、割り当て済み・キャンセル済みならNoneを返す
+def assign_vip_to_group(reservation_id, count, group_collection, time=None):
     try:
         # 既存のグループを取得
-        groups = db.collection(group_collection).stream()
-        group_list = []
-        
-        for group_doc in groups:
-            try:
-                group_num = int(group_doc.id)
-                group_data = group_doc.to_dict()
-                
-                # ステータスが0のグループのみ
-                if group_data.get('status', 0) != 0:
-                    continue
-                
-                # このグループの現在の人数を計算
-                current_reservations = group_data.get('reservation', [])
-                current_count = 0
-                
-                for r_id in current_reservations:
-                    r_doc = db.collection('reservation').document(r_id).get()
-                    if r_doc.exists:
-                        current_count += r_doc.to_dict().get('count', 0)
-                
-                group_list.append({
-                    'number': group_num,
-                    'current_count': current_count,
-                    'reservations': current_reservations
-                })
-            except ValueError:
-                continue
+        # ステータスが0のグループのみ
+        waiting_groups = [group for group in list_groups(group_collection) if group.status == 0]
         
         # グループ番号でソート
-        group_list.sort(key=lambda x: x['number'])
-        
-        # 4人以下で収まるグループを探す
-        for group in group_list:
-            if group['current_count'] + count <= 4:
-                # このグループに追加
-                group['reservations'].append(reservation_id)
-                db.collection(group_collection).document(str(group['number'])).update({
-                    'reservation': group['reservations']
-                })
-                db.collection('reservation').document(reservation_id).update({
-                    'group': group['number']
-                })
-                return group['number']
+        waiting_groups.sort(key=lambda group: group.number)
+        
+        summary = member_summary(count, 0, False, time)
+        
+        # 空きのあるグループ（なければ新しいグループ）に入れる
+        def place(transaction):
+            writer = BatchWriter(transaction)
+            snapshot = reservation_ref(reservation_id).get(transaction=transaction)
+            data = snapshot.to_dict() if snapshot.exists else None
+            if data is None or data.get('status', 0) != 0 or data.get('group'):
+                return None, writer
+            group_num = place_in_group(writer, group_collection, reservation_id, summary, waiting_groups)
+            writer.update_reservation(reservation_id, {
+                'group': group_num
+            })
+            return group_num, writer
         
-        # 既存のグループに入らない場合、新しいグループを作成
-        new_group_num = get_next_available_group_number(group_collection)
-        db.collection(group_collection).document(str(new_group_num)).set({
-            'status': 0,
-            'reservation': [reservation_id]
-        })
-        db.collection('reservation').document(reservation_id).update({
-            'group': new_group_num
-        })
+        group_num, writer = run_transaction('assign_vip_to_group', place)
+        writer.commit()
         
-        return new_group_num
+        return group_num
     except Exception as e:
         print(f"Error in assign_vip_to_group: {e}")
-        return 1
-
-# 次の利用可能なグループ番号を取得
-def get_next_available_group_number(group_collection):
-    try:
-        groups = db.collection(group_collection).stream()
-        existing_nums = set()
-        
-        for group_doc in groups:
-            try:
-                num = int(group_doc.id)
-                existing_nums.add(num)
-            except ValueError:
-                continue
-        
-        # 既存の番号がない場合
-        if not existing_nums:
-            return 1
-        
-        # 最大値+1を返す（既存と重複しない）
-        new_num = max(existing_nums) + 1
-        
-        # 念のため既存と重複する場合はさらに+1
-        while new_num in existing_nums:
-            new_num += 1
-        
-        return new_num
-    except Exception as e:
-        print(f"Error getting next group number: {e}")
-        return 1
+        return None
 
 @app.route('/api/admin/dashboard', methods=['GET'])
 @require_auth
 def dashboard():
     try:
-        date = request.args.get('date', '2025-11-01')
+        date = request.args.get('date', DEFAULT_DATE)
         return jsonify({
             'next_group': None,
             'calling_group': None,
@@ -680,66 +1576,100 @@ def dashboard():
 
 @app.route('/api/admin/reservations', methods=['GET'])
 @require_auth
+@conditional_get()
 def get_reservations():
     try:
-        date = request.args.get('date', '2025-11-01')
-        print(f"=== Get Reservations for date: {date} ===")
-        result = []
+        date = request.args.get('date', DEFAULT_DATE)
         
-        all_res = db.collection('reservation').stream()
-        total_count = 0
-        matched_count = 0
+        # since=（前回のversion）があればそれ以降に変わった予約だけを返す
+        since = request.args.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return jsonify({'error': 'Invalid since'}), 400
         
-        for doc in all_res:
-            total_count += 1
-            res_id = doc.id
-            data = doc.to_dict()
-            
-            # タイプ判定
-            res_type = res_id[0] if len(res_id) > 0 else 'X'
-            
-            # 日付判定
-            if data.get('date'):
-                res_date = data['date']
-            else:
-                res_date = '2025-11-01' if res_type in ['A', 'C', 'X'] else '2025-11-02'
-            
-            print(f"  Reservation {res_id}: type={res_type}, date={res_date}, status={data.get('status')}")
-            
-            # 日付フィルタ
-            if res_date != date:
-                continue
+        # NDJSON（1行1件）で全件をストリーミング
+        if request.args.get('format') == 'ndjson':
+            def generate():
+                for res in iter_reservations_ordered(date):
+                    yield payload.dumps(res.to_dict()) + '\n'
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        # format=columnar なら予約の一覧を列ごとの配列にする（CSVと同じ列順、繰り返しの多い文字列は辞書の番号）
+        columnar = request.args.get('format') == 'columnar'
+        
+        # limit / cursor があればページング（並び順は group, created_at）
+        if since is None and (request.args.get('limit') or request.args.get('cursor')):
+            try:
+                limit = min(max(int(request.args.get('limit', 100)), 1), MAX_PAGE_LIMIT)
+                cursor = request.args.get('cursor')
+                after = decode_cursor(cursor) if cursor else None
+            except (ValueError, TypeError):
+                return jsonify({'error': 'Invalid limit or cursor'}), 400
             
-            matched_count += 1
-            result.append({
-                'reservation_id': res_id,
-                'type': res_type,
-                'count': data.get('count', 0),
-                'group': data.get('group'),
-                'status': data.get('status', 0),
-                'created_at': data.get('created_at', ''),
-                'time': data.get('time'),
-                'date': res_date,
-                'priority': data.get('priority', False)
+            records, next_cursor = list_reservations_page(date, limit, after)
+            result = [res.to_dict() for res in records]
+            return jsonify({
+                'reservations': payload.to_columnar(result, CSV_COLUMNS) if columnar else result,
+                'next_cursor': next_cursor
             })
         
-        print(f"Total reservations: {total_count}, Matched: {matched_count}")
+        records, removed, version = list_reservations_since(date, since)
+        result = [res.to_dict() for res in records]
         
         # ソート
         result.sort(key=lambda x: (x.get('group') or 9999, x.get('created_at', '')))
         
-        return jsonify({'reservations': result})
+        response = {'reservations': payload.to_columnar(result, CSV_COLUMNS) if columnar else result, 'version': version}
+        if since is not None:
+            response['removed'] = removed
+        return jsonify(response)
     except Exception as e:
         print(f"Error in get_reservations: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+# 予約をCSVでエクスポート（1行ずつストリーミング）
+CSV_COLUMNS = ['reservation_id', 'type', 'count', 'group', 'status', 'priority', 'time', 'date', 'created_at']
+
+@app.route('/api/admin/reservations/export.csv', methods=['GET'])
+@require_auth
+def export_reservations_csv():
+    try:
+        date = request.args.get('date', DEFAULT_DATE)
+        
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            
+            # Excelで文字化けしないようにBOMを付ける
+            yield '\ufeff'
+            writer.writerow(CSV_COLUMNS)
+            for res in iter_reservations_ordered(date):
+                row = res.to_dict()
+                writer.writerow(['' if row.get(col) is None else row.get(col) for col in CSV_COLUMNS])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+            yield buffer.getvalue()
+        
+        return Response(stream_with_context(generate()), mimetype='text/csv', headers={
+            'Content-Disposition': f'attachment; filename="reservations-{date}.csv"',
+            'Cache-Control': 'no-store'
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/reservations/<res_id>/cancel', methods=['POST'])
 @require_auth
 def mark_cancel(res_id):
     try:
-        db.collection('reservation').document(res_id).update({'status': 2})
+        update_reservation_status(res_id, {
+            'status': 2,
+            'cancelled_at': datetime.now().isoformat()
+        })
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -758,6 +1688,11 @@ def create_reservation():
         if not all([res_type, count, date]):
             return jsonify({'error': 'Missing required fields'}), 400
         
+        # 種別は開催日ごとに決まっている（予約番号の先頭文字から日付と保存先を引くため）
+        day = registry.day(date)
+        if day is None or len(res_type) != 1 or registry.day_of_id(res_type) is not day:
+            return jsonify({'error': f'Invalid type {res_type} for {date}'}), 400
+        
         # 予約番号を生成
         reservation_id = generate_reservation_id(res_type, date)
         
@@ -765,207 +1700,527 @@ def create_reservation():
         reservation_data = {
             'count': int(count),
             'status': 0,
+            'date': date,
             'created_at': datetime.now().isoformat()
         }
         
         # 関係者予約の場合
-        if res_type in ['X', 'Y']:
+        if is_vip_type(res_type):
             if not time:
                 return jsonify({'error': 'Time required for VIP'}), 400
-            reservation_data['date'] = date
             reservation_data['time'] = time
+            reservation_data['group'] = None
             # グループは時刻の5分前に自動割り当て
-        else:
-            # 通常予約・当日予約の場合はグループを割り当て
-            group_collection = 'group' if date == '2025-11-01' else 'group2'
-            group_num = assign_to_group(reservation_id, int(count), res_type, group_collection)
-            reservation_data['group'] = group_num
         
-        # Firestoreに保存
-        db.collection('reservation').document(reservation_id).set(reservation_data)
+        # Firestoreに保存（グループへの追加と同じトランザクションで）
+        def save(transaction):
+            writer = BatchWriter(transaction)
+            data = dict(reservation_data)
+            if not is_vip_type(res_type):
+                # 通常予約・当日予約の場合はグループを割り当て
+                group_collection = group_collection_for(date)
+                data['group'] = assign_to_group(reservation_id, int(count), res_type, group_collection, writer)
+            writer.set_reservation(reservation_id, data)
+            writer.increment_stats(date, {
+                'total': 1,
+                'waiting': 1,
+                f'by_type.{res_type}': 1,
+                f'by_hour.{stats_hour(data["created_at"])}.created': 1
+            })
+            return writer
+        
+        run_transaction('create_reservation', save).commit()
+        
+        # 関係者予約は割り当て時刻にスケジューラがグループに入れる
+        if is_vip_type(res_type):
+            schedule_vip(ReservationRecord(reservation_id, date, reservation_data))
         
         return jsonify({'success': True, 'reservation_id': reservation_id})
     except Exception as e:
         print(f"Create reservation error: {e}")
         return jsonify({'error': str(e)}), 500
 
-# 予約番号生成
-def generate_reservation_id(res_type, date):
+# トランザクションを実行し、競合したらバックオフしてやり直す（name: メトリクスのラベル）
+# firestore.transactionalの再試行は間を空けずにやり直すので、1回ずつ実行して待ち時間を入れる
+def run_transaction(name, func):
+    conflicts = 0
+    while True:
+        try:
+            result = firestore.transactional(func)(db.transaction(max_attempts=1))
+        except (storage.Aborted, ValueError) as e:
+            # 再試行回数を超えたときのValueErrorは競合（Aborted）が原因のものだけ扱う
+            if isinstance(e, ValueError) and not isinstance(e.__cause__, storage.Aborted):
+                raise
+            conflicts += 1
+            if conflicts >= TRANSACTION_MAX_ATTEMPTS:
+                metrics.record_transaction(name, conflicts, committed=False)
+                print(f"Transaction {name} failed after {conflicts} conflicts")
+                raise
+            delay = min(TRANSACTION_BACKOFF_MAX_SECONDS, TRANSACTION_BACKOFF_SECONDS * 2 ** (conflicts - 1))
+            time.sleep(random.uniform(0, delay))
+            continue
+        metrics.record_transaction(name, conflicts, committed=True)
+        return result
+
+# 取り込む行を読み込む（JSONの配列・{"reservations": [...]}・CSV（ヘッダー行: type,count,date,time,created_at））
+def read_import_rows():
+    upload = request.files.get('file')
+    if upload is not None:
+        return list(csv.DictReader(io.StringIO(upload.read().decode('utf-8-sig'))))
+    if request.mimetype == 'text/csv':
+        return list(csv.DictReader(io.StringIO(request.get_data(as_text=True).lstrip('\ufeff'))))
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('reservations')
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON array or CSV')
+    return data
+
+# 取り込む1行を検証する（問題があればValueError）
+def parse_import_row(row):
+    if not isinstance(row, dict):
+        raise ValueError('Row must be an object')
+    
+    res_type = str(row.get('type') or '').strip().upper()
+    if res_type not in RESERVATION_PREFIXES:
+        raise ValueError(f"Invalid type: {row.get('type')}")
+    
     try:
-        all_res = db.collection('reservation').stream()
-        max_number = 0
-        
-        for doc in all_res:
-            res_id = doc.id
-            if res_id.startswith(res_type):
-                try:
-                    number = int(res_id[1:])
-                    max_number = max(max_number, number)
-                except ValueError:
-                    continue
-        
-        return f"{res_type}{(max_number + 1):04d}"
-    except Exception as e:
-        print(f"Error generating ID: {e}")
-        return f"{res_type}0001"
+        count = int(row.get('count'))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid count: {row.get('count')}")
+    if count < 1:
+        raise ValueError(f"Invalid count: {count}")
+    
+    # 日付の省略時は種別から判定（種別は開催日ごとに決まっている）
+    date = str(row.get('date') or '').strip() or reservation_date(res_type, {})
+    if registry.day(date) is None:
+        raise ValueError(f"Invalid date: {date}")
+    if registry.day_of_id(res_type).date != date:
+        raise ValueError(f"Type {res_type} is not for {date}")
+    
+    time = str(row.get('time') or '').strip() or None
+    if is_vip_type(res_type) and vip_due_time(date, time) is None:
+        raise ValueError('Time (HH:MM) required for VIP')
+    
+    created_at = str(row.get('created_at') or '').strip() or None
+    if created_at:
+        try:
+            datetime.fromisoformat(created_at)
+        except ValueError:
+            raise ValueError(f"Invalid created_at: {created_at}")
+    
+    return {'type': res_type, 'count': count, 'date': date, 'time': time, 'created_at': created_at}
 
-# グループ割り当て
-def assign_to_group(reservation_id, count, res_type, group_collection):
+# 取り込む予約をグループに組み合わせる（メモリ上で、待機中のグループの空きから順にGROUP_STRATEGYで詰める）
+# 戻り値: グループ（slot）の一覧。新しいグループはnumber=Noneで、作った順に並ぶ
+def plan_import_groups(rows, group_collection):
+    capacity = group_capacity(GROUP_DATES.get(group_collection))
+    waiting_groups = sorted((group for group in list_groups(group_collection) if group.status == 0),
+                            key=lambda group: group.number)
+    head_counts = groups_head_counts(waiting_groups)
+    slots = [{'number': group.number, 'group': group, 'parity': group.number % 2,
+              'head_count': head_counts[group.number], 'rows': []} for group in waiting_groups]
+    
+    for row in rows:
+        parity = 1 if registry.kind(row['type']) == 'reserved' else 0
+        open_slots = [(pos, slot['head_count']) for pos, slot in enumerate(slots) if slot['parity'] == parity]
+        choices = GROUP_STRATEGY.candidates(open_slots, row['count'], capacity)
+        if choices:
+            slot = slots[choices[0]]
+        else:
+            slot = {'number': None, 'group': None, 'parity': parity, 'head_count': 0, 'rows': []}
+            slots.append(slot)
+        slot['head_count'] += row['count']
+        slot['rows'].append(row)
+    
+    return [slot for slot in slots if slot['rows']]
+
+# 取り込む予約のグループのメンバー情報
+def import_member_summary(data):
+    return member_summary(data['count'], 0, False, data.get('time'))
+
+# 取り込んだ予約1件分の統計の増減をstats（日付 → 増減）に足す
+def add_import_stats(stats, res_id, data):
+    counts = stats.setdefault(data['date'], {})
+    for field_path in ('total', 'waiting', f"by_type.{res_id[0]}", f"by_hour.{stats_hour(data['created_at'])}.created"):
+        counts[field_path] = counts.get(field_path, 0) + 1
+
+# 取り込む予約をまとめて既存のグループに追加する（トランザクションでグループを読み直してから追加）
+# 計画の後に受付・呼び出し・スケジューラがグループを変えて、待機中でなくなったり定員を超える場合はNoneを返す
+def join_import_group(transaction, group_collection, group_num, writes):
+    ref = db.collection(group_collection).document(str(group_num))
+    snapshot = ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return None
+    group = GroupRecord(group_num, snapshot.to_dict())
+    total = sum(data['count'] for _, _, data in writes)
+    if group.status != 0 or (group.has_summary() and group.head_count + total > group_capacity(GROUP_DATES.get(group_collection))):
+        return None
+    
+    writer = BatchWriter(transaction)
+    stats = {}
+    for _, res_id, data in writes:
+        writer.set_reservation(res_id, data)
+        add_import_stats(stats, res_id, data)
+    writer.update_group(group_collection, group_num, group_join_many_fields(
+        group, {res_id: import_member_summary(data) for _, res_id, data in writes}))
+    for date, counts in stats.items():
+        writer.increment_stats(date, counts)
+    return writer
+
+# 取り込む予約1件を受付と同じ方法でグループに入れる（計画したグループに入れなかった場合）
+def place_import_reservation(transaction, group_collection, res_id, data):
+    writer = BatchWriter(transaction)
+    data = dict(data)
+    data['group'] = assign_to_group(res_id, data['count'], res_id[0], group_collection, writer)
+    writer.set_reservation(res_id, data)
+    stats = {}
+    add_import_stats(stats, res_id, data)
+    for date, counts in stats.items():
+        writer.increment_stats(date, counts)
+    return writer
+
+# 予約をまとめて取り込む（?dry_run=1 なら検証と組み合わせの確認だけ）
+# 事前予約の投入用。待機中のグループの空きにも詰める（既存のグループへの追加はトランザクションで読み直し、
+# 計画の後に変わっていたら1件ずつ受付と同じ方法で入れ直す）
+@app.route('/api/admin/reservations/import', methods=['POST'])
+@require_auth
+def import_reservations():
     try:
-        is_reserved = res_type in ['A', 'B']  # 事前予約
-        
-        # 既存のグループを取得
-        groups = db.collection(group_collection).stream()
-        group_list = []
+        started = time.perf_counter()
+        dry_run = request.args.get('dry_run') in ('1', 'true')
         
-        for group_doc in groups:
+        try:
+            rows = read_import_rows()
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            return jsonify({'error': str(e)}), 400
+        if not rows:
+            return jsonify({'error': 'No rows'}), 400
+        if len(rows) > MAX_IMPORT_ROWS:
+            return jsonify({'error': f'Too many rows (max {MAX_IMPORT_ROWS})'}), 400
+        
+        # 書き込む前に全行を検証
+        parsed = []
+        errors = []
+        for line, row in enumerate(rows, 1):
             try:
-                group_num = int(group_doc.id)
-                group_data = group_doc.to_dict()
-                
-                # ステータスが0のグループのみ
-                if group_data.get('status', 0) != 0:
-                    continue
-                
-                # 優先チェック: 奇数=事前予約, 偶数=当日来店
-                if is_reserved and group_num % 2 == 0:
-                    continue
-                if not is_reserved and group_num % 2 == 1:
+                parsed.append(parse_import_row(row))
+            except ValueError as e:
+                errors.append({'row': line, 'error': str(e)})
+        if errors:
+            return jsonify({'error': 'Invalid rows', 'error_count': len(errors), 'errors': errors[:100]}), 400
+        
+        # グループの組み合わせ（関係者予約は時刻にスケジューラが割り当てる）
+        plans = {}
+        for group_collection, date in GROUP_DATES.items():
+            rows_for_date = [row for row in parsed if row['date'] == date and not is_vip_type(row['type'])]
+            if rows_for_date:
+                plans[group_collection] = plan_import_groups(rows_for_date, group_collection)
+        vip_rows = [row for row in parsed if is_vip_type(row['type'])]
+        
+        report = {
+            'dry_run': dry_run,
+            'rows': len(parsed),
+            'groups_created': sum(1 for slots in plans.values() for slot in slots if slot['number'] is None),
+            'groups_joined': sum(1 for slots in plans.values() for slot in slots if slot['number'] is not None),
+            'vip': len(vip_rows)
+        }
+        if dry_run:
+            report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            return jsonify(report)
+        
+        # 予約番号は種別ごと、グループ番号は日付ごとにまとめて払い出す
+        id_starts = {}
+        for res_type in RESERVATION_PREFIXES:
+            needed = sum(1 for row in parsed if row['type'] == res_type)
+            if needed:
+                id_starts[res_type] = reserve_id_block(res_type, needed)
+        # 作成日時の指定がない行は、行の順に並ぶよう1マイクロ秒ずつずらす
+        now = datetime.now()
+        for index, row in enumerate(parsed):
+            row['id'] = f"{row['type']}{id_starts[row['type']]:04d}"
+            id_starts[row['type']] += 1
+            row['created_at'] = row['created_at'] or (now + timedelta(microseconds=index)).isoformat()
+        
+        for group_collection, slots in plans.items():
+            new_slots = [slot for slot in slots if slot['number'] is None]
+            if new_slots:
+                numbers = run_transaction('reserve_group_numbers', lambda transaction: next_group_numbers(
+                    transaction, group_collection, [slot['parity'] for slot in new_slots]))
+                for slot, number in zip(new_slots, numbers):
+                    slot['number'] = number
+        
+        # 新しいグループ（とそのメンバーの予約）は1つを単位に、500件以内ずつコミット
+        # 既存のグループへの追加は他の書き込みと競合するので、グループごとにトランザクションでコミット
+        units = []
+        joins = []
+        
+        def reservation_write(row, group_num):
+            data = {
+                'count': row['count'],
+                'status': 0,
+                'date': row['date'],
+                'group': group_num,
+                'created_at': row['created_at']
+            }
+            if row['time']:
+                data['time'] = row['time']
+            return ('reservation', row['id'], data)
+        
+        for group_collection, slots in plans.items():
+            for slot in slots:
+                unit = [reservation_write(row, slot['number']) for row in slot['rows']]
+                if slot['group'] is not None:
+                    joins.append((group_collection, slot['number'], unit))
                     continue
-                
-                # このグループの現在の人数を計算
-                current_reservations = group_data.get('reservation', [])
-                current_count = 0
-                
-                for r_id in current_reservations:
-                    r_doc = db.collection('reservation').document(r_id).get()
-                    if r_doc.exists:
-                        current_count += r_doc.to_dict().get('count', 0)
-                
-                group_list.append({
-                    'number': group_num,
-                    'current_count': current_count,
-                    'reservations': current_reservations
-                })
-            except ValueError:
+                members = {res_id: import_member_summary(data) for _, res_id, data in unit}
+                unit.append(('set_group', group_collection, slot['number'], {
+                    'status': 0,
+                    'reservation': list(members),
+                    'head_count': sum(member['count'] for member in members.values()),
+                    'members': members
+                }))
+                units.append(unit)
+        for row in vip_rows:
+            units.append([reservation_write(row, None)])
+        
+        batches = []
+        current = []
+        for unit in units:
+            # 統計ドキュメント（日付ごとに1件）の書き込みの分を空けておく
+            if current and len(current) + len(unit) > IMPORT_BATCH_WRITES - len(registry.days):
+                batches.append(current)
+                current = []
+            current.extend(unit)
+        if current:
+            batches.append(current)
+        
+        for index, batch in enumerate(batches, 1):
+            writer = BatchWriter()
+            stats = {}
+            for write in batch:
+                if write[0] == 'reservation':
+                    writer.set_reservation(write[1], write[2])
+                    add_import_stats(stats, write[1], write[2])
+                else:
+                    writer.set_group(write[1], write[2], write[3])
+            # 統計はそのバッチの予約の分を同じコミットで増やす（途中で失敗しても予約と食い違わない）
+            for date, counts in stats.items():
+                writer.increment_stats(date, counts)
+            writer.commit()
+            print(f"Import: batch {index}/{len(batches)} committed ({len(batch)} writes)")
+        
+        replanned = 0
+        for group_collection, group_num, writes in joins:
+            writer = run_transaction('import_join_group', lambda transaction: join_import_group(
+                transaction, group_collection, group_num, writes))
+            if writer is not None:
+                writer.commit()
                 continue
-        
-        # グループ番号でソート
-        group_list.sort(key=lambda x: x['number'])
-        
-        # 4人以下で収まるグループを探す
-        for group in group_list:
-            if group['current_count'] + count <= 4:
-                # このグループに追加
-                group['reservations'].append(reservation_id)
-                db.collection(group_collection).document(str(group['number'])).update({
-                    'reservation': group['reservations']
-                })
-                return group['number']
-        
-        # 既存のグループに入らない場合、新しいグループを作成
-        new_group_num = get_next_group_number(group_collection, is_reserved)
-        db.collection(group_collection).document(str(new_group_num)).set({
-            'status': 0,
-            'reservation': [reservation_id]
-        })
-        
-        return new_group_num
+            # 計画したグループが変わっていた（呼び出し済み・定員超過など）
+            print(f"Import: group {group_num} changed since planning, placing {len(writes)} reservations again")
+            replanned += 1
+            for _, res_id, data in writes:
+                run_transaction('import_place_reservation', lambda transaction: place_import_reservation(
+                    transaction, group_collection, res_id, data)).commit()
+        
+        for row in vip_rows:
+            schedule_vip(ReservationRecord(row['id'], row['date'], {'count': row['count'], 'time': row['time'], 'group': None}))
+        
+        report['batches'] = len(batches)
+        report['groups_replanned'] = replanned
+        report['reservation_ids'] = [row['id'] for row in parsed]
+        report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return jsonify(report)
     except Exception as e:
-        print(f"Error in assign_to_group: {e}")
-        return 1
+        print(f"Import error: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
 
-# 次のグループ番号を取得
-def get_next_group_number(group_collection, is_reserved):
-    try:
-        groups = db.collection(group_collection).stream()
-        existing_nums = set()
-        
-        for group_doc in groups:
+# 予約番号生成（プレフィックスごとのカウンターから採番）
+def generate_reservation_id(res_type, date):
+    with _id_blocks_lock:
+        block = _id_blocks.get(res_type)
+        # 手元のブロックを使い切ったらカウンターから次のブロックを確保
+        if block is None or block[0] > block[1]:
+            start = reserve_id_block(res_type, ID_BLOCK_SIZE)
+            block = [start, start + ID_BLOCK_SIZE - 1]
+            _id_blocks[res_type] = block
+        number = block[0]
+        block[0] += 1
+    
+    return f"{res_type}{number:04d}"
+
+# 予約番号のカウンター（開催日のcounters/reservation_{プレフィックス}、lastは払い出し済みの最大番号）
+_id_blocks = {}
+_id_blocks_lock = threading.Lock()
+
+def counter_ref(res_type):
+    return db.document(day_of_reservation(res_type).reservation_counter(res_type))
+
+# 既存の予約IDから最大番号を求める（カウンターの初期化用）
+def max_reservation_number(res_type):
+    max_number = 0
+    for res in list_all_reservations():
+        if res.id.startswith(res_type):
             try:
-                num = int(group_doc.id)
-                existing_nums.add(num)
+                max_number = max(max_number, int(res.id[1:]))
             except ValueError:
                 continue
-        
-        # 既存の番号がない場合
-        if not existing_nums:
-            return 1 if is_reserved else 2
-        
-        max_num = max(existing_nums)
-        
-        # 次の番号を計算（奇数or偶数を維持し、既存と重複しない）
-        next_num = max_num + 1
-        
-        # 奇数グループ（事前予約）が必要な場合
-        if is_reserved:
-            if next_num % 2 == 0:
-                next_num += 1
-        # 偶数グループ（当日来店）が必要な場合
+    return max_number
+
+# カウンターをトランザクションでsize進め、確保した番号の先頭を返す
+def reserve_id_block(res_type, size):
+    ref = counter_ref(res_type)
+    
+    def reserve(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if snapshot.exists:
+            last = snapshot.to_dict().get('last', 0)
         else:
-            if next_num % 2 == 1:
-                next_num += 1
-        
-        # 既存の番号と重複する場合はさらに+2
-        while next_num in existing_nums:
-            next_num += 2
+            # カウンター未作成（seed-counters前）は既存の予約から初期化
+            last = max_reservation_number(res_type)
+        transaction.set(ref, {'last': last + size, 'updated_at': datetime.now().isoformat()})
+        return last + 1
+    
+    return run_transaction('reserve_id_block', reserve)
+
+# グループ割り当て
+# writerはトランザクションのBatchWriter（予約の書き込みと同じトランザクションでグループに入れる）
+def assign_to_group(reservation_id, count, res_type, group_collection, writer):
+    is_reserved = registry.kind(res_type) == 'reserved'  # 事前予約
+    
+    # 既存のグループを取得
+    waiting_groups = []
+    
+    for group in list_groups(group_collection):
+        # ステータスが0のグループのみ
+        if group.status != 0:
+            continue
+        
+        # 優先チェック: 奇数=事前予約, 偶数=当日来店
+        if is_reserved and group.number % 2 == 0:
+            continue
+        if not is_reserved and group.number % 2 == 1:
+            continue
+        
+        waiting_groups.append(group)
+    
+    # グループ番号でソート
+    waiting_groups.sort(key=lambda group: group.number)
+    
+    return place_in_group(writer, group_collection, reservation_id, member_summary(count), waiting_groups,
+                          1 if is_reserved else 0)
+
+# 待機中のグループ（番号順）のうち定員内に収まるグループ（GROUP_STRATEGYで選ぶ）に予約を入れ、なければ新しいグループを作る
+# 候補はミラー（またはクエリ）の人数で絞り、トランザクション内でグループを読み直してから追加するので、
+# 複数の端末・インスタンスが同時に追加しても定員を超えない（競合したらrun_transactionがやり直す）
+def place_in_group(writer, group_collection, reservation_id, summary, waiting_groups, parity=None):
+    count = summary['count']
+    capacity = group_capacity(GROUP_DATES.get(group_collection))
+    head_counts = groups_head_counts(waiting_groups)
+    groups_by_number = {group.number: group for group in waiting_groups}
+    
+    for group_num in GROUP_STRATEGY.candidates([(group.number, head_counts[group.number]) for group in waiting_groups],
+                                               count, capacity):
+        group = groups_by_number[group_num]
+        
+        # サマリーのない旧データのグループは予約から数えた人数で判定する
+        if group.has_summary():
+            snapshot = db.collection(group_collection).document(str(group.number)).get(transaction=writer.transaction)
+            if not snapshot.exists:
+                continue
+            group = GroupRecord(group.number, snapshot.to_dict())
+            if group.status != 0 or group.head_count + count > capacity:
+                continue
         
-        return next_num
-    except Exception as e:
-        print(f"Error getting next group number: {e}")
-        return 1 if is_reserved else 2
+        # このグループに追加
+        writer.update_group(group_collection, group.number, group_join_fields(group, reservation_id, summary))
+        return group.number
+    
+    # 既存のグループに入らない場合、新しいグループを作成
+    new_group_num = next_group_number(writer.transaction, group_collection, parity)
+    writer.set_group(group_collection, new_group_num, {
+        'status': 0,
+        'reservation': [reservation_id],
+        'head_count': count,
+        'members': {reservation_id: summary}
+    })
+    
+    return new_group_num
+
+# グループ番号のカウンター（開催日のcounters、lastは払い出し済みの最大番号）
+def group_counter_ref(group_collection):
+    day = registry.day_of_groups(group_collection)
+    if day is None:
+        return db.collection('counters').document(f'group_number_{group_collection}')
+    return db.document(day.group_counter)
+
+# 次のグループ番号をトランザクションで払い出す
+# parity: 1=奇数（事前予約）, 0=偶数（当日来店）, None=指定なし（関係者・優先）
+# 番号は作成順に増えるので、呼び出し順（番号順）は今まで通り
+def allocate_group_number(group_collection, parity=None):
+    return run_transaction('allocate_group_number',
+                           lambda transaction: next_group_number(transaction, group_collection, parity))
+
+# トランザクション内でカウンターを進めて次のグループ番号を返す
+def next_group_number(transaction, group_collection, parity=None):
+    return next_group_numbers(transaction, group_collection, [parity])[0]
+
+# トランザクション内でparitiesの数だけグループ番号をまとめて払い出す（1件ずつ払い出した場合と同じ番号になる）
+def next_group_numbers(transaction, group_collection, parities):
+    ref = group_counter_ref(group_collection)
+    snapshot = ref.get(transaction=transaction)
+    if snapshot.exists:
+        last = snapshot.to_dict().get('last', 0)
+    else:
+        # カウンター未作成（seed-counters前）は既存のグループから初期化
+        last = max((group.number for group in list_groups(group_collection)), default=0)
+    
+    numbers = []
+    for parity in parities:
+        next_num = last + 1
+        # 奇数or偶数を維持する
+        if parity is not None and next_num % 2 != parity:
+            next_num += 1
+        numbers.append(next_num)
+        last = next_num
+    
+    transaction.set(ref, {'last': last, 'updated_at': datetime.now().isoformat()})
+    return numbers
 
 @app.route('/api/admin/statistics', methods=['GET'])
 @require_auth
+@conditional_get()
 def statistics():
     try:
-        date = request.args.get('date', '2025-11-01')
+        date = request.args.get('date', DEFAULT_DATE)
         
-        total = 0
-        visited = 0
-        cancelled = 0
-        waiting = 0
-        by_type = {}
-        
-        all_res = db.collection('reservation').stream()
-        for doc in all_res:
-            res_id = doc.id
-            data = doc.to_dict()
-            
-            res_type = res_id[0] if len(res_id) > 0 else 'X'
-            if data.get('date'):
-                res_date = data['date']
-            else:
-                res_date = '2025-11-01' if res_type in ['A', 'C', 'X'] else '2025-11-02'
-            
-            if res_date != date:
-                continue
-            
-            total += 1
-            status = data.get('status', 0)
-            
-            if status == 1:
-                visited += 1
-            elif status == 2:
-                cancelled += 1
-            else:
-                waiting += 1
-            
-            by_type[res_type] = by_type.get(res_type, 0) + 1
+        # 集計済みの統計ドキュメントを読む
+        snapshot = stats_ref(date).get()
+        if snapshot.exists:
+            stats = snapshot.to_dict()
+        else:
+            # まだ統計ドキュメントがない日は予約から集計する
+            docs = day_reservations_query(db, date).stream()
+            stats = aggregate_stats((doc.id, doc.to_dict()) for doc in docs)
         
         return jsonify({
-            'total': total,
-            'visited': visited,
-            'cancelled': cancelled,
-            'waiting': waiting,
-            'by_type': by_type,
-            'by_hour': {}
+            'total': stats.get('total', 0),
+            'visited': stats.get('visited', 0),
+            'cancelled': stats.get('cancelled', 0),
+            'waiting': stats.get('waiting', 0),
+            'by_type': stats.get('by_type', {}),
+            'by_hour': stats.get('by_hour', {})
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/admin/settings', methods=['GET'])
 @require_auth
+@conditional_get(per_date=False)
 def get_settings():
     try:
         doc = db.collection('settings').document('base').get()
@@ -996,7 +2251,312 @@ def update_settings():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# グループのhead_count / メンバー情報を予約ドキュメントから作り直す（既存データの移行・修復用）
+@app.cli.command('repair-groups')
+def repair_groups():
+    """グループのhead_count・メンバー情報を予約から作り直す"""
+    if init_db() is None:
+        print("❌ DB not ready")
+        return
+    
+    for group_collection in GROUP_COLLECTIONS:
+        group_docs = [doc for doc in db.collection(group_collection).stream()]
+        
+        # メンバーの予約をまとめて読み込む
+        res_ids = list(dict.fromkeys(r_id for doc in group_docs for r_id in doc.to_dict().get('reservation', [])))
+        reservations = {}
+        for start in range(0, len(res_ids), FETCH_BATCH_SIZE):
+            refs = [reservation_ref(r_id) for r_id in res_ids[start:start + FETCH_BATCH_SIZE]]
+            for doc in db.get_all(refs):
+                if doc.exists:
+                    reservations[doc.id] = doc.to_dict()
+        
+        batch = db.batch()
+        pending = 0
+        repaired = 0
+        
+        for doc in group_docs:
+            data = doc.to_dict()
+            members = {}
+            for r_id in data.get('reservation', []):
+                res_data = reservations.get(r_id)
+                if res_data is None:
+                    continue
+                members[r_id] = member_summary(res_data.get('count', 0), res_data.get('status', 0),
+                                               res_data.get('priority', False), res_data.get('time'))
+            head_count = sum(m['count'] for m in members.values())
+            
+            if data.get('head_count') == head_count and data.get('members') == members:
+                continue
+            
+            batch.update(doc.reference, {
+                'head_count': head_count,
+                'members': members,
+                'updated_at': firestore.SERVER_TIMESTAMP
+            })
+            pending += 1
+            repaired += 1
+            
+            # 1バッチ500件まで
+            if pending >= 500:
+                batch.commit()
+                batch = db.batch()
+                pending = 0
+        
+        if pending:
+            batch.commit()
+        
+        print(f"{group_collection}: {len(group_docs)} groups checked, {repaired} repaired")
+
+# dateフィールドのない旧データにIDから判定した日付を書き込む（既存データの移行用）
+# groupフィールドのない予約にはgroup=Noneも書き込む
+@app.cli.command('backfill-dates')
+def backfill_dates():
+    """dateフィールドのない予約に日付を書き込む"""
+    if init_db() is None:
+        print("❌ DB not ready")
+        return
+    
+    batch = db.batch()
+    pending = 0
+    checked = 0
+    updated = 0
+    
+    for doc in stream_all_reservations():
+        checked += 1
+        data = doc.to_dict()
+        if data.get('date') and 'group' in data:
+            continue
+        
+        # groupのない予約（割り当て前の関係者予約）にはNoneを入れて一覧の並び替えクエリに含める
+        batch.update(doc.reference, {
+            'date': reservation_date(doc.id, data),
+            'group': data.get('group'),
+            'updated_at': firestore.SERVER_TIMESTAMP
+        })
+        pending += 1
+        updated += 1
+        
+        # 1バッチ500件まで
+        if pending >= 500:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    
+    if pending:
+        batch.commit()
+    
+    print(f"{checked} reservations checked, {updated} updated")
+
+# 統計ドキュメントを予約から集計し直す（--checkは差分の確認だけ）
+@app.cli.command('recompute-stats')
+@click.option('--check', is_flag=True, help='書き込まずに差分だけ表示する')
+def recompute_stats(check):
+    """統計ドキュメントを予約から集計し直す"""
+    if init_db() is None:
+        print("❌ DB not ready")
+        return
+    
+    # 日付ごとに集計
+    by_date = {}
+    for doc in stream_all_reservations():
+        data = doc.to_dict()
+        by_date.setdefault(reservation_date(doc.id, data), []).append((doc.id, data))
+    
+    for date in sorted(by_date):
+        stats = aggregate_stats(by_date[date])
+        ref = stats_ref(date)
+        snapshot = ref.get()
+        current = snapshot.to_dict() if snapshot.exists else None
+        
+        if compact_stats(current) == compact_stats(stats):
+            print(f"{date}: ok ({stats['total']} reservations)")
+            continue
+        
+        if check:
+            print(f"{date}: mismatch (stored={current}, computed={stats})")
+        else:
+            ref.set(stats)
+            print(f"{date}: rebuilt ({stats['total']} reservations)")
+
+# 予約番号・グループ番号のカウンターを既存のIDから作成する（既存データの移行用）
+@app.cli.command('seed-counters')
+def seed_counters():
+    """予約番号・グループ番号のカウンターを既存のIDから作成する"""
+    if init_db() is None:
+        print("❌ DB not ready")
+        return
+    
+    # IDだけ分かればよいのでドキュメントの中身は読まない
+    max_numbers = {prefix: 0 for prefix in RESERVATION_PREFIXES}
+    refs = [ref for path in registry.reservation_collections() for ref in db.collection(path).list_documents()]
+    for ref in refs:
+        prefix = ref.id[:1]
+        if prefix not in max_numbers:
+            continue
+        try:
+            max_numbers[prefix] = max(max_numbers[prefix], int(ref.id[1:]))
+        except ValueError:
+            continue
+    
+    for prefix, max_number in max_numbers.items():
+        ref = counter_ref(prefix)
+        
+        # 既に進んでいるカウンターは戻さない
+        @firestore.transactional
+        def seed(transaction):
+            snapshot = ref.get(transaction=transaction)
+            last = snapshot.to_dict().get('last', 0) if snapshot.exists else 0
+            if last < max_number:
+                transaction.set(ref, {'last': max_number, 'updated_at': datetime.now().isoformat()})
+            return max(last, max_number)
+        
+        print(f"{prefix}: last={seed(db.transaction())}")
+    
+    # グループ番号のカウンター
+    for group_collection in GROUP_COLLECTIONS:
+        max_number = 0
+        for ref in db.collection(group_collection).list_documents():
+            try:
+                max_number = max(max_number, int(ref.id))
+            except ValueError:
+                continue
+        
+        ref = group_counter_ref(group_collection)
+        
+        @firestore.transactional
+        def seed(transaction):
+            snapshot = ref.get(transaction=transaction)
+            last = snapshot.to_dict().get('last', 0) if snapshot.exists else 0
+            if last < max_number:
+                transaction.set(ref, {'last': max_number, 'updated_at': datetime.now().isoformat()})
+            return max(last, max_number)
+        
+        print(f"{group_collection}: last={seed(db.transaction())}")
+
+# 旧レイアウト（reservation / group, group2 / counters / stats）のデータを日付ごとのパーティションにコピーする
+# パーティションに既にあるドキュメントは上書きしないので、何度実行してもよい
+# コピー後に STORAGE_LAYOUT=partitioned に切り替える（切り替え前の書き込みは、もう一度実行すればコピーされる）
+@app.cli.command('migrate-partitions')
+@click.option('--dry-run', is_flag=True, help='書き込まずに件数だけ表示する')
+def migrate_partitions(dry_run):
+    """予約・グループ・カウンター・統計を日付ごとのパーティションにコピーする"""
+    if init_db() is None:
+        print("❌ DB not ready")
+        return
+    
+    legacy = registry.with_layout('legacy')
+    partitioned = registry.with_layout('partitioned')
+    
+    batch = db.batch()
+    pending = 0
+    
+    def write(ref, data):
+        nonlocal batch, pending
+        if dry_run:
+            return
+        batch.set(ref, data)
+        pending += 1
+        # 1バッチ500件まで
+        if pending >= 500:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    
+    # 予約を日付ごとに振り分ける（dateのない旧データにはIDから判定した日付を入れる）
+    by_date = {}
+    for doc in db.collection(legacy.days[0].reservations).stream():
+        data = doc.to_dict()
+        data['date'] = reservation_date(doc.id, data)
+        data.setdefault('group', None)
+        by_date.setdefault(data['date'], []).append((doc.id, data))
+    unknown = sorted(set(by_date) - set(registry.dates))
+    if unknown:
+        print(f"⚠️ Skipping reservations for unknown dates: {', '.join(unknown)}")
+    
+    def copy_counter(source_path, target_path, max_number):
+        source = db.document(source_path).get()
+        target = db.document(target_path).get()
+        last = max(max_number,
+                   source.to_dict().get('last', 0) if source.exists else 0,
+                   target.to_dict().get('last', 0) if target.exists else 0)
+        write(db.document(target_path), {'last': last, 'updated_at': datetime.now().isoformat()})
+        return last
+    
+    for old, new in zip(legacy.days, partitioned.days):
+        reservations = by_date.get(old.date, [])
+        existing = {ref.id for ref in db.collection(new.reservations).list_documents()}
+        copied = 0
+        for res_id, data in reservations:
+            if res_id not in existing:
+                write(db.collection(new.reservations).document(res_id), data)
+                copied += 1
+        print(f"{old.date}: {copied}/{len(reservations)} reservations copied to {new.reservations}")
+        
+        existing = {ref.id for ref in db.collection(new.groups).list_documents()}
+        copied = 0
+        group_docs = list(db.collection(old.groups).stream())
+        for doc in group_docs:
+            if doc.id not in existing:
+                write(db.collection(new.groups).document(doc.id), doc.to_dict())
+                copied += 1
+        print(f"{old.date}: {copied}/{len(group_docs)} groups copied to {new.groups}")
+        
+        # カウンターは旧カウンター・既存の番号・パーティションのカウンターのうち最大のもの（戻さない）
+        for prefix in old.prefixes.values():
+            numbers = [int(res_id[1:]) for res_id, _ in reservations if res_id[:1] == prefix and res_id[1:].isdigit()]
+            last = copy_counter(old.reservation_counter(prefix), new.reservation_counter(prefix), max(numbers, default=0))
+            print(f"{old.date}: {prefix} last={last}")
+        numbers = [int(doc.id) for doc in group_docs if doc.id.isdigit()]
+        last = copy_counter(old.group_counter, new.group_counter, max(numbers, default=0))
+        print(f"{old.date}: group last={last}")
+        
+        # 統計はパーティションにまだなければコピー（旧レイアウトにもなければ予約から集計）
+        if not db.document(new.stats).get().exists:
+            stats = db.document(old.stats).get()
+            write(db.document(new.stats), stats.to_dict() if stats.exists else aggregate_stats(reservations))
+            print(f"{old.date}: stats {'copied' if stats.exists else 'computed'}")
+    
+    if pending:
+        batch.commit()
+    
+    print("Dry run: nothing written" if dry_run else "Done. Set STORAGE_LAYOUT=partitioned, then run repair-groups and recompute-stats --check")
+
+# グループの組み方を実際の予約で比較する（書き込みはしない）
+@app.cli.command('compare-grouping')
+@click.option('--date', 'dates', multiple=True, help='対象の日付（省略時は全日付）')
+@click.option('--capacity', type=int, default=None, help='定員（省略時はGROUP_CAPACITY）')
+def compare_grouping(dates, capacity):
+    """予約の作成順にグループを組み直して、戦略ごとのグループ数・平均充足率を表示する"""
+    if init_db() is None:
+        print("❌ DB not ready")
+        return
+    
+    for date in dates or GROUP_DATES.values():
+        date_capacity = capacity or group_capacity(date)
+        # 関係者予約は時刻で入るので除く
+        records = sorted((res for res in list_reservations(date) if not is_vip_type(res.type)),
+                         key=lambda res: (res.created_at or '', res.id))
+        reservations = [(res.created_at or '', registry.kind(res.type) == 'reserved', res.count) for res in records]
+        # 呼び出した時刻でグループを閉じる（優先グループはシミュレーションで作らないので除く）
+        calls = [group.called_at for group in list_groups(group_collection_for(date))
+                 if group.called_at and not group.is_priority]
+        print(f"{date}: {len(reservations)} reservations, capacity {date_capacity}")
+        if calls:
+            print(f"  online: groups close at the {len(calls)} recorded call times")
+        else:
+            print("  online: no calls recorded, groups are never closed (optimistic)")
+        
+        results = [(f"{name} (online)", grouping.simulate(reservations, date_capacity, name, calls))
+                   for name in grouping.STRATEGIES]
+        results += [(f"{name}-decreasing (offline)", grouping.pack_offline(reservations, date_capacity, name))
+                    for name in grouping.STRATEGIES]
+        for label, result in results:
+            print(f"  {label:<32} groups={result['groups']:<5} average_fill={result['average_fill']:.3f} "
+                  f"underfilled={result['underfilled_groups']}")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     print(f"Starting on port {port}")
+    start_warmup()
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,241 @@
+import asyncio
+import io
+import os
+import threading
+import time
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import request, jsonify, make_response
+import app as admin
+import metrics
+import storage
+from mirror import ReservationRecord, GroupRecord, waiting_key
+
+# ASGIサーバーで動かす場合の入口（uvicorn asgi:app など、a2wsgiが必要）
+# APIはすべてFlaskのハンドラーをa2wsgiのWSGIMiddlewareでスレッドで実行する（書き込み・SSEも同じ）。
+# ただしミラーが使えないとき（MIRROR_ENABLED=0 など）は、呼び出し画面が頻繁に読む next-group / calling-group だけ
+# Firestoreの非同期クライアント（firestore.AsyncClient）で読み、独立した読み込みを同時に行う（JSONはFlaskと同じ）
+
+# Flaskのハンドラーを実行するスレッド数（SSEの接続も1本ずつスレッドを使う）
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', '64'))
+
+flask_app = admin.app
+wsgi_app = WSGIMiddleware(flask_app, workers=ASGI_THREADS)
+
+# 非同期クライアント（初回に作成）。ローカルエンジンの場合は同じデータを読む互換クライアント
+_async_client = None
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        if admin.STORAGE_BACKEND in ('memory', 'sqlite'):
+            # 操作数はこちらで記録するので、計測用のラッパーの内側を使う
+            _async_client = storage.AsyncClient(getattr(admin.db, '_target', admin.db))
+        else:
+            from firebase_admin import firestore_async
+            _async_client = firestore_async.client()
+    return _async_client
+
+# ミラーが使えるときはメモリだけで答えられるのでFlaskのハンドラーに任せる
+# （まだ起動していない・作り直せる場合もFlask側でget_mirrorが起動する）
+def use_direct_reads():
+    if admin.db is None:
+        return False
+    if not admin.MIRROR_ENABLED:
+        return True
+    return admin._mirror is not None and not admin._mirror.is_ready()
+
+# --- 非同期の読み込み（操作数はFlaskと同じく /metrics と X-Firestore-* に記録する） ---
+async def read_query(query):
+    started = time.perf_counter()
+    docs = await query.get()
+    metrics.record('query', time.perf_counter() - started, reads=len(docs), queries=1)
+    return docs
+
+async def read_groups(group_collection, status=None):
+    query = get_async_client().collection(group_collection)
+    if status is not None:
+        query = query.where('status', '==', status)
+    result = []
+    for group_doc in await read_query(query):
+        try:
+            result.append(GroupRecord(int(group_doc.id), group_doc.to_dict()))
+        except ValueError:
+            continue
+    return result
+
+# 予約をまとめて取得（FETCH_BATCH_SIZE件ずつのget_allを同時に実行）
+async def read_reservations(res_ids):
+    client = get_async_client()
+    
+    async def read_chunk(chunk):
+        started = time.perf_counter()
+        refs = [admin.reservation_ref(r_id, client) for r_id in chunk]
+        docs = [doc async for doc in client.get_all(refs)]
+        metrics.record('get_all', time.perf_counter() - started, reads=len(docs))
+        return docs
+    
+    chunks = [res_ids[start:start + admin.FETCH_BATCH_SIZE] for start in range(0, len(res_ids), admin.FETCH_BATCH_SIZE)]
+    result = {}
+    for docs in await asyncio.gather(*[read_chunk(chunk) for chunk in chunks]):
+        for doc in docs:
+            if doc.exists:
+                data = doc.to_dict()
+                result[doc.id] = ReservationRecord(doc.id, admin.reservation_date(doc.id, data), data)
+    return result
+
+async def read_members(groups):
+    legacy_ids = admin.legacy_member_ids(groups)
+    fetched = await read_reservations(legacy_ids) if legacy_ids else {}
+    return admin.groups_members(groups, fetched)
+
+# --- ミラーなしで読むハンドラー（app.py の同名のハンドラーと同じ結果を返す） ---
+# 次に呼び出すグループを取得（優先予約のスキャンとグループの読み込みを同時に行う）
+async def get_next_group():
+    try:
+        date = request.args.get('date', admin.DEFAULT_DATE)
+        error = admin.check_date(date)
+        if error is not None:
+            return error
+        group_collection = admin.group_collection_for(date)
+        
+        priority_query = admin.reservations_query(get_async_client(), date, status=0, priority=True)
+        priority_docs, groups = await asyncio.gather(read_query(priority_query), read_groups(group_collection, status=0))
+        
+        # 優先予約がある場合はグループを作る書き込みがあるので、Flaskのハンドラーで処理する
+        if priority_docs:
+            return await asyncio.to_thread(admin.get_next_group)
+        
+        waiting_groups = sorted(groups, key=waiting_key)  # 優先グループ→グループ番号順
+        
+        for start in range(0, len(waiting_groups), admin.MEMBER_FETCH_WINDOW):
+            window = waiting_groups[start:start + admin.MEMBER_FETCH_WINDOW]
+            members = await read_members(window)
+            
+            for group in window:
+                reservations = [m for m in members[group.number] if m['status'] == 0]
+                has_priority = any(m['priority'] for m in reservations)
+                
+                if reservations:
+                    return jsonify({
+                        'group_number': group.number,
+                        'reservations': reservations,
+                        'has_priority': has_priority
+                    })
+        
+        return jsonify({'group_number': None, 'reservations': []})
+    except Exception as e:
+        print(f"Error in get_next_group (direct read): {e}")
+        return jsonify({'error': str(e)}), 500
+
+# 呼び出し中のグループを取得
+async def get_calling_group():
+    try:
+        date = request.args.get('date', admin.DEFAULT_DATE)
+        error = admin.check_date(date)
+        if error is not None:
+            return error
+        group_collection = admin.group_collection_for(date)
+        
+        groups = sorted(await read_groups(group_collection, status=1), key=lambda group: group.number)
+        
+        for group in groups:
+            reservations = (await read_members([group]))[group.number]
+            return jsonify({
+                'group_number': group.number,
+                'reservations': reservations
+            })
+        
+        return jsonify({'group_number': None, 'reservations': []})
+    except Exception as e:
+        print(f"Error in get_calling_group (direct read): {e}")
+        return jsonify({'error': str(e)}), 500
+
+# conditional_getと同じヘッダー（ミラーがないのでETagは付けない）
+def no_cache(response):
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Authorization')
+    return response
+
+STREAM_PATH = '/api/admin/stream'
+
+DIRECT_READ_ROUTES = {
+    '/api/admin/next-group': (get_next_group, None),
+    '/api/admin/calling-group': (get_calling_group, no_cache)
+}
+
+# before_request（接続・スケジューラの起動、メトリクスなど）と認証
+def before_handler():
+    response = flask_app.preprocess_request()
+    if response is None:
+        response = admin.check_auth()
+    return response
+
+# ハンドラーをFlaskのリクエストコンテキストの中で実行する
+# （認証・before_request / after_request（CORS・計測・圧縮）はFlaskのものを、イベントループを止めないようスレッドで実行する）
+async def call_direct_read(scope, send, handler, finish):
+    environ = build_environ(scope, io.BytesIO(b''))
+    with flask_app.request_context(environ):
+        response = await asyncio.to_thread(before_handler)
+        if response is None:
+            response = await handler()
+        response = make_response(response)
+        if finish is not None and response.status_code == 200:
+            response = finish(response)
+        response = await asyncio.to_thread(flask_app.process_response, response)
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers.to_wsgi_list()]
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+# SSE（GET、本文なし）はWSGIでは切断が分からないので、切断を監視してscopeのdisconnectedで知らせる
+# （a2wsgiはscopeをenviron['asgi.scope']に入れるので、app.py の stream() が見て生成を止める）
+async def call_stream(scope, receive, send):
+    disconnected = threading.Event()
+    
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+    
+    async def receive_body():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+    
+    # 切断後の送信は捨てる（スレッドは次のハートビートで止まる）
+    async def send_open(message):
+        if not disconnected.is_set():
+            await send(message)
+    
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await wsgi_app(dict(scope, disconnected=disconnected), receive_body, send_open)
+    finally:
+        watcher.cancel()
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # 接続・ミラー・スケジューラの準備はバックグラウンドで行う（終わったかどうかは /ready で分かる）
+            admin.start_warmup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            wsgi_app.executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    
+    is_get = scope['type'] == 'http' and scope['method'] == 'GET'
+    route = DIRECT_READ_ROUTES.get(scope['path']) if is_get else None
+    if route is not None and use_direct_reads():
+        await call_direct_read(scope, send, *route)
+    elif is_get and scope['path'] == STREAM_PATH:
+        await call_stream(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
@@ -0,0 +1,450 @@
+"""学園祭当日を想定した管理APIの負荷試験
+
+1日分の予約（A/B/C/Dの通常・当日予約と時間指定のX/Y）を投入してから、
+複数スレッドで実際の操作（予約作成・次のグループ・呼び出し・来店・不在・一覧・統計）を
+混ぜて実行し、操作ごとのレイテンシ（p50/p95/p99）・スループット・Firestore操作数をJSONに保存する。
+投入後に新しいプロセスを起動して、import・/ready・最初のリクエストまでの時間も測る（--no-cold-start で省略）。
+
+    python benchmark.py                                 # メモリ上のエンジンで実行
+    python benchmark.py --backend sqlite --walkins 5000
+    python benchmark.py --layout partitioned            # 日付ごとのパーティション（events.py）で実行
+    FIRESTORE_EMULATOR_HOST=localhost:8081 python benchmark.py --backend emulator
+    python benchmark.py --compare bench/old.json bench/new.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+import events
+
+# 開催日と予約番号の種別（app.pyと同じEVENT_DAYS）
+DAYS = events.Registry.parse(os.environ.get('EVENT_ID', 'default'), os.environ.get('EVENT_DAYS'))
+
+# 操作ごとの実行割合（受付タブレット数台＋管理画面のポーリングを想定）
+DEFAULT_MIX = {
+    'create': 10,
+    'next_group': 15,
+    'call_group': 3,
+    'calling_group': 15,
+    'visit': 10,
+    'absent': 2,
+    'reservations': 25,
+    'statistics': 20
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='管理APIの負荷試験')
+    parser.add_argument('--backend', default='memory', choices=['memory', 'sqlite', 'emulator'])
+    parser.add_argument('--sqlite-path', default='bench.db')
+    parser.add_argument('--date', default=DAYS.default_date, choices=DAYS.dates)
+    parser.add_argument('--layout', default=os.environ.get('STORAGE_LAYOUT', 'legacy'), choices=events.LAYOUTS,
+                        help='保存先のレイアウト（events.py）')
+    parser.add_argument('--walkins', type=int, default=3000, help='投入する通常・当日予約の件数')
+    parser.add_argument('--vips', type=int, default=100, help='投入する時間指定予約の件数')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='実行時間（秒）')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-mirror', action='store_true', help='ミラーを使わずに実行する')
+    parser.add_argument('--out', default=None, help='結果のJSONファイル（既定: bench/<日時>.json）')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='保存した結果を比較する')
+    parser.add_argument('--no-cold-start', action='store_true', help='起動時間を計測しない')
+    parser.add_argument('--cold-start-probe', choices=['lazy', 'warm'], help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+# --- 環境の準備 ---
+# reset=Trueならsqliteのファイルを作り直す（起動時間の計測では投入済みのファイルをそのまま使う）
+def configure(args, reset=True):
+    os.environ['FIRESTORE_DEBUG_HEADERS'] = '1'
+    os.environ['MIRROR_ENABLED'] = '0' if args.no_mirror else '1'
+    os.environ['STORAGE_LAYOUT'] = args.layout
+    if args.backend == 'emulator':
+        if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+            sys.exit('FIRESTORE_EMULATOR_HOST is not set')
+        os.environ['STORAGE_BACKEND'] = 'firestore'
+    else:
+        os.environ['STORAGE_BACKEND'] = args.backend
+        os.environ['SQLITE_PATH'] = args.sqlite_path
+        if reset and args.backend == 'sqlite' and os.path.exists(args.sqlite_path):
+            os.remove(args.sqlite_path)
+
+def connect(app_module, args):
+    # エミュレーターは認証情報なしで接続する
+    if args.backend == 'emulator':
+        import firebase_admin
+        from firebase_admin import firestore
+        firebase_admin.initialize_app(options={'projectId': os.environ.get('GCLOUD_PROJECT', 'bench')})
+        return app_module.set_db(firestore.client())
+    return app_module.init_db()
+
+def load_app(args):
+    configure(args)
+    import app as app_module
+    connect(app_module, args)
+    return app_module
+
+# 1日分の予約とグループを投入（グループのサマリー・カウンター・統計はCLIで作る）
+def seed_day(app_module, args, rng):
+    db = app_module.db
+    day = app_module.registry.day(args.date)
+    types = day.prefixes
+    start = datetime.fromisoformat(f"{args.date}T09:00:00")
+    open_groups = {}
+    groups = {}
+    last_group = 0
+    docs = []
+    
+    for i in range(args.walkins):
+        is_reserved = rng.random() < 0.5
+        res_type = types['reserved'] if is_reserved else types['walkin']
+        count = rng.choice([1, 1, 2, 2, 2, 3, 4])
+        parity = 1 if is_reserved else 0
+        
+        # 奇数=事前予約, 偶数=当日来店で4人まで詰める
+        group_num = open_groups.get(parity)
+        if group_num is None or groups[group_num]['head_count'] + count > 4:
+            group_num = last_group + 1
+            if group_num % 2 != parity:
+                group_num += 1
+            last_group = group_num
+            groups[group_num] = {'reservation': [], 'head_count': 0}
+            open_groups[parity] = group_num
+        groups[group_num]['reservation'].append(f"{res_type}{i + 1:04d}")
+        groups[group_num]['head_count'] += count
+        docs.append((f"{res_type}{i + 1:04d}", {
+            'count': count,
+            'status': 0,
+            'priority': False,
+            'date': args.date,
+            'group': group_num,
+            'created_at': (start + timedelta(seconds=i * 7)).isoformat()
+        }))
+    
+    # 前半のグループは案内済み、その次の1グループを呼び出し中にする
+    numbers = sorted(groups)
+    completed = set(numbers[:len(numbers) * 2 // 5])
+    calling = numbers[len(completed)] if len(completed) < len(numbers) else None
+    statuses = {}
+    for group_num in numbers:
+        statuses[group_num] = 2 if group_num in completed else 1 if group_num == calling else 0
+    for res_id, data in docs:
+        if statuses[data['group']] == 2:
+            data['status'] = 1 if rng.random() > 0.03 else 2
+    
+    for i in range(args.vips):
+        vip_time = start + timedelta(minutes=60 + rng.randrange(0, 360, 5))
+        docs.append((f"{types['vip']}{i + 1:04d}", {
+            'count': rng.choice([1, 2, 3]),
+            'status': 0,
+            'priority': False,
+            'date': args.date,
+            'group': None,
+            'time': vip_time.strftime('%H:%M'),
+            'created_at': (start - timedelta(days=1)).isoformat()
+        }))
+    
+    writes = [(db.collection(day.reservations).document(res_id), data) for res_id, data in docs]
+    for group_num in numbers:
+        writes.append((db.collection(day.groups).document(str(group_num)), {
+            'status': statuses[group_num],
+            'reservation': groups[group_num]['reservation']
+        }))
+    for chunk in range(0, len(writes), 400):
+        batch = db.batch()
+        for ref, data in writes[chunk:chunk + 400]:
+            batch.set(ref, data)
+        batch.commit()
+    
+    runner = app_module.app.test_cli_runner()
+    for command in ('seed-counters', 'repair-groups', 'recompute-stats'):
+        result = runner.invoke(args=[command])
+        print(f"  {command}: {result.output.strip().splitlines()[-1] if result.output.strip() else result.exit_code}")
+    return {'reservations': len(docs), 'groups': len(numbers)}
+
+# --- 操作 ---
+class Workload:
+    """スレッド間で共有する状態（次のグループ・呼び出し中のメンバーなど）"""
+    
+    def __init__(self, date, types):
+        self.date = date
+        self.types = types
+        self.lock = threading.Lock()
+        self.next_group = None
+        self.calling_members = []
+        self.etags = {}
+    
+    def op_create(self, client, headers, rng):
+        res_type = rng.choice([self.types['reserved'], self.types['walkin']])
+        return client.post('/api/admin/reservations/create', headers=headers,
+                           json={'type': res_type, 'count': rng.choice([1, 2, 2, 3, 4]), 'date': self.date})
+    
+    def op_next_group(self, client, headers, rng):
+        response = client.get(f'/api/admin/next-group?date={self.date}', headers=headers)
+        data = response.get_json(silent=True) or {}
+        with self.lock:
+            self.next_group = data.get('group_number')
+        return response
+    
+    def op_call_group(self, client, headers, rng):
+        with self.lock:
+            group_num, self.next_group = self.next_group, None
+        if group_num is None:
+            return None
+        return client.post('/api/admin/call-group', headers=headers,
+                           json={'date': self.date, 'group_number': group_num})
+    
+    def op_calling_group(self, client, headers, rng):
+        response = client.get(f'/api/admin/calling-group?date={self.date}', headers=headers)
+        data = response.get_json(silent=True) or {}
+        with self.lock:
+            self.calling_members = [r['reservation_id'] for r in data.get('reservations', []) if r.get('status') == 0]
+        return response
+    
+    def _take_member(self):
+        with self.lock:
+            return self.calling_members.pop() if self.calling_members else None
+    
+    def op_visit(self, client, headers, rng):
+        res_id = self._take_member()
+        if res_id is None:
+            return None
+        return client.post(f'/api/admin/reservations/{res_id}/visit', headers=headers)
+    
+    def op_absent(self, client, headers, rng):
+        res_id = self._take_member()
+        if res_id is None:
+            return None
+        return client.post(f'/api/admin/reservations/{res_id}/absent', headers=headers)
+    
+    # 一覧・統計は画面のポーリングと同じくETagを付けて取得する
+    def _poll(self, client, headers, url):
+        request_headers = dict(headers)
+        etag = self.etags.get(url)
+        if etag:
+            request_headers['If-None-Match'] = etag
+        response = client.get(url, headers=request_headers)
+        if response.headers.get('ETag'):
+            self.etags[url] = response.headers['ETag']
+        return response
+    
+    def op_reservations(self, client, headers, rng):
+        return self._poll(client, headers, f'/api/admin/reservations?date={self.date}')
+    
+    def op_statistics(self, client, headers, rng):
+        return self._poll(client, headers, f'/api/admin/statistics?date={self.date}')
+
+# --- 起動時間（新しいプロセスで計測） ---
+# lazy: 最初のリクエストが接続・ミラーの読み込みを待つ場合
+# warm: /ready が200になるまで待ってから最初のリクエストを送る場合（Cloud Runのスタートアッププローブと同じ）
+def probe_cold_start(args, mode):
+    configure(args, reset=False)
+    started = time.perf_counter()
+    import app as app_module
+    result = {'import_ms': round((time.perf_counter() - started) * 1000, 3)}
+    if args.backend == 'emulator':
+        connect(app_module, args)
+    
+    import jwt
+    token = jwt.encode({'exp': datetime.utcnow() + timedelta(hours=1)}, app_module.JWT_SECRET, algorithm='HS256')
+    client = app_module.app.test_client()
+    if mode == 'warm':
+        step = time.perf_counter()
+        while client.get('/ready').status_code != 200:
+            if time.perf_counter() - step > 120:
+                sys.exit('not ready in 120s')
+            time.sleep(0.005)
+        result['ready_ms'] = round((time.perf_counter() - step) * 1000, 3)
+    
+    step = time.perf_counter()
+    response = client.get(f'/api/admin/next-group?date={args.date}', headers={'Authorization': f'Bearer {token}'})
+    result['first_request_ms'] = round((time.perf_counter() - step) * 1000, 3)
+    result['first_request_status'] = response.status_code
+    result['total_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    result['app_timings'] = app_module.startup_timings
+    print(json.dumps(result))
+
+def measure_cold_start(args):
+    result = {'seeded': args.backend != 'memory'}
+    for mode in ('lazy', 'warm'):
+        command = [sys.executable, os.path.abspath(__file__), '--cold-start-probe', mode, '--backend', args.backend,
+                   '--sqlite-path', args.sqlite_path, '--date', args.date, '--layout', args.layout]
+        if args.no_mirror:
+            command.append('--no-mirror')
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        result[mode] = json.loads(output.strip().splitlines()[-1])
+    return result
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+def run_workload(app_module, args, workload, token):
+    mix = list(DEFAULT_MIX.items())
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    
+    def worker(index):
+        rng = random.Random(args.seed * 1000 + index)
+        client = app_module.app.test_client()
+        headers = {'Authorization': f'Bearer {token}'}
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            response = getattr(workload, f'op_{name}')(client, headers, rng)
+            elapsed = time.perf_counter() - started
+            if response is None:
+                continue
+            sample = (
+                elapsed,
+                response.status_code,
+                int(response.headers.get('X-Firestore-Reads', 0)),
+                int(response.headers.get('X-Firestore-Writes', 0)),
+                int(response.headers.get('X-Firestore-Queries', 0))
+            )
+            with lock:
+                samples[name].append(sample)
+    
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+def summarize(samples, elapsed):
+    ops = {}
+    for name, rows in samples.items():
+        if not rows:
+            continue
+        latencies = [row[0] * 1000 for row in rows]
+        ops[name] = {
+            'calls': len(rows),
+            'errors': sum(1 for row in rows if row[1] >= 500),
+            'not_modified': sum(1 for row in rows if row[1] == 304),
+            'throughput_per_sec': round(len(rows) / elapsed, 2),
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 3),
+                'p95': round(percentile(latencies, 95), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'max': round(max(latencies), 3)
+            },
+            'firestore_per_call': {
+                'reads': round(sum(row[2] for row in rows) / len(rows), 2),
+                'writes': round(sum(row[3] for row in rows) / len(rows), 2),
+                'queries': round(sum(row[4] for row in rows) / len(rows), 2)
+            }
+        }
+    total_calls = sum(op['calls'] for op in ops.values())
+    return ops, {'calls': total_calls, 'throughput_per_sec': round(total_calls / elapsed, 2), 'elapsed_sec': round(elapsed, 2)}
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+def print_table(ops):
+    print(f"{'operation':<15}{'calls':>8}{'err':>5}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}{'reads':>8}{'writes':>8}")
+    for name, op in ops.items():
+        latency = op['latency_ms']
+        per_call = op['firestore_per_call']
+        print(f"{name:<15}{op['calls']:>8}{op['errors']:>5}{latency['p50']:>10}{latency['p95']:>10}"
+              f"{latency['p99']:>10}{per_call['reads']:>8}{per_call['writes']:>8}")
+
+# 2つの結果のp95とFirestore読み込み数を比較
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'operation':<15}{'p95 old':>10}{'p95 new':>10}{'change':>9}{'reads old':>11}{'reads new':>11}")
+    for name in sorted(set(old['ops']) | set(new['ops'])):
+        before = old['ops'].get(name)
+        after = new['ops'].get(name)
+        if before is None or after is None:
+            print(f"{name:<15} only in {'new' if before is None else 'old'}")
+            continue
+        p95_old = before['latency_ms']['p95']
+        p95_new = after['latency_ms']['p95']
+        change = f"{(p95_new - p95_old) / p95_old * 100:+.1f}%" if p95_old else '-'
+        print(f"{name:<15}{p95_old:>10}{p95_new:>10}{change:>9}"
+              f"{before['firestore_per_call']['reads']:>11}{after['firestore_per_call']['reads']:>11}")
+    
+    if old.get('cold_start') and new.get('cold_start'):
+        print(f"{'cold start':<20}{'old ms':>10}{'new ms':>10}")
+        for mode, key in (('lazy', 'import_ms'), ('lazy', 'first_request_ms'), ('warm', 'ready_ms'), ('warm', 'first_request_ms')):
+            print(f"{mode + ' ' + key[:-3]:<20}{old['cold_start'][mode][key]:>10}{new['cold_start'][mode][key]:>10}")
+
+def main():
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.cold_start_probe:
+        probe_cold_start(args, args.cold_start_probe)
+        return
+    
+    rng = random.Random(args.seed)
+    app_module = load_app(args)
+    if app_module.db is None:
+        sys.exit('storage is not available')
+    
+    print(f"Seeding {args.date}: {args.walkins} walk-ins, {args.vips} VIPs ({args.backend})")
+    seeded = seed_day(app_module, args, rng)
+    
+    import jwt
+    token = jwt.encode({'exp': datetime.utcnow() + timedelta(hours=1)}, app_module.JWT_SECRET, algorithm='HS256')
+    
+    cold_start = None
+    if not args.no_cold_start:
+        print("Measuring cold start")
+        cold_start = measure_cold_start(args)
+        for mode in ('lazy', 'warm'):
+            print(f"  {mode}: import {cold_start[mode]['import_ms']}ms, "
+                  f"ready {cold_start[mode].get('ready_ms', '-')}ms, first request {cold_start[mode]['first_request_ms']}ms")
+    
+    # ミラーの初回読み込みは計測に含めない
+    app_module.app.test_client().get('/health')
+    
+    print(f"Running {args.workers} workers for {args.duration}s")
+    workload = Workload(args.date, DAYS.day(args.date).prefixes)
+    samples, elapsed = run_workload(app_module, args, workload, token)
+    ops, total = summarize(samples, elapsed)
+    print_table(ops)
+    
+    result = {
+        'meta': {
+            'revision': git_revision(),
+            'started_at': datetime.now().isoformat(),
+            'backend': args.backend,
+            'layout': args.layout,
+            'mirror': not args.no_mirror,
+            'workers': args.workers,
+            'duration_sec': args.duration,
+            'seed': args.seed,
+            'seeded': seeded
+        },
+        'cold_start': cold_start,
+        'total': total,
+        'ops': ops
+    }
+    out = args.out or os.path.join('bench', f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"Saved {out} ({total['calls']} calls, {total['throughput_per_sec']}/s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import deque
+
+class ChangeFeed:
+    """ミラーが受け取った変更を /api/admin/stream に配信するためのイベント列（プロセス内）
+    
+    イベントIDは「起動ごとのエポック-連番」。別プロセスのIDや
+    バッファから消えた古いIDで再接続された場合は差分を返せないので、
+    呼び出し側で reset イベントを送って全件を取り直してもらう。
+    """
+    
+    def __init__(self, size=1000):
+        self.epoch = format(int(time.time() * 1000), 'x')
+        self._events = deque(maxlen=size)
+        self._seq = 0
+        self._versions = {}
+        self._global_version = 0
+        self._cond = threading.Condition()
+    
+    @property
+    def last_seq(self):
+        return self._seq
+    
+    def publish(self, kind, date, data):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, kind, date, data))
+            # 日付のないイベント（設定・reset）は全日付のバージョンを進める
+            if date is None:
+                self._global_version = self._seq
+            else:
+                self._versions[date] = self._seq
+            self._cond.notify_all()
+            return self._seq
+    
+    # 日付ごとのデータのバージョン（その日付に関係する最後のイベントの連番、dateがNoneなら全日付共通分のみ）
+    def version(self, date=None):
+        if date is None:
+            return self._global_version
+        return max(self._global_version, self._versions.get(date, 0))
+    
+    def event_id(self, seq):
+        return f"{self.epoch}-{seq}"
+    
+    # Last-Event-IDから連番を取り出す（このプロセスのIDでなければNone）
+    def parse_event_id(self, event_id):
+        epoch, _, seq = (event_id or '').partition('-')
+        if epoch != self.epoch:
+            return None
+        try:
+            return int(seq)
+        except ValueError:
+            return None
+    
+    # seqより後のイベント（バッファから消えていて差分を返せない場合はNone）
+    def since(self, seq):
+        with self._cond:
+            if seq > self._seq:
+                return None
+            if self._events and seq < self._events[0][0] - 1:
+                return None
+            return [event for event in self._events if event[0] > seq]
+    
+    # seqより後のイベントが届くまで待つ（最大timeout秒）
+    def wait(self, seq, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq > seq, timeout)
@@ -0,0 +1,124 @@
+import re
+
+# イベントの開催日と、予約番号の種別・保存先（日ごとのパーティション）の一覧
+#
+# EVENT_DAYS: "日付=事前予約,当日来店,関係者;..."（例: "2025-11-01=A,C,X;2025-11-02=B,D,Y"）
+#   予約番号の先頭文字で開催日と種別が決まる（1文字につき1日だけ）
+# STORAGE_LAYOUT:
+#   legacy      … reservation / group, group2, ... / counters / stats（全日付で1つのコレクション）
+#   partitioned … events/{EVENT_ID}/days/{日付}/reservations, groups, counters（統計は日付のドキュメント）
+#                 クエリは開催日のコレクションだけを読むので、過去のイベントのデータが増えても遅くならない
+#   既存のデータは flask migrate-partitions でパーティションにコピーしてから切り替える
+
+DEFAULT_EVENT_DAYS = '2025-11-01=A,C,X;2025-11-02=B,D,Y'
+LAYOUTS = ('legacy', 'partitioned')
+KINDS = ('reserved', 'walkin', 'vip')
+
+class Day:
+    """1日分の設定（日付・予約番号の種別・保存先のパス）"""
+    
+    def __init__(self, event, index, date, prefixes, layout):
+        self.event = event
+        self.index = index
+        self.date = date
+        self.prefixes = dict(zip(KINDS, prefixes))
+        self.layout = layout
+        if layout == 'partitioned':
+            base = f'events/{event}/days/{date}'
+            self.reservations = f'{base}/reservations'
+            self.groups = f'{base}/groups'
+            self.stats = base
+            self._counters = f'{base}/counters'
+            self._group_counter = 'group_number'
+        else:
+            self.reservations = 'reservation'
+            self.groups = 'group' if index == 0 else f'group{index + 1}'
+            self.stats = f'stats/{date}'
+            self._counters = 'counters'
+            self._group_counter = f'group_number_{self.groups}'
+    
+    # 予約のコレクションを他の日付と共有しているか（共有していればdateで絞り込む）
+    @property
+    def shared(self):
+        return self.layout == 'legacy'
+    
+    # 予約番号のカウンター（種別ごと）
+    def reservation_counter(self, res_type):
+        return f'{self._counters}/reservation_{res_type}'
+    
+    # グループ番号のカウンター
+    @property
+    def group_counter(self):
+        return f'{self._counters}/{self._group_counter}'
+
+class Registry:
+    """開催日の一覧。予約番号の先頭文字・日付・グループのコレクションから日を引く表を作っておく"""
+    
+    def __init__(self, event, days, layout='legacy'):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown storage layout: {layout} (choose from {', '.join(LAYOUTS)})")
+        self.event = event
+        self.layout = layout
+        self._spec = list(days)
+        self.days = [Day(event, index, date, prefixes, layout) for index, (date, prefixes) in enumerate(self._spec)]
+        if not self.days:
+            raise ValueError('No event days')
+        self._by_date = {day.date: day for day in self.days}
+        self._by_groups = {day.groups: day for day in self.days}
+        self._by_prefix = {}
+        self._kinds = {}
+        for day in self.days:
+            for kind, prefix in day.prefixes.items():
+                if prefix in self._by_prefix:
+                    raise ValueError(f"Reservation type {prefix} is used on more than one day")
+                self._by_prefix[prefix] = day
+                self._kinds[prefix] = kind
+    
+    @classmethod
+    def parse(cls, event, value, layout='legacy'):
+        days = []
+        for part in (value or DEFAULT_EVENT_DAYS).split(';'):
+            part = part.strip()
+            if not part:
+                continue
+            date, _, prefixes = part.partition('=')
+            prefixes = [prefix.strip().upper() for prefix in prefixes.split(',')]
+            if not re.fullmatch(r'\d{4}-\d{2}-\d{2}', date.strip()) or len(prefixes) != len(KINDS) \
+                    or not all(re.fullmatch(r'[A-Z]', prefix) for prefix in prefixes):
+                raise ValueError(f"Invalid event day: {part} (expected YYYY-MM-DD=A,C,X)")
+            days.append((date.strip(), prefixes))
+        return cls(event, days, layout)
+    
+    # 同じイベント・開催日で保存先だけ違うもの（移行用）
+    def with_layout(self, layout):
+        return Registry(self.event, self._spec, layout)
+    
+    @property
+    def default_date(self):
+        return self.days[0].date
+    
+    @property
+    def dates(self):
+        return [day.date for day in self.days]
+    
+    @property
+    def prefixes(self):
+        return sorted(self._by_prefix)
+    
+    def day(self, date):
+        return self._by_date.get(date)
+    
+    def day_of_groups(self, group_collection):
+        return self._by_groups.get(group_collection)
+    
+    # 予約番号（または種別）の先頭文字から開催日を引く（分からなければNone）
+    def day_of_id(self, res_id):
+        return self._by_prefix.get(res_id[:1])
+    
+    # 種別の区分（reserved / walkin / vip、分からなければNone）
+    def kind(self, res_type):
+        return self._kinds.get(res_type[:1])
+    
+    # 予約のコレクション → 日付（legacyは全日付で共有する1つで、日付はNone）
+    def reservation_collections(self):
+        return {day.reservations: None if day.shared else day.date for day in self.days}
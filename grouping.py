@@ -0,0 +1,111 @@
+# グループ編成（予約をどのグループに入れるか）の戦略と、定員・オフライン比較用の計算
+
+DEFAULT_CAPACITY = 4
+
+# 日付ごとの定員（"4" なら全日付、"2025-11-01=4,2025-11-02=5" なら日付別。指定のない日付はdefault）
+def parse_capacity(value, default=DEFAULT_CAPACITY):
+    capacities = {}
+    for part in (value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        date, sep, number = part.rpartition('=')
+        if sep:
+            capacities[date.strip()] = int(number)
+        else:
+            default = int(number)
+    return lambda date: capacities.get(date, default)
+
+# --- 1件ずつ届く予約の入れ先（オンライン） ---
+# groups: (グループ番号, 現在の人数) の一覧（番号順）。入れる候補のグループ番号を優先順で返す
+class FirstFit:
+    """番号が一番小さい、空きのあるグループに入れる（呼び出し順を崩さない）"""
+    name = 'first-fit'
+    
+    def candidates(self, groups, count, capacity):
+        return [number for number, head_count in groups if head_count + count <= capacity]
+
+class BestFit:
+    """入れた後の空きが一番少なくなるグループに入れる（同じなら番号が小さい方）"""
+    name = 'best-fit'
+    
+    def candidates(self, groups, count, capacity):
+        fits = [(capacity - head_count - count, number) for number, head_count in groups if head_count + count <= capacity]
+        return [number for _, number in sorted(fits)]
+
+STRATEGIES = {strategy.name: strategy for strategy in (FirstFit(), BestFit())}
+
+def get_strategy(name):
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown grouping strategy: {name} (choose from {', '.join(STRATEGIES)})")
+    return STRATEGIES[name]
+
+# --- まとめて組み合わせる（優先予約・オフライン比較） ---
+# items: (ID, 人数) の一覧。decreasing=Trueなら人数の多い順に入れる（first-fit-decreasing / best-fit-decreasing）
+# 定員を超える予約は分けられないので1件で1グループにする。戻り値はグループごとのIDの一覧
+def pack(items, capacity, strategy='first-fit', decreasing=True):
+    strategy = get_strategy(strategy)
+    if decreasing:
+        items = sorted(items, key=lambda item: -item[1])
+    bins = []
+    loads = []
+    for item_id, count in items:
+        choices = strategy.candidates(list(enumerate(loads)), count, capacity)
+        if choices:
+            bins[choices[0]].append(item_id)
+            loads[choices[0]] += count
+        else:
+            bins.append([item_id])
+            loads.append(count)
+    return bins
+
+# 1日分の予約を作成順に流して、グループ数と埋まり具合を求める（オフライン比較用）
+# reservations: (作成日時, 事前予約か, 人数) の作成順の一覧（関係者予約は除く）。奇数=事前予約, 偶数=当日来店 の振り分けは本番と同じ
+# calls: 実際にグループを呼び出した日時の一覧。呼び出しごとに待機中で番号が一番小さいグループを閉じ、以降は追加しない
+# （callsがなければグループは閉じないので、実際より詰め込める楽観的な結果になる）
+def simulate(reservations, capacity, strategy='first-fit', calls=()):
+    strategy = get_strategy(strategy)
+    groups = {}
+    waiting = set()
+    calls = sorted(calls)
+    called = 0
+    last = 0
+    for created_at, reserved, count in reservations:
+        while called < len(calls) and calls[called] <= created_at:
+            if waiting:
+                waiting.remove(min(waiting))
+            called += 1
+        
+        parity = 1 if reserved else 0
+        open_groups = [(number, groups[number]) for number in sorted(waiting) if number % 2 == parity]
+        choices = strategy.candidates(open_groups, count, capacity)
+        if choices:
+            groups[choices[0]] += count
+            continue
+        last += 1
+        if last % 2 != parity:
+            last += 1
+        groups[last] = count
+        waiting.add(last)
+    return summarize(groups.values(), capacity)
+
+# 予約の種別（事前予約・当日来店）ごとにまとめて組み合わせた場合（全予約が分かっている場合の目安）
+def pack_offline(reservations, capacity, strategy='first-fit'):
+    loads = []
+    for reserved in (True, False):
+        items = [(i, count) for i, (_, is_reserved, count) in enumerate(reservations) if is_reserved == reserved]
+        counts = dict(items)
+        for members in pack(items, capacity, strategy, decreasing=True):
+            loads.append(sum(counts[i] for i in members))
+    return summarize(loads, capacity)
+
+def summarize(loads, capacity):
+    loads = list(loads)
+    people = sum(loads)
+    return {
+        'groups': len(loads),
+        'people': people,
+        'average_fill': round(people / (len(loads) * capacity), 3) if loads else 0,
+        'full_groups': sum(1 for load in loads if load >= capacity),
+        'underfilled_groups': sum(1 for load in loads if load < capacity)
+    }
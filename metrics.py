@@ -0,0 +1,336 @@
+import threading
+import time
+from flask import g, has_request_context, request, Response
+
+# Firestoreの操作回数・レイテンシとAPIのリクエストを集計して /metrics（Prometheus形式）で公開する
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+OPS_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+FIRESTORE_OPS = ('read', 'write', 'query')
+
+_lock = threading.Lock()
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+    
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with _lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+    
+    def observe(self, *labels, value):
+        with _lock:
+            counts, total, count = self._values.get(labels, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[labels] = (counts, total + value, count + 1)
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        bucket_names = self.label_names + ('le',)
+        with _lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_format_labels(bucket_names, labels + (bound,))} {bucket_count}')
+                lines.append(f'{self.name}_bucket{_format_labels(bucket_names, labels + ("+Inf",))} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(self.label_names, labels)} {count}')
+        return lines
+
+REQUESTS = Counter('http_requests_total', 'APIリクエスト数', ('route', 'method', 'status'))
+REQUEST_ERRORS = Counter('http_request_errors_total', 'ステータス500以上のリクエスト数', ('route', 'method'))
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'APIのレイテンシ（秒）', ('route', 'method'))
+FIRESTORE_OPERATIONS = Counter('firestore_operations_total', 'Firestoreの操作数（read=ドキュメント読み込み, write=書き込み, query=クエリ）', ('route', 'op'))
+FIRESTORE_OPS_PER_REQUEST = Histogram('firestore_ops_per_request', '1リクエストあたりのFirestore操作数', ('route', 'op'), OPS_BUCKETS)
+FIRESTORE_RPC_LATENCY = Histogram('firestore_rpc_duration_seconds', 'Firestore呼び出しのレイテンシ（秒）', ('rpc',))
+FIRESTORE_LISTENER_READS = Counter('firestore_listener_reads_total', 'スナップショットリスナーが受け取ったドキュメント数', ('target',))
+FIRESTORE_TRANSACTIONS = Counter('firestore_transactions_total', 'トランザクションの結果（committed=成功, failed=再試行しても競合）', ('name', 'result'))
+FIRESTORE_TRANSACTION_CONFLICTS = Counter('firestore_transaction_conflicts_total', 'トランザクションの競合（再試行）回数', ('name',))
+
+REGISTRY = [REQUESTS, REQUEST_ERRORS, REQUEST_LATENCY, FIRESTORE_OPERATIONS, FIRESTORE_OPS_PER_REQUEST,
+            FIRESTORE_RPC_LATENCY, FIRESTORE_LISTENER_READS, FIRESTORE_TRANSACTIONS, FIRESTORE_TRANSACTION_CONFLICTS]
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# 現在のリクエストのルート（リクエスト外はbackground）
+def _current_route():
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return 'background' if not has_request_context() else 'unmatched'
+
+# Firestoreの操作を記録
+def record(rpc, seconds, reads=0, writes=0, queries=0):
+    FIRESTORE_RPC_LATENCY.observe(rpc, value=seconds)
+    route = _current_route()
+    for op, count in (('read', reads), ('write', writes), ('query', queries)):
+        if not count:
+            continue
+        FIRESTORE_OPERATIONS.inc(route, op, amount=count)
+        if has_request_context():
+            ops = g.setdefault('firestore_ops', dict.fromkeys(FIRESTORE_OPS, 0))
+            ops[op] += count
+
+# トランザクションの結果を記録（conflicts: 競合して再試行した回数）
+def record_transaction(name, conflicts, committed):
+    if conflicts:
+        FIRESTORE_TRANSACTION_CONFLICTS.inc(name, amount=conflicts)
+    FIRESTORE_TRANSACTIONS.inc(name, 'committed' if committed else 'failed')
+
+# 現在のリクエストでのFirestore操作数
+def request_ops():
+    if not has_request_context():
+        return dict.fromkeys(FIRESTORE_OPS, 0)
+    return g.setdefault('firestore_ops', dict.fromkeys(FIRESTORE_OPS, 0))
+
+# --- Firestoreクライアントのラッパー ---
+class _Proxy:
+    def __init__(self, target):
+        self._target = target
+    
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+def _unwrap(value):
+    return value._target if isinstance(value, _Proxy) else value
+
+def _count_listener(target, callback):
+    def on_snapshot(docs, changes, read_time):
+        FIRESTORE_LISTENER_READS.inc(target, amount=len(changes))
+        return callback(docs, changes, read_time)
+    return on_snapshot
+
+class QueryProxy(_Proxy):
+    def _wrap(self, result):
+        return QueryProxy(result)
+    
+    def where(self, *args, **kwargs):
+        return self._wrap(self._target.where(*args, **kwargs))
+    
+    def order_by(self, *args, **kwargs):
+        return self._wrap(self._target.order_by(*args, **kwargs))
+    
+    def limit(self, *args, **kwargs):
+        return self._wrap(self._target.limit(*args, **kwargs))
+    
+    def start_after(self, *args, **kwargs):
+        return self._wrap(self._target.start_after(*args, **kwargs))
+    
+    def select(self, *args, **kwargs):
+        return self._wrap(self._target.select(*args, **kwargs))
+    
+    def document(self, *args, **kwargs):
+        return DocumentProxy(self._target.document(*args, **kwargs))
+    
+    def stream(self, transaction=None):
+        started = time.perf_counter()
+        reads = 0
+        try:
+            for doc in self._target.stream(transaction=_unwrap(transaction)):
+                reads += 1
+                yield doc
+        finally:
+            record('query', time.perf_counter() - started, reads=reads, queries=1)
+    
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+    
+    def list_documents(self, *args, **kwargs):
+        started = time.perf_counter()
+        refs = list(self._target.list_documents(*args, **kwargs))
+        record('list_documents', time.perf_counter() - started, reads=len(refs), queries=1)
+        return refs
+    
+    def add(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._target.add(*args, **kwargs)
+        record('add', time.perf_counter() - started, writes=1)
+        return result
+    
+    def on_snapshot(self, callback):
+        return self._target.on_snapshot(_count_listener(getattr(self._target, 'id', 'query'), callback))
+
+class DocumentProxy(_Proxy):
+    def collection(self, *args, **kwargs):
+        return QueryProxy(self._target.collection(*args, **kwargs))
+    
+    def get(self, *args, transaction=None, **kwargs):
+        started = time.perf_counter()
+        result = self._target.get(*args, transaction=_unwrap(transaction), **kwargs)
+        record('get', time.perf_counter() - started, reads=1)
+        return result
+    
+    def _write(self, rpc, *args, **kwargs):
+        started = time.perf_counter()
+        result = getattr(self._target, rpc)(*args, **kwargs)
+        record(rpc, time.perf_counter() - started, writes=1)
+        return result
+    
+    def set(self, *args, **kwargs):
+        return self._write('set', *args, **kwargs)
+    
+    def update(self, *args, **kwargs):
+        return self._write('update', *args, **kwargs)
+    
+    def create(self, *args, **kwargs):
+        return self._write('create', *args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        return self._write('delete', *args, **kwargs)
+    
+    def on_snapshot(self, callback):
+        return self._target.on_snapshot(_count_listener(self._target.parent.id, callback))
+
+# WriteBatch / Transaction の書き込みを数える（コミット時に記録）
+class _WriterProxy(_Proxy):
+    def __init__(self, target):
+        super().__init__(target)
+        self._pending = 0
+    
+    def set(self, reference, *args, **kwargs):
+        self._pending += 1
+        return self._target.set(_unwrap(reference), *args, **kwargs)
+    
+    def update(self, reference, *args, **kwargs):
+        self._pending += 1
+        return self._target.update(_unwrap(reference), *args, **kwargs)
+    
+    def create(self, reference, *args, **kwargs):
+        self._pending += 1
+        return self._target.create(_unwrap(reference), *args, **kwargs)
+    
+    def delete(self, reference, *args, **kwargs):
+        self._pending += 1
+        return self._target.delete(_unwrap(reference), *args, **kwargs)
+
+class BatchProxy(_WriterProxy):
+    def __len__(self):
+        return len(self._target)
+    
+    def commit(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._target.commit(*args, **kwargs)
+        record('commit', time.perf_counter() - started, writes=self._pending)
+        self._pending = 0
+        return result
+
+# firestore.transactional から呼ばれる _begin / _commit を経由して記録する
+# コミット結果（update_time）はwrite_resultsに残す（ミラーへの反映で使う）
+class TransactionProxy(_WriterProxy):
+    def __init__(self, target):
+        super().__init__(target)
+        self.write_results = None
+    
+    def _begin(self, *args, **kwargs):
+        self._pending = 0
+        self.write_results = None
+        return self._target._begin(*args, **kwargs)
+    
+    def _commit(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._target._commit(*args, **kwargs)
+        record('transaction_commit', time.perf_counter() - started, writes=self._pending)
+        self.write_results = result
+        return result
+
+class ClientProxy(_Proxy):
+    def collection(self, *args, **kwargs):
+        return QueryProxy(self._target.collection(*args, **kwargs))
+    
+    def document(self, *args, **kwargs):
+        return DocumentProxy(self._target.document(*args, **kwargs))
+    
+    def batch(self):
+        return BatchProxy(self._target.batch())
+    
+    def transaction(self, *args, **kwargs):
+        return TransactionProxy(self._target.transaction(*args, **kwargs))
+    
+    def get_all(self, references, *args, transaction=None, **kwargs):
+        started = time.perf_counter()
+        reads = 0
+        try:
+            for doc in self._target.get_all([_unwrap(ref) for ref in references], *args,
+                                            transaction=_unwrap(transaction), **kwargs):
+                reads += 1
+                yield doc
+        finally:
+            record('get_all', time.perf_counter() - started, reads=reads)
+
+# dbを計測用のラッパーで包む
+def instrument(client):
+    if client is None or isinstance(client, ClientProxy):
+        return client
+    return ClientProxy(client)
+
+# リクエストの計測と /metrics を登録
+# debug_headers=True（またはapp.debug）の場合はレスポンスに X-Firestore-Reads などを付ける
+# check_auth: /metrics の認証（問題があればエラーのレスポンス、なければNoneを返す関数）
+def init_app(app, debug_headers=False, check_auth=None):
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+    
+    @app.after_request
+    def record_request(response):
+        route = _current_route()
+        if route == '/metrics':
+            return response
+        method = request.method
+        elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+        REQUESTS.inc(route, method, str(response.status_code))
+        REQUEST_LATENCY.observe(route, method, value=elapsed)
+        if response.status_code >= 500:
+            REQUEST_ERRORS.inc(route, method)
+        
+        ops = request_ops()
+        for op in FIRESTORE_OPS:
+            FIRESTORE_OPS_PER_REQUEST.observe(route, op, value=ops[op])
+        
+        if debug_headers or app.debug:
+            response.headers['X-Firestore-Reads'] = str(ops['read'])
+            response.headers['X-Firestore-Writes'] = str(ops['write'])
+            response.headers['X-Firestore-Queries'] = str(ops['query'])
+        return response
+    
+    @app.route('/metrics')
+    def metrics():
+        if check_auth is not None:
+            error = check_auth()
+            if error is not None:
+                return error
+        return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,461 @@
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Firestoreの変換値（Increment / ArrayUnion など）をローカルのデータに適用する
+# （google-cloud-firestoreがない環境ではstorageの互換クラス）
+from storage import ArrayRemove, ArrayUnion, DELETE_FIELD, Increment, SERVER_TIMESTAMP
+
+def _resolve(value, current):
+    if isinstance(value, Increment):
+        return (current or 0) + value.value
+    if isinstance(value, ArrayUnion):
+        return list(current or []) + [v for v in value.values if v not in (current or [])]
+    if isinstance(value, ArrayRemove):
+        return [v for v in (current or []) if v not in value.values]
+    if value is SERVER_TIMESTAMP:
+        return datetime.now().isoformat()
+    return value
+
+# update()と同じ形式（ドット区切りのフィールドパス）の変更を辞書に適用
+def apply_fields(data, fields):
+    for field_path, value in fields.items():
+        parts = field_path.split('.')
+        node = data
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            else:
+                node[part] = dict(node[part])
+            node = node[part]
+        if value is DELETE_FIELD:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = _resolve(value, node.get(parts[-1]))
+    return data
+
+# 予約の簡易レコード（APIで使う項目だけを保持）
+class ReservationRecord:
+    FIELDS = ('count', 'group', 'status', 'priority', 'time', 'created_at', 'absent_at')
+    __slots__ = ('id', 'type', 'date', 'update_time') + FIELDS
+    
+    def __init__(self, res_id, date, data, update_time=None):
+        self.id = res_id
+        self.type = res_id[0] if len(res_id) > 0 else 'X'
+        self.date = date
+        self.count = data.get('count', 0)
+        self.group = data.get('group')
+        self.status = data.get('status', 0)
+        self.priority = data.get('priority', False)
+        self.time = data.get('time')
+        self.created_at = data.get('created_at', '')
+        self.absent_at = data.get('absent_at')
+        self.update_time = update_time
+    
+    def to_data(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+    
+    # 一部の項目を書き換えた新しいレコードを返す
+    def replace(self, fields, update_time=None):
+        return ReservationRecord(self.id, self.date, apply_fields(self.to_data(), fields), update_time or self.update_time)
+    
+    # グループのメンバーとして返す形式
+    def to_member(self):
+        return {
+            'reservation_id': self.id,
+            'count': self.count,
+            'type': self.type,
+            'time': self.time,
+            'status': self.status,
+            'priority': self.priority
+        }
+    
+    def to_dict(self):
+        return {
+            'reservation_id': self.id,
+            'type': self.type,
+            'count': self.count,
+            'group': self.group,
+            'status': self.status,
+            'created_at': self.created_at,
+            'time': self.time,
+            'date': self.date,
+            'priority': self.priority
+        }
+
+# グループの簡易レコード
+# head_count / members はグループドキュメント上のサマリー（旧データにはない）
+class GroupRecord:
+    FIELDS = ('status', 'reservation', 'is_priority', 'created_at', 'called_at', 'completed_at',
+              'head_count', 'members')
+    __slots__ = ('number', 'update_time') + FIELDS
+    
+    def __init__(self, number, data, update_time=None):
+        self.number = number
+        self.status = data.get('status', 0)
+        self.reservation = tuple(data.get('reservation', []))
+        self.is_priority = data.get('is_priority', False)
+        self.created_at = data.get('created_at')
+        self.called_at = data.get('called_at')
+        self.completed_at = data.get('completed_at')
+        self.head_count = data.get('head_count')
+        self.members = data.get('members') or {}
+        self.update_time = update_time
+    
+    def has_summary(self):
+        return self.head_count is not None
+    
+    def to_data(self):
+        data = {name: getattr(self, name) for name in self.FIELDS}
+        data['reservation'] = list(self.reservation)
+        return data
+    
+    def replace(self, fields, update_time=None):
+        return GroupRecord(self.number, apply_fields(self.to_data(), fields), update_time or self.update_time)
+
+# 呼び出す順番（優先グループが先、同じ区分の中はグループ番号順）
+def waiting_key(group):
+    return (not group.is_priority, group.number)
+
+# 呼び出し待ちに並べるグループか（status=0で待機中のメンバーがいる）
+# サマリーのない旧データはメンバーの状態が分からないので、予約があれば並べて呼び出し側で確かめる
+def is_waiting(group):
+    if group.status != 0:
+        return False
+    if not group.has_summary():
+        return bool(group.reservation)
+    return any(group.members.get(r_id, {}).get('status', 0) == 0 for r_id in group.reservation if r_id in group.members)
+
+# update_time（コミット時刻）をバージョン番号（マイクロ秒の整数）にする
+# 秒とマイクロ秒を分けて整数で計算する（浮動小数点の秒を経由すると1マイクロ秒ずれることがある）
+def version_of(update_time):
+    if update_time is None:
+        return 0
+    return int(update_time.timestamp()) * 1_000_000 + update_time.microsecond
+
+# バージョン番号をUTCの日時に戻す
+def time_of(version):
+    seconds, microseconds = divmod(version, 1_000_000)
+    return datetime.fromtimestamp(seconds, timezone.utc) + timedelta(microseconds=microseconds)
+
+# 後から届いた古いスナップショットで上書きしないための比較
+def _is_older(update_time, current):
+    if update_time is None or current is None or current.update_time is None:
+        return False
+    return update_time < current.update_time
+
+# リスナーが先に同じ書き込みを届けている場合（Incrementなどを二重に適用しない）
+def _already_applied(update_time, current):
+    if update_time is None or current.update_time is None:
+        return False
+    return update_time <= current.update_time
+
+class Mirror:
+    """予約・グループのコレクションと設定のプロセス内ミラー
+    
+    起動時に全件を読み込み、以降はスナップショットリスナーと
+    自分の書き込み（ライトスルー）で最新状態を保つ。
+    on_change を渡すと、初回読み込み後の変更ごとに
+    on_change(種類, 変更前, 変更後) を呼ぶ（削除は変更後がNone）。
+    reservation_collections は予約のコレクション → 日付（日付ごとのパーティション）で、
+    日付がNoneのコレクションは全日付の予約をdate_ofで振り分ける（既定は reservation の1つ）。
+    """
+    
+    def __init__(self, date_of, group_collections, on_change=None, reservation_collections=None):
+        self._date_of = date_of
+        self._group_collections = list(group_collections)
+        self._reservation_collections = dict(reservation_collections or {'reservation': None})
+        self._on_change = on_change
+        self._lock = threading.RLock()
+        self._reservations = {}
+        self._by_date = {}
+        self._groups = {col: {} for col in self._group_collections}
+        # 呼び出し待ちのグループのヒープ（waiting_key順）と、各グループの現在のキー
+        # 変わったグループは新しいキーを積み、古いものは取り出すときに捨てる
+        self._waiting = {col: [] for col in self._group_collections}
+        self._waiting_keys = {col: {} for col in self._group_collections}
+        # 呼び出し中（status=1）のグループ番号
+        self._calling = {col: set() for col in self._group_collections}
+        # 日付ごとの待機中（status=0）の優先予約（不在から戻った予約、next-groupで優先グループにする）
+        self._priority = {}
+        self._settings = {}
+        self._removed = {}
+        # 差分取得のバージョンはコレクション（リスナー）ごと
+        self._reservation_versions = {col: 0 for col in self._reservation_collections}
+        self._watches = []
+        self._pending = set()
+        self._initial_loaded = threading.Event()
+        self._started_at = None
+        self._last_sync = None
+        self._read_time = None
+        self._events = 0
+    
+    # スナップショットリスナーを登録して初回読み込みを待つ
+    def start(self, db, timeout=10):
+        self._started_at = time.time()
+        self._pending = {'settings'} | set(self._reservation_collections) | set(self._group_collections)
+        self._watches = [db.collection(col).on_snapshot(self._reservation_listener(col, date))
+                         for col, date in self._reservation_collections.items()]
+        for col in self._group_collections:
+            self._watches.append(db.collection(col).on_snapshot(self._group_listener(col)))
+        self._watches.append(db.collection('settings').document('base').on_snapshot(self._on_settings_snapshot))
+        self._initial_loaded.wait(timeout)
+        return self.is_ready()
+    
+    def stop(self):
+        for watch in self._watches:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                print(f"Error stopping mirror watch: {e}")
+        self._watches = []
+    
+    def is_listening(self):
+        return bool(self._watches) and all(getattr(w, 'is_active', True) for w in self._watches)
+    
+    def is_ready(self):
+        return self._initial_loaded.is_set() and self.is_listening()
+    
+    def _mark_synced(self, target, read_time):
+        self._last_sync = time.time()
+        self._read_time = read_time
+        self._events += 1
+        if target in self._pending:
+            self._pending.discard(target)
+            if not self._pending:
+                self._initial_loaded.set()
+                print(f"✅ Mirror loaded: {len(self._reservations)} reservations")
+    
+    # 変更を通知（初回読み込み中のものは通知しない）
+    def _notify(self, kind, old, new):
+        if self._on_change is None:
+            return
+        if kind == 'reservation' and not self._pending.isdisjoint(self._reservation_collections):
+            return
+        if kind in self._pending:
+            return
+        try:
+            self._on_change(kind, old, new)
+        except Exception as e:
+            print(f"Error in mirror change callback: {e}")
+    
+    # --- リスナー ---
+    def _on_settings_snapshot(self, docs, changes, read_time):
+        with self._lock:
+            data = docs[0].to_dict() if docs and docs[0].exists else {}
+            old = self._settings
+            self._settings = data or {}
+            if old != self._settings:
+                self._notify('settings', old, self._settings)
+            self._mark_synced('settings', read_time)
+    
+    def _reservation_listener(self, collection, date):
+        def on_snapshot(docs, changes, read_time):
+            with self._lock:
+                for change in changes:
+                    doc = change.document
+                    if change.type.name == 'REMOVED':
+                        self._remove_reservation(doc.id, version_of(read_time))
+                    else:
+                        self._put_reservation(doc.id, doc.to_dict() or {}, doc.update_time, date)
+                # ここまでのコミットはすべて反映済み
+                self._reservation_versions[collection] = max(self._reservation_versions[collection], version_of(read_time))
+                self._mark_synced(collection, read_time)
+        return on_snapshot
+    
+    def _group_listener(self, group_collection):
+        def on_snapshot(docs, changes, read_time):
+            with self._lock:
+                for change in changes:
+                    doc = change.document
+                    if change.type.name == 'REMOVED':
+                        self._remove_group(group_collection, doc.id)
+                    else:
+                        self._put_group(group_collection, doc.id, doc.to_dict() or {}, doc.update_time)
+                self._mark_synced(group_collection, read_time)
+        return on_snapshot
+    
+    # --- 内部更新 ---
+    def _put_reservation(self, res_id, data, update_time, date=None):
+        current = self._reservations.get(res_id)
+        if _is_older(update_time, current):
+            return
+        self._store_reservation(ReservationRecord(res_id, date or self._date_of(res_id, data), data, update_time))
+    
+    def _store_reservation(self, record):
+        current = self._reservations.get(record.id)
+        if current is not None and current.date != record.date:
+            self._by_date.get(current.date, {}).pop(record.id, None)
+        self._reservations[record.id] = record
+        self._by_date.setdefault(record.date, {})[record.id] = record
+        self._removed.get(record.date, {}).pop(record.id, None)
+        if current is not None:
+            self._priority.get(current.date, {}).pop(record.id, None)
+        if record.status == 0 and record.priority:
+            self._priority.setdefault(record.date, {})[record.id] = True
+        if current is None or current.to_data() != record.to_data():
+            self._notify('reservation', current, record)
+    
+    # 削除された予約は差分取得用にバージョンを残しておく
+    def _remove_reservation(self, res_id, version=0):
+        current = self._reservations.pop(res_id, None)
+        if current is not None:
+            self._by_date.get(current.date, {}).pop(res_id, None)
+            self._priority.get(current.date, {}).pop(res_id, None)
+            self._removed.setdefault(current.date, {})[res_id] = version
+            self._notify('reservation', current, None)
+    
+    def _put_group(self, group_collection, doc_id, data, update_time):
+        try:
+            number = int(doc_id)
+        except ValueError:
+            return
+        groups = self._groups.setdefault(group_collection, {})
+        if _is_older(update_time, groups.get(number)):
+            return
+        self._store_group(group_collection, GroupRecord(number, data, update_time))
+    
+    def _store_group(self, group_collection, record):
+        groups = self._groups.setdefault(group_collection, {})
+        current = groups.get(record.number)
+        groups[record.number] = record
+        self._index_group(group_collection, record.number, record)
+        if current is None or current.to_data() != record.to_data():
+            self._notify(group_collection, current, record)
+    
+    def _remove_group(self, group_collection, doc_id):
+        try:
+            current = self._groups.get(group_collection, {}).pop(int(doc_id), None)
+        except ValueError:
+            return
+        if current is not None:
+            self._index_group(group_collection, current.number, None)
+            self._notify(group_collection, current, None)
+    
+    # 呼び出し待ちのキューと呼び出し中のグループを更新する（recordがNoneなら削除）
+    def _index_group(self, group_collection, number, record):
+        keys = self._waiting_keys.setdefault(group_collection, {})
+        heap = self._waiting.setdefault(group_collection, [])
+        key = waiting_key(record) if record is not None and is_waiting(record) else None
+        if keys.get(number) != key:
+            if key is None:
+                keys.pop(number, None)
+            else:
+                keys[number] = key
+                heapq.heappush(heap, key)
+            # 捨てたキーが溜まったら作り直す
+            if len(heap) > 2 * len(keys) + 64:
+                heap[:] = list(keys.values())
+                heapq.heapify(heap)
+        
+        calling = self._calling.setdefault(group_collection, set())
+        if record is not None and record.status == 1:
+            calling.add(number)
+        else:
+            calling.discard(number)
+    
+    # --- ライトスルー（自分の書き込みを即時反映） ---
+    def set_reservation(self, res_id, data, update_time=None):
+        with self._lock:
+            self._put_reservation(res_id, data, update_time)
+    
+    def update_reservation(self, res_id, fields, update_time=None):
+        with self._lock:
+            current = self._reservations.get(res_id)
+            if current is None or _already_applied(update_time, current):
+                return
+            self._store_reservation(current.replace(fields, update_time))
+    
+    def set_group(self, group_collection, group_num, data, update_time=None):
+        with self._lock:
+            self._put_group(group_collection, str(group_num), data, update_time)
+    
+    def update_group(self, group_collection, group_num, fields, update_time=None):
+        with self._lock:
+            groups = self._groups.setdefault(group_collection, {})
+            current = groups.get(int(group_num))
+            if current is None or _already_applied(update_time, current):
+                return
+            self._store_group(group_collection, current.replace(fields, update_time))
+    
+    # --- 読み取り ---
+    def reservations(self, date):
+        with self._lock:
+            return list(self._by_date.get(date, {}).values())
+    
+    # sinceより後に変わった予約・削除された予約IDと、新しいバージョン（sinceがNoneなら全件）
+    def reservations_since(self, date, since=None):
+        with self._lock:
+            records = list(self._by_date.get(date, {}).values())
+            current = self._reservation_version(date)
+            if since is None:
+                return records, [], current
+            changed = [record for record in records if version_of(record.update_time) > since]
+            removed = [res_id for res_id, version in self._removed.get(date, {}).items() if version > since]
+            return changed, removed, max(since, current)
+    
+    # 日付の予約を受け取っているリスナーのバージョン（日付のコレクションがなければ全日付のコレクション）
+    def _reservation_version(self, date):
+        for col, col_date in self._reservation_collections.items():
+            if col_date == date:
+                return self._reservation_versions[col]
+        return max((self._reservation_versions[col] for col, col_date in self._reservation_collections.items()
+                    if col_date is None), default=0)
+    
+    # 待機中の優先予約（status=0・priority=True）
+    def priority_reservations(self, date):
+        with self._lock:
+            return [self._reservations[res_id] for res_id in self._priority.get(date, ())]
+    
+    def all_reservations(self):
+        with self._lock:
+            return list(self._reservations.values())
+    
+    def reservation(self, res_id):
+        return self._reservations.get(res_id)
+    
+    def groups(self, group_collection):
+        with self._lock:
+            return list(self._groups.get(group_collection, {}).values())
+    
+    def group(self, group_collection, group_num):
+        return self._groups.get(group_collection, {}).get(int(group_num))
+    
+    # 次に呼び出すグループ（呼び出し待ちのキューの先頭、なければNone）
+    def next_waiting_group(self, group_collection):
+        with self._lock:
+            heap = self._waiting.get(group_collection, [])
+            keys = self._waiting_keys.get(group_collection, {})
+            while heap:
+                key = heap[0]
+                if keys.get(key[1]) == key:
+                    return self._groups[group_collection][key[1]]
+                heapq.heappop(heap)
+            return None
+    
+    # 呼び出し中のグループ（複数あれば番号の小さいもの、なければNone）
+    def calling_group(self, group_collection):
+        with self._lock:
+            calling = self._calling.get(group_collection)
+            if not calling:
+                return None
+            return self._groups[group_collection][min(calling)]
+    
+    def settings(self):
+        return dict(self._settings)
+    
+    # /health 用の状態
+    def status(self):
+        age = time.time() - self._last_sync if self._last_sync else None
+        return {
+            'ready': self.is_ready(),
+            'listening': self.is_listening(),
+            'consistent': self.is_ready(),
+            'reservations': len(self._reservations),
+            'groups': sum(len(g) for g in self._groups.values()),
+            'events': self._events,
+            'last_sync': datetime.fromtimestamp(self._last_sync).isoformat() if self._last_sync else None,
+            'seconds_since_event': round(age, 1) if age is not None else None,
+            'read_time': self._read_time.isoformat() if self._read_time else None
+        }
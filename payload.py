@@ -0,0 +1,155 @@
+import gzip
+import json
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+# レスポンスの大きさを減らすための処理
+# ・JSONの書き出しを高速なorjsonで行う（未インストールなら標準のjson）
+# ・一覧を列ごとの配列にする columnar 形式
+# ・Accept-Encodingに応じたgzip / brotli圧縮
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# これより小さいレスポンスは圧縮しない（ヘッダーの方が大きくなる）
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# 圧縮したレスポンスのETagの末尾（圧縮方式ごとに別のETagにする）
+ETAG_SUFFIXES = {'gzip': 'gz', 'br': 'br'}
+
+# --- JSON ---
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify をorjsonで書き出す（キーの並び・日時の書式は標準のプロバイダーと同じ）"""
+    
+    def _option(self):
+        # 日時はorjsonのISO形式ではなく、標準と同じくdefault（HTTP日付）に渡す
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+    
+    def _dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=self.default, option=self._option())
+    
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return self._dumps_bytes(obj).decode()
+        except orjson.JSONEncodeError:
+            return super().dumps(obj)
+    
+    def response(self, *args, **kwargs):
+        # デバッグ時の整形（indent）は標準のプロバイダーで行う
+        if self._app.debug:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = self._dumps_bytes(obj) + b'\n'
+        except orjson.JSONEncodeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+# 1行分のJSON（NDJSONなど、jsonifyを通さずに書き出す場合）
+def dumps(obj):
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, default=str)
+
+# --- columnar形式 ---
+# rows（dictの一覧）を {列名: 値の配列} にする。columnsの順に並べ、それ以外のキーは後ろに追加する
+# 文字列だけの列で種類が行数の半分以下のもの（type / date / time など）は、
+# dictionary[列名] の番号に置き換える（Noneはそのまま）
+def to_columnar(rows, columns=()):
+    names = list(columns)
+    for row in rows:
+        for key in row:
+            if key not in names:
+                names.append(key)
+    
+    data = {}
+    dictionary = {}
+    for name in names:
+        values = [row.get(name) for row in rows]
+        strings = {value for value in values if value is not None}
+        if strings and all(isinstance(value, str) for value in strings) and len(strings) * 2 <= len(values):
+            words = sorted(strings)
+            index = {word: i for i, word in enumerate(words)}
+            values = [None if value is None else index[value] for value in values]
+            dictionary[name] = words
+        data[name] = values
+    return {'format': 'columnar', 'count': len(rows), 'columns': names, 'data': data, 'dictionary': dictionary}
+
+# --- 圧縮 ---
+# Accept-Encodingから使える圧縮方式を選ぶ（brotliが使えれば優先）
+def choose_encoding(accept_encoding):
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0
+        accepted[name.strip().lower()] = quality
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+# 圧縮方式ごとのETag（圧縮しなければそのまま）
+def encoded_etag(etag, encoding):
+    return f"{etag}-{ETAG_SUFFIXES[encoding]}" if encoding else etag
+
+# If-None-Matchに含まれるETag（圧縮したものも含めて、一致したものを返す。なければNone）
+def matching_etag(if_none_match, etag):
+    for encoding in (None, *ETAG_SUFFIXES):
+        candidate = encoded_etag(etag, encoding)
+        if if_none_match.contains(candidate):
+            return candidate
+    return None
+
+def init_app(app):
+    if orjson is not None:
+        app.json = FastJSONProvider(app)
+    
+    # 圧縮したレスポンスのETagには圧縮方式を付ける（同じETagで中身が違うレスポンスにしない）
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return response
+        response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(encoded_etag(etag, encoding), weak)
+        return response
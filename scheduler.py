@@ -0,0 +1,87 @@
+import heapq
+import threading
+from datetime import datetime
+
+class VipScheduler:
+    """関係者予約（X/Y）のグループ割り当てを時刻ちょうどに実行するスケジューラ（プロセス内）
+    
+    割り当て時刻（予約時刻の5分前）の早い順にヒープで持ち、先頭の時刻まで眠ってから run(予約IDの一覧) を呼ぶ。
+    キャンセル済み・他のインスタンスで割り当て済みかどうかは run 側で確認するので、
+    ヒープから消さなくてもよい（時刻が変わった予約は add し直せば古い方は読み飛ばす）。
+    """
+    
+    # 時計が変わっても取りこぼさないよう、待つのは最大この秒数まで
+    MAX_SLEEP_SECONDS = 60
+    
+    def __init__(self, run):
+        self._run = run
+        self._heap = []
+        self._due = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+    
+    def add(self, res_id, due):
+        with self._cond:
+            if self._due.get(res_id) == due:
+                return
+            self._due[res_id] = due
+            heapq.heappush(self._heap, (due, res_id))
+            self._cond.notify()
+    
+    def discard(self, res_id):
+        with self._cond:
+            self._due.pop(res_id, None)
+    
+    # 次の割り当て時刻（なければNone）
+    def next_due(self):
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+    
+    def pending(self):
+        with self._cond:
+            return len(self._due)
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='vip-scheduler', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+    
+    # ヒープの先頭にある、取り消し・再登録で古くなったものを捨てる
+    def _drop_stale(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+    
+    # nowまでに割り当て時刻になった予約IDを取り出す
+    def _pop_due(self, now):
+        res_ids = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return res_ids
+            _, res_id = heapq.heappop(self._heap)
+            del self._due[res_id]
+            res_ids.append(res_id)
+    
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    res_ids = self._pop_due(datetime.now())
+                    if res_ids:
+                        break
+                    timeout = self.MAX_SLEEP_SECONDS
+                    if self._heap:
+                        timeout = min(timeout, max(0, (self._heap[0][0] - datetime.now()).total_seconds()))
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+            try:
+                self._run(res_ids)
+            except Exception as e:
+                print(f"Error in VIP scheduler: {e}")
@@ -14,6 +14,7 @@ let reservationsCache = [];
 let selectedReservations = [];
 let absentCheckInterval = null;
 let autoStopCheckInterval = null; // 自動停止チェック用
+let eventDates = []; // 開催日（'2025-11-01'など、サーバーの設定から読み込む）
 let currentSettings = null; // 設定をキャッシュ
 
 // ユーティリティ関数
@@ -157,8 +158,9 @@ async function initMainScreen() {
     updateCurrentTime();
     setInterval(updateCurrentTime, 1000);
     
-    // 設定を読み込む
+    // 設定・開催日を読み込む
     await loadSettingsToCache();
+    await loadEventDates();
     
     loadCurrentTab();
 }
@@ -415,17 +417,47 @@ function updateGroupCount() {
 async function acceptGroup() {
     if (selectedReservations.length === 0) return;
 
-    const ids = selectedReservations.map(r => r.id);
-    
-    // 各予約のstatusを1に更新
-    for (const id of ids) {
-        await apiCall(`/api/reservations/${id}`, 'PUT', { status: 1 });
+    // グループごとにまとめて来店済みにする（1グループ1リクエスト）
+    const outcomesByGroup = {};
+    const ungrouped = [];
+    selectedReservations.forEach(r => {
+        const reservation = reservationsCache.find(res => res.id === r.id);
+        if (reservation && reservation.group) {
+            outcomesByGroup[reservation.group] = outcomesByGroup[reservation.group] || {};
+            outcomesByGroup[reservation.group][r.id] = 'visited';
+        } else {
+            ungrouped.push(r.id);
+        }
+    });
+
+    // 失敗した予約は選択したまま残す（apiCallはエラーでもJSONを返すので結果を確認する）
+    const failed = [];
+    const errors = [];
+    for (const [group, outcomes] of Object.entries(outcomesByGroup)) {
+        const result = await apiCall(`/api/admin/groups/${group}/resolve`, 'POST', { date: apiDate(currentDate), outcomes });
+        if (!result || result.error) {
+            failed.push(...Object.keys(outcomes));
+            errors.push(`グループ${group}: ${result && result.error ? result.error : '応答がありません'}`);
+        }
+    }
+
+    // グループ未割り当ての予約は1件ずつstatusを1に更新
+    for (const id of ungrouped) {
+        const result = await apiCall(`/api/reservations/${id}`, 'PUT', { status: 1 });
+        if (!result || result.error) {
+            failed.push(id);
+            errors.push(`${id}: ${result && result.error ? result.error : '応答がありません'}`);
+        }
     }
 
-    selectedReservations = [];
+    selectedReservations = selectedReservations.filter(r => failed.includes(r.id));
     renderCallGroup();
     updateGroupCount();
     loadGroupScreen();
+
+    if (errors.length > 0) {
+        alert(`来店済みにできませんでした\n${errors.join('\n')}`);
+    }
 }
 
 async function markAsAbsent(reservationId) {
@@ -503,6 +535,25 @@ async function guideAbsent(reservationId) {
     }
 }
 
+// 開催日の一覧をサーバーから読み込む
+async function loadEventDates() {
+    const result = await apiCall('/api/admin/event-days');
+    if (result && Array.isArray(result.dates)) {
+        eventDates = result.dates;
+    } else {
+        console.error('開催日の読み込みに失敗しました');
+    }
+}
+
+// 画面の日付をAPIの日付にする（'11/1' → '2025-11-01'、開催日になければnull）
+function apiDate(date) {
+    const [month, day] = date.split('/').map(Number);
+    return eventDates.find(d => {
+        const [, m, dd] = d.split('-').map(Number);
+        return m === month && dd === day;
+    }) || null;
+}
+
 function startAbsentCheck() {
     if (absentCheckInterval) return;
     
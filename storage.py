@@ -0,0 +1,834 @@
+import asyncio
+import copy
+import itertools
+import json
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+
+# Firestoreクライアントと同じ呼び出し方（collection / document / where / batch / transaction / on_snapshot）で使える
+# ローカルのストレージエンジン。STORAGE_BACKEND=memory / sqlite のときにFirestoreの代わりに使う
+
+# Firestoreの変換値・例外（未インストール時は互換クラスを使う）
+try:
+    from google.cloud.firestore_v1.transforms import (
+        ArrayRemove, ArrayUnion, DELETE_FIELD, Increment, SERVER_TIMESTAMP
+    )
+    from google.api_core.exceptions import Aborted, AlreadyExists, NotFound
+    from google.cloud.firestore_v1 import __version__ as FIRESTORE_CLIENT_VERSION
+except ImportError:
+    FIRESTORE_CLIENT_VERSION = None
+    
+    class _Sentinel:
+        def __init__(self, description):
+            self.description = description
+        
+        def __repr__(self):
+            return f"Sentinel: {self.description}"
+    
+    DELETE_FIELD = _Sentinel('Value used to delete a field in a document.')
+    SERVER_TIMESTAMP = _Sentinel('Value used to set a document field to the server timestamp.')
+    
+    class Increment:
+        def __init__(self, value):
+            self.value = value
+    
+    class ArrayUnion:
+        def __init__(self, values):
+            self.values = list(values)
+    
+    class ArrayRemove:
+        def __init__(self, values):
+            self.values = list(values)
+    
+    class Aborted(Exception):
+        pass
+    
+    class AlreadyExists(Exception):
+        pass
+    
+    class NotFound(Exception):
+        pass
+
+# 互換クラス・transactional・ミラーは、google-cloud-firestoreの次の動きに合わせている
+# ・変換値の属性（Increment.value / ArrayUnion.values / ArrayRemove.values）
+# ・transactionalが再試行回数を超えたら、最後のAbortedを原因とするValueErrorを出す
+# ・コミットしたTransactionのwrite_results
+# 確認したバージョン（以上, 未満）以外では起動しない。上げるときは tests/test_storage.py を通してから範囲を広げる
+FIRESTORE_CLIENT_VERSIONS = ((2, 34), (3, 0))
+
+def check_client_version(version):
+    numbers = tuple(int(part) for part in re.findall(r'\d+', version)[:2])
+    low, high = FIRESTORE_CLIENT_VERSIONS
+    if not low <= numbers < high:
+        raise ImportError(f"google-cloud-firestore {version} is not supported "
+                          f"(tested >={low[0]}.{low[1]},<{high[0]}.{high[1]})")
+
+if FIRESTORE_CLIENT_VERSION is not None:
+    check_client_version(FIRESTORE_CLIENT_VERSION)
+
+class ChangeType(Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+class DocumentChange:
+    def __init__(self, type, document, old_index=-1, new_index=-1):
+        self.type = type
+        self.document = document
+        self.old_index = old_index
+        self.new_index = new_index
+
+# フィールドパスの値を取得（存在しない場合は_MISSING）
+_MISSING = object()
+
+def _get_field(data, field_path):
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+# Firestoreの型順序（null < bool < 数値 < 日時 < 文字列 < 配列 < マップ）
+def _type_rank(value):
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, (list, tuple)):
+        return 6
+    return 7
+
+def _sort_key(value):
+    rank = _type_rank(value)
+    if rank == 0:
+        return (rank, 0)
+    if rank in (6, 7):
+        return (rank, json.dumps(value, sort_keys=True, default=str))
+    return (rank, value)
+
+def _resolve(value, current, ts):
+    if value is SERVER_TIMESTAMP:
+        return ts
+    if isinstance(value, Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        return base + value.value
+    if isinstance(value, ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        for v in value.values:
+            if v not in result:
+                result.append(v)
+        return result
+    if isinstance(value, ArrayRemove):
+        result = list(current) if isinstance(current, list) else []
+        return [v for v in result if v not in value.values]
+    if isinstance(value, dict):
+        base = current if isinstance(current, dict) else {}
+        return {k: _resolve(v, base.get(k), ts) for k, v in value.items() if v is not DELETE_FIELD}
+    return copy.deepcopy(value)
+
+def _merge(target, data, ts):
+    for key, value in data.items():
+        if value is DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            current = target.get(key)
+            target[key] = _merge(dict(current) if isinstance(current, dict) else {}, value, ts)
+        else:
+            target[key] = _resolve(value, target.get(key), ts)
+    return target
+
+def _update(target, fields, ts):
+    for field_path, value in fields.items():
+        parts = field_path.split('.')
+        node = target
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                if value is DELETE_FIELD:
+                    node = None
+                    break
+                child = {}
+                node[part] = child
+            node = child
+        if node is None:
+            continue
+        if value is DELETE_FIELD:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = _resolve(value, node.get(parts[-1]), ts)
+    return target
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time, update_time, read_time):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+    
+    @property
+    def id(self):
+        return self.reference.id
+    
+    @property
+    def exists(self):
+        return self._data is not None
+    
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+    
+    def get(self, field_path):
+        if self._data is None:
+            return None
+        value = _get_field(self._data, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+class _Query:
+    def __init__(self, client, path, filters=(), orders=(), limit=None, cursor=None):
+        self._client = client
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+    
+    def _copy(self, **changes):
+        params = {
+            'filters': self._filters, 'orders': self._orders,
+            'limit': self._limit, 'cursor': self._cursor,
+        }
+        params.update(changes)
+        return _Query(self._client, self._path, **params)
+    
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+    
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, str(direction).upper()),))
+    
+    def limit(self, count):
+        return self._copy(limit=count)
+    
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+    
+    def _value(self, doc_id, data, field_path):
+        if field_path == '__name__':
+            return doc_id
+        return _get_field(data, field_path)
+    
+    def _matches(self, doc_id, data):
+        for field_path, op, expected in self._filters:
+            actual = self._value(doc_id, data, field_path)
+            if op == '==':
+                if actual is _MISSING or _type_rank(actual) != _type_rank(expected) or actual != expected:
+                    return False
+            elif op == '!=':
+                if actual is _MISSING or actual is None or actual == expected:
+                    return False
+            elif op in ('<', '<=', '>', '>='):
+                if actual is _MISSING or _type_rank(actual) != _type_rank(expected):
+                    return False
+                if op == '<' and not actual < expected:
+                    return False
+                if op == '<=' and not actual <= expected:
+                    return False
+                if op == '>' and not actual > expected:
+                    return False
+                if op == '>=' and not actual >= expected:
+                    return False
+            elif op == 'in':
+                if actual is _MISSING or actual not in expected:
+                    return False
+            elif op == 'not-in':
+                if actual is _MISSING or actual is None or actual in expected:
+                    return False
+            elif op == 'array_contains':
+                if not isinstance(actual, list) or expected not in actual:
+                    return False
+            elif op == 'array_contains_any':
+                if not isinstance(actual, list) or not any(v in actual for v in expected):
+                    return False
+            else:
+                raise ValueError(f"Unsupported operator: {op}")
+        for field_path, _ in self._orders:
+            if self._value(doc_id, data, field_path) is _MISSING:
+                return False
+        return True
+    
+    def _order_key(self, doc_id, data):
+        key = []
+        for field_path, direction in self._orders:
+            value = _sort_key(self._value(doc_id, data, field_path))
+            key.append(_Reverse(value) if direction == 'DESCENDING' else value)
+        key.append(doc_id)
+        return tuple(key)
+    
+    def _cursor_key(self):
+        cursor = self._cursor
+        if isinstance(cursor, DocumentSnapshot):
+            return self._order_key(cursor.id, cursor._data or {})
+        if isinstance(cursor, dict):
+            values = [cursor.get(field_path) for field_path, _ in self._orders]
+        else:
+            values = list(cursor)
+        key = []
+        for (field_path, direction), value in zip(self._orders, values):
+            value = _sort_key(value)
+            key.append(_Reverse(value) if direction == 'DESCENDING' else value)
+        if isinstance(cursor, dict) and '__name__' in cursor:
+            key.append(cursor['__name__'])
+        return tuple(key)
+    
+    def _run(self):
+        rows = [
+            (doc_id, entry) for doc_id, entry in self._client._list(self._path)
+            if self._matches(doc_id, entry[0])
+        ]
+        rows.sort(key=lambda row: self._order_key(row[0], row[1][0]))
+        if self._cursor is not None:
+            cursor_key = self._cursor_key()
+            rows = [row for row in rows if self._order_key(row[0], row[1][0])[:len(cursor_key)] > cursor_key]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return rows
+    
+    def stream(self, transaction=None):
+        with self._client._lock:
+            rows = self._run()
+            read_time = self._client._clock()
+        for doc_id, (data, create_time, update_time) in rows:
+            ref = DocumentReference(self._client, f"{self._path}/{doc_id}")
+            if transaction is not None:
+                transaction._track(ref._path, update_time)
+            yield DocumentSnapshot(ref, copy.deepcopy(data), create_time, update_time, read_time)
+    
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+    
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+class _Reverse:
+    def __init__(self, value):
+        self.value = value
+    
+    def __lt__(self, other):
+        return self.value > other.value
+    
+    def __gt__(self, other):
+        return self.value < other.value
+    
+    def __eq__(self, other):
+        return self.value == other.value
+
+class CollectionReference(_Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+    
+    @property
+    def id(self):
+        return self._path.rsplit('/', 1)[-1]
+    
+    def document(self, document_id=None):
+        if document_id is None:
+            document_id = self._client._auto_id()
+        return DocumentReference(self._client, f"{self._path}/{document_id}")
+    
+    def add(self, data):
+        ref = self.document()
+        write = ref.set(data)
+        return write.update_time, ref
+    
+    def list_documents(self):
+        with self._client._lock:
+            ids = [doc_id for doc_id, _ in self._client._list(self._path)]
+        return [self.document(doc_id) for doc_id in ids]
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self._path = path
+    
+    @property
+    def id(self):
+        return self._path.rsplit('/', 1)[-1]
+    
+    @property
+    def path(self):
+        return self._path
+    
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self._path.rsplit('/', 1)[0])
+    
+    def collection(self, collection_id):
+        return CollectionReference(self._client, f"{self._path}/{collection_id}")
+    
+    def get(self, field_paths=None, transaction=None):
+        return next(self._client.get_all([self], transaction=transaction))
+    
+    def set(self, document_data, merge=False):
+        batch = self._client.batch()
+        batch.set(self, document_data, merge=merge)
+        return batch.commit()[0]
+    
+    def update(self, field_updates):
+        batch = self._client.batch()
+        batch.update(self, field_updates)
+        return batch.commit()[0]
+    
+    def create(self, document_data):
+        batch = self._client.batch()
+        batch.create(self, document_data)
+        return batch.commit()[0]
+    
+    def delete(self):
+        batch = self._client.batch()
+        batch.delete(self)
+        return batch.commit()[0]
+    
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+class WriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+    
+    def __len__(self):
+        return len(self._writes)
+    
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference._path, document_data, merge))
+        return self
+    
+    def update(self, reference, field_updates):
+        self._writes.append(('update', reference._path, field_updates, False))
+        return self
+    
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference._path, document_data, False))
+        return self
+    
+    def delete(self, reference):
+        self._writes.append(('delete', reference._path, None, False))
+        return self
+    
+    def commit(self):
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+class Transaction(WriteBatch):
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._reads = {}
+        self._ids = itertools.count(1)
+    
+    @property
+    def in_progress(self):
+        return self._id is not None
+    
+    @property
+    def id(self):
+        return self._id
+    
+    def _track(self, path, update_time):
+        self._reads.setdefault(path, update_time)
+    
+    def _clean_up(self):
+        self._writes = []
+        self._reads = {}
+        self._id = None
+    
+    def _begin(self, retry_id=None):
+        self._id = str(next(self._ids)).encode()
+    
+    def _rollback(self):
+        self._clean_up()
+    
+    def _commit(self):
+        writes, reads = self._writes, self._reads
+        self._clean_up()
+        self.write_results = self._client._commit(writes, reads)
+        return self.write_results
+    
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, DocumentReference):
+            return self._client.get_all([ref_or_query], transaction=self)
+        return ref_or_query.stream(transaction=self)
+    
+    def get_all(self, references):
+        return self._client.get_all(references, transaction=self)
+
+# トランザクション実行デコレータ（firestore.transactionalと同じ呼び出し方）
+def transactional(to_wrap):
+    def run(transaction, *args, **kwargs):
+        last_exc = None
+        for _ in range(transaction._max_attempts):
+            transaction._clean_up()
+            transaction._begin()
+            try:
+                result = to_wrap(transaction, *args, **kwargs)
+                transaction._commit()
+                return result
+            except Aborted as exc:
+                last_exc = exc
+            except BaseException:
+                transaction._rollback()
+                raise
+        raise ValueError(f"Failed to commit transaction in {transaction._max_attempts} attempts.") from last_exc
+    return run
+
+class _Watch:
+    def __init__(self, client, target, callback):
+        self._client = client
+        self._target = target
+        self._callback = callback
+        self._current = {}
+        self.is_active = True
+    
+    def unsubscribe(self):
+        self.is_active = False
+        with self._client._lock:
+            if self in self._client._watches:
+                self._client._watches.remove(self)
+
+class BaseClient(ABC):
+    """Firestoreクライアント互換のローカルエンジン（アプリが使う範囲のAPIのみ）"""
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._watches = []
+        self._last_ts = datetime.now(timezone.utc)
+        self._id_seq = itertools.count(1)
+    
+    # --- サブクラスが実装する保存処理 ---
+    @abstractmethod
+    def _list(self, collection_path):
+        pass
+    
+    @abstractmethod
+    def _load(self, path):
+        pass
+    
+    @abstractmethod
+    def _store(self, path, entry):
+        pass
+    
+    @abstractmethod
+    def _delete(self, path):
+        pass
+    
+    def _flush(self):
+        pass
+    
+    # --- 公開API ---
+    def collection(self, path):
+        return CollectionReference(self, path)
+    
+    def document(self, path):
+        return DocumentReference(self, path)
+    
+    def batch(self):
+        return WriteBatch(self)
+    
+    def transaction(self, max_attempts=5, read_only=False):
+        return Transaction(self, max_attempts=max_attempts, read_only=read_only)
+    
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        with self._lock:
+            entries = [self._load(ref._path) for ref in references]
+            read_time = self._clock()
+        for ref, entry in zip(references, entries):
+            data, create_time, update_time = entry if entry else (None, None, None)
+            if transaction is not None:
+                transaction._track(ref._path, update_time)
+            yield DocumentSnapshot(ref, copy.deepcopy(data), create_time, update_time, read_time)
+    
+    def close(self):
+        pass
+    
+    # --- 内部処理 ---
+    def _auto_id(self):
+        return f"auto{next(self._id_seq):012d}"
+    
+    def _clock(self):
+        now = datetime.now(timezone.utc)
+        if now <= self._last_ts:
+            now = self._last_ts + timedelta(microseconds=1)
+        self._last_ts = now
+        return now
+    
+    def _commit(self, writes, reads=None):
+        with self._lock:
+            for path, update_time in (reads or {}).items():
+                entry = self._load(path)
+                if (entry[2] if entry else None) != update_time:
+                    raise Aborted('Transaction lock timeout / contention')
+            ts = self._clock()
+            staged = {}
+            for op, path, data, merge in writes:
+                entry = staged[path] if path in staged else self._load(path)
+                if op == 'delete':
+                    staged[path] = None
+                    continue
+                if op == 'create' and entry:
+                    raise AlreadyExists(f"Document already exists: {path}")
+                if op == 'update' and not entry:
+                    raise NotFound(f"No document to update: {path}")
+                current = copy.deepcopy(entry[0]) if entry else {}
+                if op == 'update':
+                    new_data = _update(current, data, ts)
+                elif merge:
+                    new_data = _merge(current, data, ts)
+                else:
+                    new_data = _resolve(data, {}, ts)
+                staged[path] = (new_data, entry[1] if entry else ts, ts)
+            for path, entry in staged.items():
+                if entry is None:
+                    self._delete(path)
+                else:
+                    self._store(path, entry)
+            self._flush()
+            notifications = self._collect_notifications(staged.keys(), ts)
+        for callback, args in notifications:
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Snapshot callback error: {e}")
+        return [WriteResult(ts) for _ in writes]
+    
+    def _watch(self, target, callback):
+        watch = _Watch(self, target, callback)
+        with self._lock:
+            self._watches.append(watch)
+            read_time = self._clock()
+            changes = []
+            if isinstance(target, DocumentReference):
+                entry = self._load(target._path)
+                snap = DocumentSnapshot(target, copy.deepcopy(entry[0]) if entry else None,
+                                        entry[1] if entry else None, entry[2] if entry else None, read_time)
+                if entry:
+                    watch._current[target._path] = snap
+                docs = [snap]
+            else:
+                for doc_id, (data, create_time, update_time) in target._run():
+                    ref = DocumentReference(self, f"{target._path}/{doc_id}")
+                    snap = DocumentSnapshot(ref, copy.deepcopy(data), create_time, update_time, read_time)
+                    watch._current[ref._path] = snap
+                    changes.append(DocumentChange(ChangeType.ADDED, snap))
+                docs = list(watch._current.values())
+        callback(docs, changes, read_time)
+        return watch
+    
+    def _collect_notifications(self, paths, ts):
+        notifications = []
+        for watch in list(self._watches):
+            target = watch._target
+            changes = []
+            for path in paths:
+                entry = self._load(path)
+                ref = DocumentReference(self, path)
+                if isinstance(target, DocumentReference):
+                    if path != target._path:
+                        continue
+                    matched = entry is not None
+                else:
+                    parent, doc_id = path.rsplit('/', 1)
+                    if parent != target._path or target._limit is not None:
+                        continue
+                    matched = entry is not None and target._matches(doc_id, entry[0])
+                had = path in watch._current
+                if matched:
+                    snap = DocumentSnapshot(ref, copy.deepcopy(entry[0]), entry[1], entry[2], ts)
+                    watch._current[path] = snap
+                    changes.append(DocumentChange(ChangeType.MODIFIED if had else ChangeType.ADDED, snap))
+                elif had:
+                    old = watch._current.pop(path)
+                    snap = DocumentSnapshot(ref, old._data, old.create_time, old.update_time, ts)
+                    changes.append(DocumentChange(ChangeType.REMOVED, snap))
+            if not changes:
+                continue
+            if isinstance(target, DocumentReference):
+                entry = self._load(target._path)
+                docs = [DocumentSnapshot(target, copy.deepcopy(entry[0]) if entry else None,
+                                         entry[1] if entry else None, entry[2] if entry else None, ts)]
+            else:
+                docs = list(watch._current.values())
+            notifications.append((watch._callback, (docs, changes, ts)))
+        return notifications
+
+class MemoryClient(BaseClient):
+    """プロセス内メモリに保持するエンジン（負荷試験・ローカル実行用）"""
+    
+    def __init__(self):
+        super().__init__()
+        self._collections = {}
+    
+    def _list(self, collection_path):
+        return list(self._collections.get(collection_path, {}).items())
+    
+    def _load(self, path):
+        parent, doc_id = path.rsplit('/', 1)
+        return self._collections.get(parent, {}).get(doc_id)
+    
+    def _store(self, path, entry):
+        parent, doc_id = path.rsplit('/', 1)
+        self._collections.setdefault(parent, {})[doc_id] = entry
+    
+    def _delete(self, path):
+        parent, doc_id = path.rsplit('/', 1)
+        self._collections.get(parent, {}).pop(doc_id, None)
+
+# SQLiteに保存する値（日時はタグ付きの文字列にする）
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    return value
+
+def _decode(value):
+    if isinstance(value, dict):
+        if set(value) == {'__datetime__'}:
+            return datetime.fromisoformat(value['__datetime__'])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+class SqliteClient(MemoryClient):
+    """SQLiteファイルに保存するエンジン（回線が不安定な会場・ローカル実行用）
+    
+    起動時にファイルの内容をメモリに読み込み、以降の書き込みはコミットごとに
+    ファイルへ反映する。1つのファイルを使うのは1プロセスだけにすること。
+    """
+    
+    def __init__(self, path):
+        super().__init__()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS documents ('
+            'path TEXT PRIMARY KEY, parent TEXT NOT NULL, data TEXT NOT NULL, '
+            'create_time TEXT NOT NULL, update_time TEXT NOT NULL)'
+        )
+        self._conn.commit()
+        for path, data, create_time, update_time in self._conn.execute(
+                'SELECT path, data, create_time, update_time FROM documents'):
+            entry = (_decode(json.loads(data)), datetime.fromisoformat(create_time), datetime.fromisoformat(update_time))
+            super()._store(path, entry)
+            self._last_ts = max(self._last_ts, entry[2])
+    
+    def _store(self, path, entry):
+        super()._store(path, entry)
+        data, create_time, update_time = entry
+        self._conn.execute(
+            'INSERT OR REPLACE INTO documents (path, parent, data, create_time, update_time) VALUES (?, ?, ?, ?, ?)',
+            (path, path.rsplit('/', 1)[0], json.dumps(_encode(data), ensure_ascii=False),
+             create_time.isoformat(), update_time.isoformat())
+        )
+    
+    def _delete(self, path):
+        super()._delete(path)
+        self._conn.execute('DELETE FROM documents WHERE path = ?', (path,))
+    
+    # 1回のコミット（バッチ・トランザクション）をまとめてファイルに書き込む
+    def _flush(self):
+        self._conn.commit()
+    
+    def close(self):
+        self._conn.close()
+
+# --- 非同期API（firestore.AsyncClient と同じ呼び出し方、asgi.py のミラーなしの読み込み用） ---
+# 読み込みはスレッドで実行するので、同時に待っている間もイベントループは止まらない
+class _AsyncQuery:
+    def __init__(self, target):
+        self._target = target
+    
+    def where(self, *args, **kwargs):
+        return _AsyncQuery(self._target.where(*args, **kwargs))
+    
+    def order_by(self, *args, **kwargs):
+        return _AsyncQuery(self._target.order_by(*args, **kwargs))
+    
+    def limit(self, *args, **kwargs):
+        return _AsyncQuery(self._target.limit(*args, **kwargs))
+    
+    def start_after(self, *args, **kwargs):
+        return _AsyncQuery(self._target.start_after(*args, **kwargs))
+    
+    def document(self, document_id=None):
+        return _AsyncDocument(self._target.document(document_id))
+    
+    async def get(self, transaction=None):
+        return await asyncio.to_thread(self._target.get)
+    
+    async def stream(self, transaction=None):
+        for doc in await self.get():
+            yield doc
+
+class _AsyncDocument:
+    def __init__(self, target):
+        self._target = target
+    
+    @property
+    def id(self):
+        return self._target.id
+    
+    def collection(self, collection_id):
+        return _AsyncQuery(self._target.collection(collection_id))
+    
+    async def get(self, field_paths=None, transaction=None):
+        return await asyncio.to_thread(self._target.get)
+
+class AsyncClient:
+    """ローカルエンジンを firestore.AsyncClient と同じ呼び出し方で使う（読み込みのみ）"""
+    
+    def __init__(self, client):
+        self._client = client
+    
+    def collection(self, path):
+        return _AsyncQuery(self._client.collection(path))
+    
+    def document(self, path):
+        return _AsyncDocument(self._client.document(path))
+    
+    async def get_all(self, references, field_paths=None, transaction=None):
+        targets = [ref._target for ref in references]
+        for doc in await asyncio.to_thread(lambda: list(self._client.get_all(targets))):
+            yield doc
+
+# STORAGE_BACKENDに応じたクライアントを作成（memory / sqlite）
+def create_client(backend, sqlite_path='local.db'):
+    if backend == 'memory':
+        return MemoryClient()
+    if backend == 'sqlite':
+        return SqliteClient(sqlite_path)
+    raise ValueError(f"Unknown storage backend: {backend}")
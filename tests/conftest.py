@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# app.py は読み込み時に環境変数を読むので、先にローカルのメモリのエンジンを指定しておく
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('MIRROR_ENABLED', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as admin_app  # noqa: E402
+import storage  # noqa: E402
+
+# テストごとに空のメモリのエンジンにつなぎ直す
+@pytest.fixture
+def admin():
+    admin_app.set_db(storage.MemoryClient())
+    admin_app._id_blocks.clear()
+    yield admin_app
+
+@pytest.fixture
+def client(admin):
+    return admin.app.test_client()
+
+@pytest.fixture
+def auth(client, admin):
+    token = client.post('/api/admin/login', json={'password': admin.ADMIN_PASSWORD}).get_json()['token']
+    return {'Authorization': f'Bearer {token}'}
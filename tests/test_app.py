@@ -0,0 +1,123 @@
+import pytest
+
+def test_tick_accepts_post_only(client, auth):
+    # 割り当てを書き込むので、GET（リンクの先読み・クローラー）では動かさない
+    assert client.get('/internal/tick', headers=auth).status_code == 405
+    
+    response = client.post('/internal/tick', headers=auth)
+    assert response.status_code == 200
+    assert 'assigned' in response.get_json()
+
+def test_init_db_retries_after_failure(admin, monkeypatch):
+    created = []
+    
+    def create_client(backend, path):
+        created.append(backend)
+        if len(created) == 1:
+            raise OSError('temporary failure')
+        return admin.storage.MemoryClient()
+    
+    monkeypatch.setattr(admin, 'db', None)
+    monkeypatch.setattr(admin, 'STORAGE_BACKEND', 'memory')
+    monkeypatch.setattr(admin.storage, 'create_client', create_client)
+    monkeypatch.setattr(admin, '_db_retry_at', 0)
+    
+    # 失敗したら待ち時間の間はやり直さず、過ぎたら接続し直す
+    assert admin.init_db() is None
+    assert admin.init_db() is None
+    assert created == ['memory']
+    
+    monkeypatch.setattr(admin, '_db_retry_at', 0)
+    assert admin.init_db() is not None
+    assert created == ['memory', 'memory']
+
+def test_metrics_requires_auth(client, auth, admin, monkeypatch):
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers=auth).status_code == 200
+    
+    # Prometheusからはスクレイプ用のトークンで読む
+    monkeypatch.setattr(admin, 'METRICS_TOKEN', 'scrape-token')
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'}).status_code == 200
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+# 読んだ後に同じドキュメントへ他の書き込みを入れて、コミットをAbortedにする
+def conflicting(admin, conflicts):
+    ref = admin.db.document('counters/group_number')
+    ref.set({'last': 0})
+    attempts = []
+    
+    def increment(transaction):
+        last = ref.get(transaction=transaction).to_dict()['last']
+        attempts.append(last)
+        if len(attempts) <= conflicts:
+            ref.set({'last': last + 100})
+        transaction.set(ref, {'last': last + 1})
+        return last + 1
+    return ref, attempts, increment
+
+def record_calls(admin, monkeypatch):
+    sleeps = []
+    recorded = []
+    monkeypatch.setattr(admin.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(admin.metrics, 'record_transaction',
+                        lambda name, conflicts, committed: recorded.append((name, conflicts, committed)))
+    return sleeps, recorded
+
+def test_run_transaction_retries_on_conflict(admin, monkeypatch):
+    sleeps, recorded = record_calls(admin, monkeypatch)
+    monkeypatch.setattr(admin, 'TRANSACTION_MAX_ATTEMPTS', 5)
+    ref, attempts, increment = conflicting(admin, conflicts=2)
+    
+    assert admin.run_transaction('test', increment) == 201
+    assert attempts == [0, 100, 200]
+    assert ref.get().to_dict() == {'last': 201}
+    assert recorded == [('test', 2, True)]
+    # 競合のたびに待つ（待ち時間は上限つきの指数バックオフ）
+    assert len(sleeps) == 2
+    assert all(0 <= delay <= admin.TRANSACTION_BACKOFF_MAX_SECONDS for delay in sleeps)
+
+def test_run_transaction_gives_up_after_the_limit(admin, monkeypatch):
+    sleeps, recorded = record_calls(admin, monkeypatch)
+    monkeypatch.setattr(admin, 'TRANSACTION_MAX_ATTEMPTS', 3)
+    ref, attempts, increment = conflicting(admin, conflicts=10)
+    
+    with pytest.raises(ValueError) as error:
+        admin.run_transaction('test', increment)
+    assert isinstance(error.value.__cause__, admin.storage.Aborted)
+    assert len(attempts) == 3
+    assert len(sleeps) == 2
+    assert recorded == [('test', 3, False)]
+    # コミットできなかった書き込みは残らない
+    assert ref.get().to_dict() == {'last': 300}
+
+def test_run_transaction_does_not_retry_other_errors(admin, monkeypatch):
+    sleeps, recorded = record_calls(admin, monkeypatch)
+    attempts = []
+    
+    def invalid(transaction):
+        attempts.append(1)
+        raise ValueError('Invalid group')
+    
+    with pytest.raises(ValueError, match='Invalid group'):
+        admin.run_transaction('test', invalid)
+    assert attempts == [1]
+    assert sleeps == [] and recorded == []
+
+def test_reservations_since_without_mirror(client, auth):
+    def create(res_type):
+        response = client.post('/api/admin/reservations/create', headers=auth,
+                               json={'type': res_type, 'count': 2, 'date': '2025-11-01'})
+        return response.get_json()['reservation_id']
+    
+    first = create('A')
+    full = client.get('/api/admin/reservations?date=2025-11-01', headers=auth).get_json()
+    assert [res['reservation_id'] for res in full['reservations']] == [first]
+    
+    # バージョンはコミット時刻のマイクロ秒なので、直後の書き込みだけが返る
+    second = create('C')
+    changes = client.get(f"/api/admin/reservations?date=2025-11-01&since={full['version']}", headers=auth).get_json()
+    assert [res['reservation_id'] for res in changes['reservations']] == [second]
+    assert changes['removed'] == [] and changes['version'] > full['version']
+    
+    again = client.get(f"/api/admin/reservations?date=2025-11-01&since={changes['version']}", headers=auth).get_json()
+    assert again['reservations'] == [] and again['version'] == changes['version']
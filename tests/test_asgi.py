@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('a2wsgi')
+
+import asgi  # noqa: E402
+
+# ASGIのアプリを1回呼び出して (ステータス, ヘッダー, 本文) を返す
+def call_asgi(path, query, headers):
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'query_string': query.encode(),
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        'http_version': '1.1',
+        'scheme': 'http',
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 1234)
+    }
+    messages = []
+    
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+    
+    async def send(message):
+        messages.append(message)
+    
+    asyncio.run(asgi.app(scope, receive, send))
+    start = messages[0]
+    body = b''.join(message.get('body', b'') for message in messages[1:])
+    return start['status'], {name.decode(): value.decode() for name, value in start['headers']}, body
+
+@pytest.fixture
+def seeded(admin, client, auth):
+    asgi._async_client = None
+    for res_type, count in [('A', 2), ('C', 3), ('A', 1), ('C', 4), ('B', 2)]:
+        date = '2025-11-02' if res_type == 'B' else '2025-11-01'
+        response = client.post('/api/admin/reservations/create', headers=auth,
+                               json={'type': res_type, 'count': count, 'date': date})
+        assert response.status_code == 200
+    assert client.post('/api/admin/call-group', headers=auth, json={'date': '2025-11-01', 'group_number': 1}).status_code == 200
+    yield
+    asgi._async_client = None
+
+@pytest.mark.parametrize('path, query', [
+    ('/api/admin/next-group', 'date=2025-11-01'),
+    ('/api/admin/next-group', 'date=2025-11-02'),
+    ('/api/admin/calling-group', 'date=2025-11-01'),
+    ('/api/admin/calling-group', 'date=2025-11-02'),
+    ('/api/admin/next-group', 'date=2030-01-01')
+])
+def test_direct_reads_match_flask(seeded, client, auth, path, query):
+    assert asgi.use_direct_reads()
+    expected = client.get(f'{path}?{query}', headers=auth)
+    
+    status, headers, body = call_asgi(path, query, auth)
+    
+    assert status == expected.status_code
+    assert asgi.flask_app.json.loads(body) == expected.get_json()
+    assert headers.get('cache-control') == expected.headers.get('Cache-Control')
+
+def test_next_group_with_priority_reservation_matches_flask(seeded, client, auth):
+    # 不在にすると優先予約になり、next-groupはFlaskのハンドラーで優先グループを作る
+    calling = client.get('/api/admin/calling-group?date=2025-11-01', headers=auth).get_json()
+    res_id = calling['reservations'][0]['reservation_id']
+    assert client.post(f'/api/admin/reservations/{res_id}/absent', headers=auth).status_code == 200
+    
+    status, _, body = call_asgi('/api/admin/next-group', 'date=2025-11-01', auth)
+    expected = client.get('/api/admin/next-group?date=2025-11-01', headers=auth)
+    
+    assert status == expected.status_code == 200
+    assert asgi.flask_app.json.loads(body) == expected.get_json()
+
+def test_direct_reads_require_auth(seeded):
+    status, _, body = call_asgi('/api/admin/next-group', 'date=2025-11-01', {})
+    
+    assert status == 401
+    assert asgi.flask_app.json.loads(body) == {'error': 'No token'}
+
+def test_other_routes_go_through_flask(seeded, client, auth):
+    status, _, body = call_asgi('/api/admin/reservations', 'date=2025-11-01', auth)
+    expected = client.get('/api/admin/reservations?date=2025-11-01', headers=auth).get_json()
+    
+    assert status == 200
+    assert asgi.flask_app.json.loads(body)['reservations'] == expected['reservations']
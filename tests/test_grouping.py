@@ -0,0 +1,129 @@
+import random
+
+import pytest
+
+import grouping
+
+CAPACITY = 4
+
+def test_parse_capacity():
+    capacity = grouping.parse_capacity('2025-11-01=4, 2025-11-02=6, 5')
+    
+    assert capacity('2025-11-01') == 4
+    assert capacity('2025-11-02') == 6
+    assert capacity('2025-11-03') == 5
+    assert grouping.parse_capacity(None)('2025-11-01') == grouping.DEFAULT_CAPACITY
+
+def test_first_fit_takes_the_lowest_number_with_room():
+    groups = [(1, 3), (3, 2), (5, 1)]
+    
+    assert grouping.get_strategy('first-fit').candidates(groups, 2, CAPACITY) == [3, 5]
+    assert grouping.get_strategy('first-fit').candidates(groups, 1, CAPACITY) == [1, 3, 5]
+    assert grouping.get_strategy('first-fit').candidates(groups, 4, CAPACITY) == []
+
+def test_best_fit_takes_the_fullest_group_that_fits():
+    groups = [(1, 1), (3, 2), (5, 2), (7, 4)]
+    
+    # 入れた後の空きが少ない順、同じなら番号順
+    assert grouping.get_strategy('best-fit').candidates(groups, 2, CAPACITY) == [3, 5, 1]
+    assert grouping.get_strategy('best-fit').candidates(groups, 3, CAPACITY) == [1]
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        grouping.get_strategy('worst-fit')
+
+@pytest.mark.parametrize('strategy, expected', [
+    ('first-fit', [['d', 'a'], ['b', 'c'], ['e', 'f']]),
+    ('best-fit', [['d', 'a'], ['b', 'c'], ['e', 'f']])
+])
+def test_pack_decreasing(strategy, expected):
+    items = [('a', 1), ('b', 2), ('c', 2), ('d', 3), ('e', 1), ('f', 1)]
+    
+    assert grouping.pack(items, CAPACITY, strategy) == expected
+
+def test_pack_best_fit_fills_the_tightest_group():
+    items = [('a', 2), ('b', 3), ('c', 1)]
+    
+    # 作成順のまま入れると、1人の予約はfirst-fitなら最初の2人、best-fitなら3人のグループに入る
+    assert grouping.pack(items, CAPACITY, 'first-fit', decreasing=False) == [['a', 'c'], ['b']]
+    assert grouping.pack(items, CAPACITY, 'best-fit', decreasing=False) == [['a'], ['b', 'c']]
+
+@pytest.mark.parametrize('strategy', list(grouping.STRATEGIES))
+@pytest.mark.parametrize('decreasing', [True, False])
+def test_pack_never_exceeds_capacity(strategy, decreasing):
+    rng = random.Random(1)
+    items = [(i, rng.choice([1, 1, 2, 2, 3, 4, 6])) for i in range(300)]
+    counts = dict(items)
+    
+    bins = grouping.pack(items, CAPACITY, strategy, decreasing)
+    
+    assert sorted(i for members in bins for i in members) == list(range(300))
+    for members in bins:
+        # 定員を超える予約は分けられないので1件だけのグループになる
+        load = sum(counts[i] for i in members)
+        assert load <= CAPACITY or len(members) == 1
+
+def test_simulate_keeps_reserved_and_walk_ins_apart():
+    reservations = [('09:00', True, 2), ('09:01', False, 2), ('09:02', True, 2), ('09:03', False, 3)]
+    
+    result = grouping.simulate(reservations, CAPACITY)
+    
+    assert result == {'groups': 3, 'people': 9, 'average_fill': 0.75, 'full_groups': 1, 'underfilled_groups': 2}
+
+def test_simulate_closes_called_groups():
+    reservations = [('09:00', False, 1), ('09:10', False, 1), ('09:20', False, 1)]
+    
+    # 呼び出しがなければ1つのグループにまとまる
+    assert grouping.simulate(reservations, CAPACITY)['groups'] == 1
+    # 呼び出されたグループには入らず、新しいグループを作る
+    result = grouping.simulate(reservations, CAPACITY, calls=['09:05', '09:15'])
+    assert result['groups'] == 3
+    assert result['average_fill'] == 0.25
+
+def test_simulate_calls_the_lowest_waiting_group():
+    reservations = [('09:00', True, 2), ('09:01', False, 2), ('09:10', True, 1), ('09:11', False, 1)]
+    
+    # 09:05の呼び出しで閉じるのはグループ1（事前予約）だけ
+    result = grouping.simulate(reservations, CAPACITY, 'best-fit', calls=['09:05'])
+    assert result['groups'] == 3
+    assert result['people'] == 6
+
+def test_pack_offline_places_everyone_by_kind():
+    reservations = [('09:00', True, 3), ('09:01', False, 2), ('09:02', True, 1), ('09:03', False, 2), ('09:04', True, 4)]
+    
+    # 事前予約 [4], [3, 1] と当日来店 [2, 2]
+    assert grouping.pack_offline(reservations, CAPACITY) == {
+        'groups': 3, 'people': 12, 'average_fill': 1.0, 'full_groups': 3, 'underfilled_groups': 0
+    }
+
+@pytest.mark.parametrize('strategy', list(grouping.STRATEGIES))
+def test_new_reservations_stay_within_capacity(admin, client, auth, monkeypatch, strategy):
+    monkeypatch.setattr(admin, 'GROUP_STRATEGY', grouping.get_strategy(strategy))
+    rng = random.Random(3)
+    for _ in range(40):
+        response = client.post('/api/admin/reservations/create', headers=auth,
+                               json={'type': rng.choice('AC'), 'count': rng.choice([1, 2, 3]), 'date': '2025-11-01'})
+        assert response.status_code == 200
+    
+    groups = admin.list_groups(admin.group_collection_for('2025-11-01'))
+    reservations = {res.id: res for res in admin.list_reservations('2025-11-01')}
+    assert sum(group.head_count for group in groups) == sum(res.count for res in reservations.values())
+    for group in groups:
+        assert group.head_count <= admin.group_capacity('2025-11-01')
+        assert group.head_count == sum(reservations[r_id].count for r_id in group.reservation)
+        # 奇数=事前予約, 偶数=当日来店
+        kinds = {admin.registry.kind(reservations[r_id].type) == 'reserved' for r_id in group.reservation}
+        assert kinds == {group.number % 2 == 1}
+
+def test_compare_grouping_says_when_groups_never_close(admin, client, auth):
+    for res_type, count in [('A', 2), ('A', 1), ('C', 3)]:
+        client.post('/api/admin/reservations/create', headers=auth, json={'type': res_type, 'count': count, 'date': '2025-11-01'})
+    runner = admin.app.test_cli_runner()
+    
+    output = runner.invoke(args=['compare-grouping', '--date', '2025-11-01']).output
+    assert 'no calls recorded, groups are never closed (optimistic)' in output
+    
+    client.post('/api/admin/call-group', headers=auth, json={'date': '2025-11-01', 'group_number': 1})
+    output = runner.invoke(args=['compare-grouping', '--date', '2025-11-01']).output
+    assert 'groups close at the 1 recorded call times' in output
+    assert 'first-fit (online)' in output and 'best-fit-decreasing (offline)' in output
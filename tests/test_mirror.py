@@ -0,0 +1,150 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from mirror import Mirror, ReservationRecord, is_waiting, time_of, version_of, waiting_key
+
+COLLECTION = 'group'
+
+def make_mirror():
+    return Mirror(lambda res_id, data: data.get('date'), [COLLECTION])
+
+def group_data(status=0, is_priority=False, members=None):
+    members = members if members is not None else {'A0001': 0}
+    return {
+        'status': status,
+        'is_priority': is_priority,
+        'reservation': list(members),
+        'head_count': len(members),
+        'members': {r_id: {'count': 1, 'status': member_status} for r_id, member_status in members.items()}
+    }
+
+def next_number(mirror):
+    group = mirror.next_waiting_group(COLLECTION)
+    return group.number if group is not None else None
+
+# キューを使わずに全グループを並べた場合の先頭
+def expected_number(mirror):
+    waiting = sorted((g for g in mirror.groups(COLLECTION) if is_waiting(g)), key=waiting_key)
+    return waiting[0].number if waiting else None
+
+def test_waiting_groups_in_number_order():
+    mirror = make_mirror()
+    for number in (5, 2, 9):
+        mirror.set_group(COLLECTION, number, group_data())
+    
+    assert next_number(mirror) == 2
+
+def test_priority_insert_goes_first():
+    mirror = make_mirror()
+    for number in (1, 2, 3):
+        mirror.set_group(COLLECTION, number, group_data())
+    
+    mirror.set_group(COLLECTION, 7, group_data(is_priority=True))
+    assert next_number(mirror) == 7
+    
+    mirror.set_group(COLLECTION, 4, group_data(is_priority=True))
+    assert next_number(mirror) == 4
+
+def test_status_changes_move_groups_out_and_back():
+    mirror = make_mirror()
+    for number in (1, 2, 3):
+        mirror.set_group(COLLECTION, number, group_data())
+    
+    # 呼び出し中・完了になったグループは並ばない
+    mirror.update_group(COLLECTION, 1, {'status': 1})
+    assert next_number(mirror) == 2
+    assert mirror.calling_group(COLLECTION).number == 1
+    mirror.update_group(COLLECTION, 2, {'status': 2})
+    assert next_number(mirror) == 3
+    
+    # 呼び出しを取り消すと元の位置に戻る
+    mirror.update_group(COLLECTION, 1, {'status': 0})
+    assert next_number(mirror) == 1
+    assert mirror.calling_group(COLLECTION) is None
+
+def test_member_status_and_priority_changes():
+    mirror = make_mirror()
+    mirror.set_group(COLLECTION, 1, group_data(members={'A0001': 0, 'A0002': 0}))
+    mirror.set_group(COLLECTION, 2, group_data())
+    
+    # 待機中のメンバーがいなくなったグループは飛ばす
+    mirror.update_group(COLLECTION, 1, {'members.A0001': {'count': 1, 'status': 1}})
+    assert next_number(mirror) == 1
+    mirror.update_group(COLLECTION, 1, {'members.A0002': {'count': 1, 'status': 2}})
+    assert next_number(mirror) == 2
+    
+    # 後から優先グループになると先頭に来る
+    mirror.update_group(COLLECTION, 1, {'members.A0002': {'count': 1, 'status': 0}})
+    mirror.update_group(COLLECTION, 2, {'is_priority': True})
+    assert next_number(mirror) == 2
+
+def test_legacy_group_without_summary_waits_while_it_has_reservations():
+    mirror = make_mirror()
+    mirror.set_group(COLLECTION, 3, {'status': 0, 'reservation': ['A0001']})
+    mirror.set_group(COLLECTION, 1, {'status': 0, 'reservation': []})
+    
+    assert next_number(mirror) == 3
+
+def test_removed_group_leaves_the_queue():
+    mirror = make_mirror()
+    mirror.set_group(COLLECTION, 1, group_data())
+    mirror.set_group(COLLECTION, 2, group_data())
+    
+    mirror._remove_group(COLLECTION, '1')
+    assert next_number(mirror) == 2
+    mirror._remove_group(COLLECTION, '2')
+    assert next_number(mirror) is None
+
+def test_queue_matches_full_sort_after_random_changes():
+    rng = random.Random(1)
+    mirror = make_mirror()
+    # 何度も変わると捨てたキーが溜まり、キューを作り直す
+    for _ in range(2000):
+        number = rng.randint(1, 40)
+        if mirror.group(COLLECTION, number) is None or rng.random() < 0.2:
+            mirror.set_group(COLLECTION, number, group_data(
+                status=rng.choice([0, 0, 1, 2]), is_priority=rng.random() < 0.2))
+        else:
+            mirror.update_group(COLLECTION, number, rng.choice([
+                {'status': rng.choice([0, 1, 2])},
+                {'is_priority': rng.random() < 0.5},
+                {'members.A0001': {'count': 1, 'status': rng.choice([0, 1])}}
+            ]))
+        assert next_number(mirror) == expected_number(mirror)
+    
+    assert len(mirror._waiting[COLLECTION]) <= 2 * len(mirror._waiting_keys[COLLECTION]) + 65
+
+@pytest.mark.parametrize('update_time', [
+    datetime(2025, 11, 1, 9, 0, 0, 0, timezone.utc),
+    datetime(2025, 11, 1, 9, 0, 0, 1, timezone.utc),
+    datetime(2025, 11, 1, 9, 0, 0, 999999, timezone.utc),
+    # timestamp() * 1000000 の浮動小数点の計算では1マイクロ秒小さくなる時刻
+    datetime.fromtimestamp(1090352934, timezone.utc) + timedelta(microseconds=935922),
+    datetime(2025, 11, 1, 18, 0, 0, 500000, timezone(timedelta(hours=9)))
+])
+def test_version_round_trips_at_microseconds(update_time):
+    version = version_of(update_time)
+    
+    assert time_of(version) == update_time
+    assert version_of(time_of(version)) == version
+    assert version % 1_000_000 == update_time.microsecond
+
+def test_versions_keep_the_order_of_close_commits():
+    first = datetime(2025, 11, 1, 9, 0, 0, 999999, timezone.utc)
+    second = first + timedelta(microseconds=1)
+    
+    assert version_of(second) - version_of(first) == 1
+    assert version_of(None) == 0
+
+def test_reservations_since_is_exclusive_at_the_same_microsecond():
+    mirror = make_mirror()
+    first = datetime(2025, 11, 1, 9, 0, 0, 100, timezone.utc)
+    mirror.set_reservation('A0001', {'date': '2025-11-01', 'status': 0}, first)
+    mirror.set_reservation('A0002', {'date': '2025-11-01', 'status': 0}, first + timedelta(microseconds=1))
+    
+    changed, removed, _ = mirror.reservations_since('2025-11-01', version_of(first))
+    assert [record.id for record in changed] == ['A0002']
+    assert removed == []
+    assert isinstance(changed[0], ReservationRecord)
@@ -0,0 +1,120 @@
+import gzip
+
+import pytest
+from werkzeug.http import parse_etags
+
+import payload
+
+ROWS = [
+    {'reservation_id': 'A0001', 'type': 'A', 'count': 2, 'time': None},
+    {'reservation_id': 'A0002', 'type': 'A', 'count': 1, 'time': None},
+    {'reservation_id': 'C0001', 'type': 'C', 'count': 3, 'time': '10:00', 'priority': True},
+    {'reservation_id': 'A0003', 'type': 'A', 'count': 4, 'time': '10:00'}
+]
+
+# columnar形式を行の一覧に戻す
+def from_columnar(result):
+    rows = []
+    for i in range(result['count']):
+        row = {}
+        for name in result['columns']:
+            value = result['data'][name][i]
+            if name in result['dictionary'] and value is not None:
+                value = result['dictionary'][name][value]
+            row[name] = value
+        rows.append(row)
+    return rows
+
+def test_columnar_uses_dictionary_for_repeated_strings():
+    result = payload.to_columnar(ROWS, ['reservation_id', 'type', 'count', 'time'])
+    
+    # 指定した列の後ろに、指定しなかったキーが付く
+    assert result['columns'] == ['reservation_id', 'type', 'count', 'time', 'priority']
+    assert result['count'] == 4
+    assert result['dictionary'] == {'type': ['A', 'C'], 'time': ['10:00']}
+    assert result['data']['type'] == [0, 0, 1, 0]
+    assert result['data']['time'] == [None, None, 0, 0]
+    # 種類の多い文字列・数値・真偽値はそのまま
+    assert result['data']['reservation_id'] == ['A0001', 'A0002', 'C0001', 'A0003']
+    assert result['data']['count'] == [2, 1, 3, 4]
+    assert result['data']['priority'] == [None, None, True, None]
+
+def test_columnar_round_trip():
+    result = payload.to_columnar(ROWS, ['reservation_id'])
+    
+    assert from_columnar(result) == [{name: row.get(name) for name in result['columns']} for row in ROWS]
+    assert payload.to_columnar([], ['reservation_id']) == {
+        'format': 'columnar', 'count': 0, 'columns': ['reservation_id'], 'data': {'reservation_id': []}, 'dictionary': {}
+    }
+
+def test_encoded_etag_and_matching_etag():
+    assert payload.encoded_etag('1-2-abc', None) == '1-2-abc'
+    assert payload.encoded_etag('1-2-abc', 'gzip') == '1-2-abc-gz'
+    assert payload.encoded_etag('1-2-abc', 'br') == '1-2-abc-br'
+    
+    assert payload.matching_etag(parse_etags('"1-2-abc"'), '1-2-abc') == '1-2-abc'
+    assert payload.matching_etag(parse_etags('"0-0-old", "1-2-abc-gz"'), '1-2-abc') == '1-2-abc-gz'
+    assert payload.matching_etag(parse_etags('"1-3-abc-gz"'), '1-2-abc') is None
+    assert payload.matching_etag(parse_etags(''), '1-2-abc') is None
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip', 'gzip'),
+    ('gzip;q=0', None),
+    ('identity', None),
+    ('', None),
+    ('deflate, gzip;q=0.5', 'gzip')
+])
+def test_choose_encoding_for_gzip(header, expected):
+    assert payload.choose_encoding(header) == expected
+
+# ミラーを使うとETagが付く（変更の連番とURLから作る）
+@pytest.fixture
+def mirrored(admin, client, auth, monkeypatch):
+    monkeypatch.setattr(admin, 'MIRROR_ENABLED', True)
+    monkeypatch.setattr(admin, '_mirror', None)
+    monkeypatch.setattr(admin, '_mirror_restarted_at', 0)
+    for i in range(30):
+        response = client.post('/api/admin/reservations/create', headers=auth,
+                               json={'type': 'AC'[i % 2], 'count': 1 + i % 4, 'date': '2025-11-01'})
+        assert response.status_code == 200
+    assert admin.get_mirror() is not None
+    yield admin
+    admin._mirror.stop()
+
+@pytest.mark.parametrize('query', ['date=2025-11-01', 'date=2025-11-01&format=columnar'])
+def test_list_with_and_without_gzip(mirrored, client, auth, query):
+    url = f'/api/admin/reservations?{query}'
+    plain = client.get(url, headers=dict(auth, **{'Accept-Encoding': 'identity'}))
+    compressed = client.get(url, headers=dict(auth, **{'Accept-Encoding': 'gzip'}))
+    
+    assert plain.status_code == compressed.status_code == 200
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in plain.headers['Vary'] and 'Accept-Encoding' in compressed.headers['Vary']
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+    
+    # 圧縮したレスポンスは別のETag
+    etag, _ = plain.get_etag()
+    assert compressed.get_etag() == (payload.encoded_etag(etag, 'gzip'), False)
+    
+    if 'columnar' in query:
+        result = plain.get_json()['reservations']
+        assert result['format'] == 'columnar' and result['count'] == 30
+        assert result['dictionary']['type'] == ['A', 'C']
+
+def test_not_modified_with_either_etag(mirrored, client, auth):
+    url = '/api/admin/reservations?date=2025-11-01&format=columnar'
+    gzip_headers = dict(auth, **{'Accept-Encoding': 'gzip'})
+    etag, _ = client.get(url, headers=auth).get_etag()
+    gzip_etag, _ = client.get(url, headers=gzip_headers).get_etag()
+    
+    for sent in (etag, gzip_etag):
+        response = client.get(url, headers=dict(gzip_headers, **{'If-None-Match': f'"{sent}"'}))
+        assert response.status_code == 304
+        assert response.get_etag() == (sent, False)
+    
+    # 予約が変わるとETagも変わる
+    client.post('/api/admin/reservations/create', headers=auth, json={'type': 'A', 'count': 1, 'date': '2025-11-01'})
+    response = client.get(url, headers=dict(gzip_headers, **{'If-None-Match': f'"{gzip_etag}"'}))
+    assert response.status_code == 200
+    assert response.get_etag()[0] != gzip_etag
@@ -0,0 +1,204 @@
+import threading
+
+import pytest
+
+import storage
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def engine(request, tmp_path):
+    client = storage.create_client(request.param, str(tmp_path / 'test.db'))
+    yield client
+    client.close()
+
+def snapshot_data(docs):
+    return [(doc.id, doc.to_dict()) for doc in docs]
+
+# メモリとSQLiteで同じ操作をして、読み込める内容を並べる
+def run_operations(client):
+    results = []
+    groups = client.collection('group')
+    
+    batch = client.batch()
+    for number, status, head_count in [(1, 0, 2), (2, 1, 4), (3, 0, 3), (4, 2, 1)]:
+        batch.set(groups.document(str(number)), {
+            'status': status,
+            'reservation': [f'A{number:04d}'],
+            'head_count': head_count,
+            'members': {f'A{number:04d}': {'count': head_count, 'status': 0}}
+        })
+    write_results = batch.commit()
+    results.append(len(write_results))
+    
+    # 変換値（Increment / ArrayUnion / ArrayRemove / DELETE_FIELD）とドット区切りのフィールド
+    groups.document('1').update({
+        'reservation': storage.ArrayUnion(['C0001', 'A0001']),
+        'head_count': storage.Increment(2),
+        'members.C0001': {'count': 2, 'status': 0}
+    })
+    groups.document('3').update({
+        'reservation': storage.ArrayRemove(['A0003']),
+        'head_count': storage.Increment(-3),
+        'members.A0003': storage.DELETE_FIELD
+    })
+    groups.document('4').set({'called_at': '10:00'}, merge=True)
+    results.append(snapshot_data(groups.order_by('__name__').get()))
+    
+    # 絞り込み・並び順・件数・続きから
+    results.append([doc.id for doc in groups.where('status', '==', 0).get()])
+    results.append([doc.id for doc in groups.where('head_count', '>=', 2).order_by('head_count', direction='DESCENDING').get()])
+    first = groups.order_by('head_count').limit(2).get()
+    results.append([doc.id for doc in first])
+    results.append([doc.id for doc in groups.order_by('head_count').start_after(first[-1]).get()])
+    results.append([doc.id for doc in groups.where('reservation', 'array_contains', 'C0001').get()])
+    results.append([doc.id for doc in groups.where('status', 'in', [1, 2]).get()])
+    
+    # 存在しないドキュメント・作成済みのドキュメント
+    results.append(client.document('group/9').get().exists)
+    with pytest.raises(storage.NotFound):
+        client.document('group/9').update({'status': 1})
+    with pytest.raises(storage.AlreadyExists):
+        client.document('group/1').create({'status': 0})
+    client.document('group/4').delete()
+    results.append([doc.id for doc in groups.get()])
+    
+    # get_allは渡した順に返す（存在しないものも含む）
+    results.append([(doc.id, doc.exists) for doc in client.get_all([groups.document('3'), groups.document('4'), groups.document('1')])])
+    return results
+
+def test_engines_return_the_same_results(tmp_path):
+    memory = storage.create_client('memory')
+    sqlite = storage.create_client('sqlite', str(tmp_path / 'same.db'))
+    
+    assert run_operations(memory) == run_operations(sqlite)
+
+def test_operations_results(engine):
+    results = run_operations(engine)
+    
+    assert results[0] == 4
+    group1 = dict(results[1])['1']
+    assert group1['reservation'] == ['A0001', 'C0001']
+    assert group1['head_count'] == 4
+    assert group1['members']['C0001'] == {'count': 2, 'status': 0}
+    group3 = dict(results[1])['3']
+    assert group3['reservation'] == [] and group3['head_count'] == 0 and 'A0003' not in group3['members']
+    assert dict(results[1])['4']['called_at'] == '10:00'
+    assert results[2] == ['1', '3']
+    assert results[3] == ['1', '2']
+    assert results[4] == ['3', '4']
+    assert results[5] == ['1', '2']
+    assert results[6] == ['1']
+    assert results[7] == ['2', '4']
+    assert results[8] is False
+    assert results[9] == ['1', '2', '3']
+    assert results[10] == [('3', True), ('4', False), ('1', True)]
+
+def test_sqlite_keeps_data_after_reopen(tmp_path):
+    path = str(tmp_path / 'reopen.db')
+    client = storage.create_client('sqlite', path)
+    expected = run_operations(client)[1]
+    client.close()
+    
+    reopened = storage.create_client('sqlite', path)
+    assert snapshot_data(reopened.collection('group').order_by('__name__').get()) == [
+        (doc_id, data) for doc_id, data in expected if doc_id != '4'
+    ]
+
+def test_transaction_retries_after_conflict(engine):
+    ref = engine.document('counters/group_number')
+    ref.set({'last': 1})
+    attempts = []
+    
+    def increment(transaction):
+        last = ref.get(transaction=transaction).to_dict()['last']
+        attempts.append(last)
+        if len(attempts) == 1:
+            # 読んだ後に他の書き込みがあるとコミットでAbortedになり、読み直してやり直す
+            ref.set({'last': 10})
+        transaction.set(ref, {'last': last + 1})
+        return last + 1
+    
+    transaction = engine.transaction()
+    assert storage.transactional(increment)(transaction) == 11
+    assert attempts == [1, 10]
+    assert ref.get().to_dict() == {'last': 11}
+    assert transaction.write_results[0].update_time == ref.get().update_time
+
+def test_transaction_gives_up_like_firestore(engine):
+    ref = engine.document('counters/group_number')
+    ref.set({'last': 1})
+    
+    def always_conflicts(transaction):
+        last = ref.get(transaction=transaction).to_dict()['last']
+        ref.set({'last': last + 100})
+        transaction.set(ref, {'last': last + 1})
+    
+    # firestore.transactionalと同じく、再試行回数を超えたら最後のAbortedを原因とするValueError
+    with pytest.raises(ValueError) as error:
+        storage.transactional(always_conflicts)(engine.transaction(max_attempts=3))
+    assert isinstance(error.value.__cause__, storage.Aborted)
+    assert ref.get().to_dict() == {'last': 301}
+
+def test_transaction_rolls_back_on_error(engine):
+    ref = engine.document('counters/group_number')
+    ref.set({'last': 1})
+    
+    def fails(transaction):
+        transaction.set(ref, {'last': 2})
+        raise RuntimeError('boom')
+    
+    with pytest.raises(RuntimeError):
+        storage.transactional(fails)(engine.transaction())
+    assert ref.get().to_dict() == {'last': 1}
+
+def test_concurrent_transactions_do_not_lose_updates(engine):
+    ref = engine.document('counters/group_number')
+    ref.set({'last': 0})
+    
+    def increment(transaction):
+        last = ref.get(transaction=transaction).to_dict()['last']
+        transaction.set(ref, {'last': last + 1})
+    
+    def worker():
+        for _ in range(20):
+            while True:
+                try:
+                    storage.transactional(increment)(engine.transaction(max_attempts=1))
+                    break
+                except ValueError:
+                    continue
+    
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ref.get().to_dict() == {'last': 80}
+
+def test_on_snapshot_reports_changes(engine):
+    seen = []
+    engine.collection('group').where('status', '==', 0).on_snapshot(
+        lambda docs, changes, read_time: seen.append([(change.type.name, change.document.id) for change in changes]))
+    
+    engine.document('group/1').set({'status': 0})
+    engine.document('group/1').update({'head_count': 1})
+    engine.document('group/1').update({'status': 1})
+    
+    assert seen == [[], [('ADDED', '1')], [('MODIFIED', '1')], [('REMOVED', '1')]]
+
+def test_client_version_pin():
+    low, high = storage.FIRESTORE_CLIENT_VERSIONS
+    storage.check_client_version(f'{low[0]}.{low[1]}.0')
+    with pytest.raises(ImportError):
+        storage.check_client_version(f'{high[0]}.{high[1]}.0')
+    with pytest.raises(ImportError):
+        storage.check_client_version('2.0.0')
+
+def test_firestore_transforms_match_what_the_engines_use():
+    pytest.importorskip('google.cloud.firestore_v1')
+    from google.cloud.firestore_v1 import transforms
+    
+    # ミラー（mirror._resolve）とローカルのエンジンが読む属性
+    assert storage.Increment is transforms.Increment
+    assert storage.Increment(3).value == 3
+    assert storage.ArrayUnion(['A0001']).values == ['A0001']
+    assert storage.ArrayRemove(['A0001']).values == ['A0001']